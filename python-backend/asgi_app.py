@@ -0,0 +1,331 @@
+import asyncio
+import itertools
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from werkzeug.formparser import FormDataParser
+from werkzeug.http import parse_options_header
+
+from chatbot_api import (
+    TRIAGE_MAX_BODY_BYTES, analyze_image, analyze_image_file, analyze_images_result, analyze_symptoms_result,
+    chat_event_stream, chat_result, health_result, observe_http_request, preload_state, search_result,
+    session_id_error, shutdown_worker_pools, start_triage_stream, triage_batch_format
+)
+from image_analysis import SPOOL_MAX_MEMORY, check_image_type, new_image_hasher
+from metrics import PROMETHEUS_CONTENT_TYPE, REGISTRY
+from validation import RequestRejected, body_too_large, check_content_length, parse_json_object, string_field
+
+MAX_BODY_BYTES = int(os.environ.get('CHATBOT_MAX_BODY_BYTES', 16 * 1024 * 1024))
+
+# Read here rather than from image_analysis: with a single worker, uvicorn imports this module in a
+# process that had already imported image_analysis before 'serve' set the variable
+PRELOAD_IMAGES = os.environ.get('CHATBOT_PRELOAD_IMAGES', '1') != '0'
+
+# Image decoding runs here so the event loop keeps serving text chats
+IMAGE_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('ASGI_IMAGE_THREADS', 0)) or os.cpu_count() or 1,
+    thread_name_prefix='image-analysis'
+)
+
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'content-type'),
+    (b'access-control-allow-methods', b'GET, POST, OPTIONS')
+]
+
+
+async def send_json(send, payload, status=200):
+    # Same serialization settings as Flask's jsonify
+    body = json.dumps(payload, sort_keys=True, ensure_ascii=True).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode())
+        ] + CORS_HEADERS
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_text(send, text, content_type, status=200):
+    body = text.encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', content_type.encode()),
+            (b'content-length', str(len(body)).encode())
+        ] + CORS_HEADERS
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_stream(send, chunks, content_type):
+    """Send each chunk of a streamed reply as its own body message; chunks may be an async iterator"""
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', content_type),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no')
+        ] + CORS_HEADERS
+    })
+    if hasattr(chunks, '__aiter__'):
+        async for chunk in chunks:
+            await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+    else:
+        for chunk in chunks:
+            await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def send_event_stream(send, events):
+    """Send each Server-Sent Event as its own body chunk"""
+    # Producing an event can load or save a SQLite session, so the generator runs in a thread
+    await send_stream(send, iter_in_thread(events, batch=1), b'text/event-stream; charset=utf-8')
+
+
+async def iter_in_thread(iterator, batch=256):
+    """Drain a blocking iterator from a worker thread, joining up to batch items per hop"""
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            items = await loop.run_in_executor(None, lambda: list(itertools.islice(iterator, batch)))
+            if not items:
+                return
+            yield ''.join(items)
+    finally:
+        # Also reached when the client disconnects; closing releases the spool and cancels queued work
+        await loop.run_in_executor(None, iterator.close)
+
+
+async def iter_body(receive, limit=MAX_BODY_BYTES):
+    """Yield request body chunks as they arrive, enforcing the size cap"""
+    received = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+        chunk = message.get('body', b'')
+        received += len(chunk)
+        if received > limit:
+            raise body_too_large(limit)
+        if chunk:
+            yield chunk
+        if not message.get('more_body'):
+            return
+
+
+async def read_json(receive):
+    return parse_json_object(b''.join([chunk async for chunk in iter_body(receive)]))
+
+
+async def spool_body(receive, limit=MAX_BODY_BYTES):
+    """Stream a request body into a spooled file, hashing it on the way in"""
+    hasher = new_image_hasher()
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    async for chunk in iter_body(receive, limit):
+        hasher.update(chunk)
+        spool.write(chunk)
+    spool.seek(0)
+    return spool, hasher.hexdigest()
+
+
+async def read_form(receive, content_type):
+    """Fields and files of a multipart body, parsed off the event loop by the parser Flask uses"""
+    spool, _ = await spool_body(receive)
+    with spool:
+        size = spool.seek(0, os.SEEK_END)
+        spool.seek(0)
+        mimetype, options = parse_options_header(content_type)
+        _, form, files = await asyncio.get_running_loop().run_in_executor(
+            None, FormDataParser().parse, spool, mimetype, size, options
+        )
+    return form, files
+
+
+def run_in_image_executor(func, *args):
+    return asyncio.get_running_loop().run_in_executor(IMAGE_EXECUTOR, func, *args)
+
+
+def request_content_type(scope):
+    """Full Content-Type header and its lowercased media type"""
+    content_type = dict(scope['headers']).get(b'content-type', b'').decode()
+    return content_type, content_type.split(';')[0].strip().lower()
+
+
+async def read_chat_request(scope, receive):
+    """Message, image analysis and session id from a JSON, multipart or raw image chat request"""
+    content_type, mimetype = request_content_type(scope)
+    image_analysis = None
+
+    if mimetype == 'multipart/form-data':
+        form, files = await read_form(receive, content_type)
+        user_message = form.get('message', '')
+        session_id = form.get('session_id')
+        upload = files.get('image')
+        if upload:
+            image_analysis = await run_in_image_executor(analyze_image_file, upload.stream)
+
+    elif mimetype.startswith('image/'):
+        # Raw image body, message in the query string
+        query = parse_qs(scope.get('query_string', b'').decode())
+        user_message = query.get('message', [''])[0]
+        session_id = query.get('session_id', [None])[0]
+        check_image_type(mimetype)
+        spool, digest = await spool_body(receive)
+        with spool:
+            image_analysis = await run_in_image_executor(analyze_image_file, spool, digest)
+    else:
+        data = await read_json(receive)
+        user_message = string_field(data, 'message')
+        session_id = string_field(data, 'session_id', None, nullable=True)
+        image_data = string_field(data, 'image', None, nullable=True)
+        if image_data:
+            image_analysis = await run_in_image_executor(analyze_image, image_data)
+
+    return user_message, image_analysis, session_id
+
+
+async def chat(scope, receive):
+    user_message, image_analysis, session_id = await read_chat_request(scope, receive)
+    error = session_id_error(session_id)
+    if error:
+        return error, 400
+
+    if b'text/event-stream' in dict(scope['headers']).get(b'accept', b''):
+        return chat_event_stream(user_message, image_analysis, session_id), 200
+
+    # Text-only routing is cheap enough to run on the event loop; a session may be stored in SQLite
+    if session_id is None:
+        return chat_result(user_message, image_analysis), 200
+    return await asyncio.to_thread(chat_result, user_message, image_analysis, session_id), 200
+
+
+async def chat_stream(scope, receive):
+    user_message, image_analysis, session_id = await read_chat_request(scope, receive)
+    error = session_id_error(session_id)
+    if error:
+        return error, 400
+    return chat_event_stream(user_message, image_analysis, session_id), 200
+
+
+async def analyze_images(scope, receive):
+    content_type, mimetype = request_content_type(scope)
+    if mimetype == 'multipart/form-data':
+        form, files = await read_form(receive, content_type)
+        user_message = form.get('message', '')
+        payloads = [upload.read() for upload in files.getlist('images')]
+    else:
+        data = await read_json(receive)
+        user_message = string_field(data, 'message')
+        payloads = data.get('images', [])
+    return await run_in_image_executor(analyze_images_result, user_message, payloads)
+
+
+async def analyze_symptoms(scope, receive):
+    return analyze_symptoms_result(await read_json(receive))
+
+
+async def analyze_symptoms_batch(scope, receive):
+    _, mimetype = request_content_type(scope)
+    field = parse_qs(scope.get('query_string', b'').decode()).get('field', ['message'])[0]
+    fmt = triage_batch_format(mimetype, field)
+
+    # Spooled in full first, as in the Flask app; triage itself runs off the event loop
+    spool, _ = await spool_body(receive, TRIAGE_MAX_BODY_BYTES)
+    lines = await asyncio.get_running_loop().run_in_executor(None, start_triage_stream, spool, fmt, field)
+    return iter_in_thread(lines), 200
+
+
+async def search(scope, receive):
+    return search_result(await read_json(receive))
+
+
+async def health(scope, receive):
+    return health_result(), 200
+
+
+async def metrics(scope, receive):
+    return REGISTRY.render(), 200
+
+
+ROUTES = {
+    ('POST', '/api/chat'): chat,
+    ('POST', '/api/chat/stream'): chat_stream,
+    ('POST', '/api/analyze-images'): analyze_images,
+    ('POST', '/api/analyze-symptoms'): analyze_symptoms,
+    ('POST', '/api/analyze-symptoms/batch'): analyze_symptoms_batch,
+    ('POST', '/api/search'): search,
+    ('GET', '/api/health'): health,
+    ('GET', '/api/metrics'): metrics
+}
+
+# Routes whose bodies are capped other than by MAX_BODY_BYTES
+BODY_LIMITS = {'/api/analyze-symptoms/batch': TRIAGE_MAX_BODY_BYTES}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Each uvicorn worker imports the app itself, so preloading here moves the cost off the first request
+            preload_state(PRELOAD_IMAGES)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            IMAGE_EXECUTOR.shutdown(wait=True)
+            shutdown_worker_pools()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI entry point"""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    method, path = scope['method'], scope['path']
+    if method == 'OPTIONS':
+        # CORS preflight, matching Flask-CORS's allow-all setup
+        await send({'type': 'http.response.start', 'status': 204, 'headers': CORS_HEADERS})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    started = time.perf_counter()
+    handler = ROUTES.get((method, path))
+    if handler is None:
+        allowed = any(route_path == path for _, route_path in ROUTES)
+        status = 405 if allowed else 404
+        await send_json(send, {'success': False, 'error': 'Method not allowed' if allowed else 'Not found'}, status)
+        observe_http_request('unmatched', method, status, time.perf_counter() - started)
+        return
+
+    try:
+        # A declared length over the cap is refused before any of the body is read
+        check_content_length(dict(scope['headers']).get(b'content-length'), BODY_LIMITS.get(path, MAX_BODY_BYTES))
+        body, status = await handler(scope, receive)
+    except RequestRejected as e:
+        body, status = e.result()
+    except Exception as e:
+        body, status = {'success': False, 'error': str(e)}, 500
+
+    # Same measurement point as the Flask app: the response is built, the body not yet sent
+    observe_http_request(path, method, status, time.perf_counter() - started)
+
+    if isinstance(body, dict):
+        await send_json(send, body, status)
+    elif isinstance(body, str):
+        await send_text(send, body, PROMETHEUS_CONTENT_TYPE, status)
+    elif hasattr(body, '__aiter__'):
+        await send_stream(send, body, b'application/x-ndjson')
+    else:
+        await send_event_stream(send, body)
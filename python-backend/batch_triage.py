@@ -0,0 +1,187 @@
+import csv
+import itertools
+import json
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Request content types read as JSON Lines; text/csv is the other accepted format
+JSONL_TYPES = ('application/x-ndjson', 'application/jsonl', 'application/json-lines', 'application/json')
+
+# Chunks queued per worker process; bounds memory however long the input is
+CHUNKS_IN_FLIGHT = 2
+
+# Server processes already run request threads, and a child forked from a threaded process can
+# deadlock on a lock another thread held; their workers come from a single-threaded fork server
+SERVER_START_METHOD = 'forkserver'
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def add_triage_command(commands, chunk_size=500):
+    """Register the 'triage' subcommand for offline batch processing of message logs"""
+    parser = commands.add_parser('triage', help='Triage a JSONL or CSV message log into JSONL results')
+    parser.add_argument('input', help="JSONL or CSV file ('-' reads stdin)")
+    parser.add_argument('--output', '-o', default='-', help="JSONL file to write ('-' prints)")
+    parser.add_argument('--format', choices=('jsonl', 'csv'), help='Input format (default: from the file extension)')
+    parser.add_argument('--field', default='message', help='JSON key or CSV column holding the message')
+    parser.add_argument('--workers', type=int, default=0, help='Worker processes (default: one per core)')
+    parser.add_argument('--chunk-size', type=int, default=chunk_size, help='Messages sent to a worker at a time')
+    return parser
+
+
+def path_format(path):
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def content_type_format(mimetype):
+    """'csv' or 'jsonl' for a request content type, None when it is neither"""
+    if mimetype == 'text/csv':
+        return 'csv'
+    return 'jsonl' if mimetype in JSONL_TYPES else None
+
+
+def read_records(lines, fmt='jsonl', field='message'):
+    """Lazily read (id, text, error) records from JSONL or CSV lines"""
+    # A CSV header without the field is refused up front rather than failing every row
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        if reader.fieldnames is None or field not in reader.fieldnames:
+            raise ValueError(f"CSV input has no '{field}' column")
+        return _csv_records(reader, field)
+    return _jsonl_records(lines, field)
+
+
+def _csv_records(reader, field):
+    for row_number, row in enumerate(reader, 1):
+        yield row.get('id') or row_number, row[field] or '', None
+
+
+def _jsonl_records(lines, field):
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            yield line_number, None, 'Invalid JSON'
+            continue
+
+        # A line is either a bare JSON string or an object holding the message under field
+        if isinstance(item, dict):
+            record_id, text = item.get('id', line_number), item.get(field)
+        else:
+            record_id, text = line_number, item
+        if isinstance(text, str):
+            yield record_id, text, None
+        else:
+            yield record_id, None, f'{field} must be a string'
+
+
+def iter_chunks(records, chunk_size):
+    iterator = iter(records)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def get_triage_pool(triage, workers, start_method=None):
+    """The worker pool for triage calls, created on first use (after any server fork) and reused by every batch"""
+    key = (workers, start_method)
+    with _pools_lock:
+        if key not in _pools:
+            context = None
+            if start_method:
+                context = multiprocessing.get_context(start_method)
+                if start_method == 'forkserver':
+                    # Workers fork from a server that has already imported the triage code
+                    context.set_forkserver_preload([triage.__module__])
+            _pools[key] = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        return _pools[key]
+
+
+def shutdown_triage_pools():
+    """Stop the triage workers, e.g. when a server worker exits"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_batch(records, triage, workers=1, chunk_size=500, start_method=None):
+    """Results of triage(chunk) for every chunk of records, in input order, across worker processes"""
+    chunks = iter_chunks(records, chunk_size)
+    if workers <= 1:
+        for chunk in chunks:
+            yield from triage(chunk)
+        return
+
+    # With the default fork start method, workers share the already loaded knowledge base copy-on-write
+    pool = get_triage_pool(triage, workers, start_method)
+    pending = deque()
+    try:
+        for chunk in chunks:
+            pending.append(pool.submit(triage, chunk))
+            if len(pending) >= workers * CHUNKS_IN_FLIGHT:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    except BrokenProcessPool:
+        # A worker died (e.g. out of memory); the next batch starts a fresh pool
+        with _pools_lock:
+            if _pools.get((workers, start_method)) is pool:
+                del _pools[(workers, start_method)]
+        raise
+    finally:
+        # The pool outlives this batch, so a stream closed early must not leave its chunks queued
+        for future in pending:
+            future.cancel()
+
+
+class Throughput:
+    """Messages and errors counted as results stream out, with a rate at most once per interval"""
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.last_report = self.started
+        self.messages = 0
+        self.errors = 0
+
+    def count(self, result):
+        """Count one result; returns True when a progress report is due"""
+        self.messages += 1
+        if 'error' in result:
+            self.errors += 1
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            return True
+        return False
+
+    def summary(self):
+        seconds = time.perf_counter() - self.started
+        return {
+            'messages': self.messages,
+            'errors': self.errors,
+            'seconds': round(seconds, 3),
+            'messages_per_second': round(self.messages / seconds, 1) if seconds else 0.0
+        }
+
+
+def write_batch(results, output, report=None, interval=1.0):
+    """Write results as JSON Lines as they arrive, calling report(summary) about once per interval"""
+    throughput = Throughput(interval)
+    for result in results:
+        output.write(json.dumps(result) + '\n')
+        if throughput.count(result) and report:
+            report(throughput.summary())
+    output.flush()
+    return throughput.summary()
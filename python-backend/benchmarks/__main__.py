@@ -0,0 +1,71 @@
+import argparse
+import json
+import sys
+
+from benchmarks.report import compare_reports, environment, write_report
+
+
+def parse_size(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Chatbot API benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    micro = commands.add_parser('micro', help='Time routing stages and image analysis in isolation')
+    micro.add_argument('--messages', type=int, default=200, help='Corpus size')
+    micro.add_argument('--image-sizes', type=parse_size, nargs='*', default=None,
+                       help='Image sizes as WIDTHxHEIGHT (default: 256x256 1024x768 2048x1536 4032x3024)')
+    micro.add_argument('--min-time', type=float, default=1.0, help='Seconds spent per benchmark')
+    micro.add_argument('--seed', type=int, default=0)
+    micro.add_argument('--output', '-o', default='-', help="JSON file to write ('-' prints)")
+
+    load = commands.add_parser('load', help='Replay a synthetic chat corpus through the Flask app')
+    load.add_argument('--messages', type=int, default=500, help='Corpus size (replayed in a loop)')
+    load.add_argument('--concurrency', type=int, default=4, help='Client threads')
+    load.add_argument('--duration', type=float, default=10.0, help='Seconds to run')
+    load.add_argument('--image-every', type=int, default=0, help='Attach an image to every Nth request')
+    load.add_argument('--image-size', type=parse_size, default=(1024, 768))
+    load.add_argument('--seed', type=int, default=0)
+    load.add_argument('--output', '-o', default='-', help="JSON file to write ('-' prints)")
+
+    compare = commands.add_parser('compare', help='Compare two result files')
+    compare.add_argument('baseline')
+    compare.add_argument('candidate')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.candidate) as f:
+            candidate = json.load(f)
+        print(f"{'metric':<60} {'baseline':>14} {'candidate':>14} {'change':>9}")
+        for key, before, after, change in compare_reports(baseline, candidate):
+            shown = f'{change:+.1%}' if change is not None else 'n/a'
+            print(f'{key:<60} {before:>14.4f} {after:>14.4f} {shown:>9}')
+        return 0
+
+    # Imported late so 'compare' works without loading the app
+    if args.command == 'micro':
+        from benchmarks.micro import IMAGE_SIZES, run_micro
+        results = run_micro(args.messages, args.image_sizes or IMAGE_SIZES, args.min_time, args.seed)
+    else:
+        from benchmarks.load import run_load_suite
+        results = run_load_suite(
+            args.messages, args.concurrency, args.duration, args.image_every, args.image_size, args.seed
+        )
+
+    write_report({
+        'benchmark': args.command,
+        'environment': environment(),
+        'options': {key: value for key, value in vars(args).items() if key not in ('command', 'output')},
+        'results': results
+    }, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+import base64
+import io
+import random
+
+import numpy as np
+from PIL import Image
+
+OPENERS = ['', 'Hi, ', 'Hello doctor, ', 'Quick question: ', 'Please help, ']
+SYMPTOM_TEMPLATES = [
+    'I have {a} and {b} on my arm',
+    'my skin shows {a}, {b} and some {c}',
+    'there is {a} since yesterday',
+    'what does {a} with {b} mean?'
+]
+QUESTION_TEMPLATES = [
+    'how do I deal with {a}?',
+    'is {a} something I should worry about',
+    'what helps against {a} at night'
+]
+FILLER = [
+    'what should I eat to stay healthy', 'can you explain blood pressure numbers',
+    'is coffee bad for me', 'how much sleep does an adult need', 'thanks for the advice'
+]
+SHORT = ['', 'hi', 'ok', '?']
+
+# Relative frequency of each routing branch in the generated traffic
+MESSAGE_MIX = {
+    'symptom_query': 2,
+    'condition': 4,
+    'health_keyword': 1,
+    'question_pattern': 3,
+    'general': 2,
+    'short': 1
+}
+
+# Mean skin-like colors the synthetic photos are drawn around
+IMAGE_TONES = {
+    'inflamed': (205, 95, 90),
+    'pink': (215, 160, 150),
+    'neutral': (190, 150, 125),
+    'pale': (235, 215, 200)
+}
+
+
+def generate_messages(kb, count, seed=0):
+    """Chat messages spread over every routing branch, built from the knowledge base's own terms"""
+    rng = random.Random(seed)
+    symptom_terms = sorted({term for condition in kb['conditions'].values() for term in condition['symptoms']})
+    pattern_terms = sorted({term for terms in kb['question_patterns'].values() for term in terms})
+
+    kinds = [kind for kind, weight in MESSAGE_MIX.items() for _ in range(weight)]
+    messages = []
+    for _ in range(count):
+        kind = rng.choice(kinds)
+        if kind == 'symptom_query':
+            text = f"I have a bad {rng.choice(list(kb['symptoms']))} today"
+        elif kind == 'condition':
+            a, b, c = rng.sample(symptom_terms, 3)
+            text = rng.choice(SYMPTOM_TEMPLATES).format(a=a, b=b, c=c)
+        elif kind == 'health_keyword':
+            text = f"I need help with my {rng.choice(list(kb['health_keywords']))}"
+        elif kind == 'question_pattern':
+            text = rng.choice(QUESTION_TEMPLATES).format(a=rng.choice(pattern_terms))
+        elif kind == 'general':
+            text = rng.choice(FILLER)
+        else:
+            messages.append({'kind': kind, 'message': rng.choice(SHORT)})
+            continue
+        messages.append({'kind': kind, 'message': rng.choice(OPENERS) + text})
+    return messages
+
+
+def generate_documents(kb, count, seed=0, vocabulary_size=30000):
+    """Retrieval documents mixing real symptom words with pseudo-words at Zipfian frequencies"""
+    rng = random.Random(seed)
+    real_words = sorted({
+        word for condition in kb['conditions'].values()
+        for term in condition['symptoms'] for word in term.split()
+    })
+    letters = 'etaoinshrdlcumwfgypbvkjxqz'
+    letter_weights = range(len(letters), 0, -1)
+    vocabulary = real_words + [
+        ''.join(rng.choices(letters, letter_weights, k=rng.randint(4, 10)))
+        for _ in range(vocabulary_size)
+    ]
+    rng.shuffle(vocabulary)
+    word_weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    return [
+        ('condition', f'synthetic_{idx}', ' '.join(rng.choices(vocabulary, word_weights, k=rng.randint(20, 60))))
+        for idx in range(count)
+    ]
+
+
+def generate_image(width, height, tone='inflamed', seed=0):
+    """A noisy photo-like image with a darker blotch, so JPEG sizes stay realistic"""
+    rng = np.random.default_rng(seed)
+    base = np.array(IMAGE_TONES[tone], dtype=np.float32)
+    pixels = base + rng.normal(0, 12, (height, width, 3)).astype(np.float32)
+
+    yy, xx = np.ogrid[:height, :width]
+    cy, cx = rng.uniform(0.3, 0.7) * height, rng.uniform(0.3, 0.7) * width
+    radius = max(4.0, min(width, height) * rng.uniform(0.08, 0.2))
+    blotch = np.exp(-((yy - cy) ** 2 + (xx - cx) ** 2) / (2 * radius ** 2))
+    pixels[..., 0] += 30 * blotch
+    pixels[..., 1:] -= 25 * blotch[..., None]
+
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'RGB')
+
+
+def generate_image_bytes(width, height, tone='inflamed', seed=0, quality=85):
+    buffer = io.BytesIO()
+    generate_image(width, height, tone, seed).save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def generate_data_url(width, height, tone='inflamed', seed=0):
+    encoded = base64.b64encode(generate_image_bytes(width, height, tone, seed)).decode()
+    return f'data:image/jpeg;base64,{encoded}'
+
+
+def generate_chat_requests(kb, count, image_every=0, image_size=(1024, 768), seed=0):
+    """JSON bodies for /api/chat; every image_every-th request carries a distinct data-URL image"""
+    tones = sorted(IMAGE_TONES)
+    requests = []
+    for idx, item in enumerate(generate_messages(kb, count, seed)):
+        body = {'message': item['message']}
+        kind = item['kind']
+        if image_every and idx % image_every == 0:
+            body['image'] = generate_data_url(*image_size, tone=tones[idx % len(tones)], seed=seed + idx)
+            kind = 'image'
+        requests.append({'kind': kind, 'body': body})
+    return requests
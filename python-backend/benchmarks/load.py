@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import Counter, defaultdict
+
+import chatbot_api
+import image_analysis
+from benchmarks.corpus import generate_chat_requests
+from benchmarks.report import peak_rss_bytes, summarize_latencies
+
+
+def cache_counters():
+    """Hit and miss counters of every cache a chat request can be answered from"""
+    near_duplicates = image_analysis.near_duplicate_stats() or {'hits': 0, 'misses': 0}
+    return {
+        'query_cache': chatbot_api.QUERY_CACHE.stats(),
+        'image_cache': chatbot_api.IMAGE_CACHE.stats(),
+        'near_duplicates': near_duplicates
+    }
+
+
+def cache_hit_rates(before, after):
+    """Hits, misses and hit rate of each cache between two cache_counters() snapshots"""
+    rates = {}
+    for name, counters in after.items():
+        hits = counters['hits'] - before[name]['hits']
+        misses = counters['misses'] - before[name]['misses']
+        rates[name] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else 0.0
+        }
+    return rates
+
+
+def clear_caches():
+    chatbot_api.QUERY_CACHE.clear()
+    chatbot_api.IMAGE_CACHE.clear()
+    image_analysis.clear_near_duplicates()
+
+
+def run_load(requests, concurrency=4, duration=10.0, warmup=20, endpoint='/api/chat'):
+    """Replay requests through the Flask test client from several threads and measure each call
+
+    The corpus repeats once it has been replayed, so later laps are mostly cache hits; the caches
+    are emptied after warm-up and their hit rates over the timed run are reported with the latencies
+    """
+    app = chatbot_api.app
+    chatbot_api.KNOWLEDGE_BASE.warm()
+
+    warm_client = app.test_client()
+    for item in requests[:warmup]:
+        warm_client.post(endpoint, json=item['body'])
+    clear_caches()
+
+    lock = threading.Lock()
+    latencies = defaultdict(list)
+    statuses = Counter()
+    cursor = [0]
+    deadline = time.perf_counter() + duration
+
+    def next_request():
+        with lock:
+            idx = cursor[0]
+            cursor[0] += 1
+        return requests[idx % len(requests)]
+
+    def worker():
+        client = app.test_client()
+        local_latencies = defaultdict(list)
+        local_statuses = Counter()
+        while time.perf_counter() < deadline:
+            item = next_request()
+            begin = time.perf_counter()
+            response = client.post(endpoint, json=item['body'])
+            response.get_data()
+            local_latencies[item['kind']].append(time.perf_counter() - begin)
+            local_statuses[response.status_code] += 1
+        with lock:
+            for kind, values in local_latencies.items():
+                latencies[kind].extend(values)
+            statuses.update(local_statuses)
+
+    rss_before = peak_rss_bytes()
+    counters_before = cache_counters()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    caches = cache_hit_rates(counters_before, cache_counters())
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        'endpoint': endpoint,
+        'concurrency': concurrency,
+        'duration_s': round(elapsed, 3),
+        'requests': len(all_latencies),
+        'throughput_rps': round(len(all_latencies) / elapsed, 2) if elapsed else 0.0,
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'latency': summarize_latencies(all_latencies),
+        'latency_by_kind': {kind: summarize_latencies(values) for kind, values in sorted(latencies.items())},
+        'caches': caches,
+        'peak_rss_bytes': peak_rss_bytes(),
+        'peak_rss_before_bytes': rss_before
+    }
+
+
+def run_load_suite(count=500, concurrency=4, duration=10.0, image_every=0, image_size=(1024, 768), seed=0):
+    kb = chatbot_api.KNOWLEDGE_BASE.current()
+    requests = generate_chat_requests(kb, count, image_every, image_size, seed)
+    return run_load(requests, concurrency, duration)
@@ -0,0 +1,114 @@
+import itertools
+import random
+import time
+
+import chatbot_api
+import image_analysis
+from benchmarks.corpus import generate_data_url, generate_documents, generate_messages
+from benchmarks.report import summarize_latencies
+from perceptual_hash import NearDuplicateIndex
+from retrieval import RetrievalIndex
+
+IMAGE_SIZES = [(256, 256), (1024, 768), (2048, 1536), (4032, 3024)]
+
+# Entries in the synthetic knowledge base the retrieval benchmark ranks against
+RETRIEVAL_DOCUMENTS = 10000
+
+# Messages scored per call in the batch condition ranking benchmark
+SYMPTOM_BATCH_SIZE = 1000
+
+# Random perceptual hashes in the near-duplicate lookup benchmark
+NEAR_DUPLICATE_ENTRIES = 65536
+
+
+def time_calls(func, args_cycle, min_time=1.0, min_calls=5, max_calls=100000, setup=None):
+    """Call func over a cycle of argument tuples until the time budget is spent; returns per-call seconds"""
+    timings = []
+    started = time.perf_counter()
+    for args in itertools.islice(itertools.cycle(args_cycle), max_calls):
+        if setup:
+            setup()
+        begin = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - begin)
+        if len(timings) >= min_calls and time.perf_counter() - started >= min_time:
+            break
+    return timings
+
+
+def clear_image_caches():
+    chatbot_api.IMAGE_CACHE.clear()
+    image_analysis.clear_near_duplicates()
+
+
+def run_micro(messages=200, image_sizes=IMAGE_SIZES, min_time=1.0, seed=0):
+    """Time each stage of the routing chain and image analysis in isolation"""
+    kb = chatbot_api.KNOWLEDGE_BASE.warm()
+    corpus = [item['message'] for item in generate_messages(kb, messages, seed)]
+    text_args = [(message,) for message in corpus]
+
+    # Warm-up so lazy imports and first-call costs stay out of the numbers
+    for message in corpus[:20]:
+        chatbot_api.generate_ai_response(message)
+
+    results = {
+        'analyze_symptoms': time_calls(chatbot_api.analyze_symptoms, text_args, min_time),
+        'analyze_symptom_query': time_calls(chatbot_api.analyze_symptom_query, text_args, min_time),
+        'generate_intelligent_response': time_calls(chatbot_api.generate_intelligent_response, text_args, min_time),
+        'generate_general_medical_response': time_calls(
+            chatbot_api.generate_general_medical_response, text_args, min_time
+        ),
+        # The corpus repeats, so the query cache is emptied before every call to time real routing;
+        # the cached figure is the same messages answered from the cache
+        'generate_ai_response': time_calls(
+            chatbot_api.generate_ai_response, text_args, min_time, setup=chatbot_api.QUERY_CACHE.clear
+        ),
+        'generate_ai_response_cached': time_calls(chatbot_api.generate_ai_response, text_args, min_time),
+        'retrieval_rank': time_calls(
+            kb.index('retrieval').rank, [(message, 'condition') for message in corpus], min_time
+        )
+    }
+
+    # Condition ranking one message at a time versus one matrix product per batch
+    symptom_index = kb.index('symptom_index')
+    term_sets = [chatbot_api.find_keywords(message, kb).get('condition_term', {}) for message in corpus]
+    batch = list(itertools.islice(itertools.cycle(term_sets), SYMPTOM_BATCH_SIZE))
+    results['symptom_rank'] = time_calls(symptom_index.rank, [(terms, 1) for terms in term_sets], min_time)
+    results[f'symptom_rank_batch_{SYMPTOM_BATCH_SIZE}'] = time_calls(symptom_index.rank_batch, [(batch, 1)], min_time)
+
+    started = time.perf_counter()
+    synthetic = RetrievalIndex(generate_documents(kb, RETRIEVAL_DOCUMENTS, seed))
+    build_seconds = time.perf_counter() - started
+    results[f'retrieval_rank_{RETRIEVAL_DOCUMENTS}'] = time_calls(
+        synthetic.rank, [(message, 'condition') for message in corpus], min_time
+    )
+
+    rng = random.Random(seed)
+    hashes = [rng.getrandbits(64) for _ in range(NEAR_DUPLICATE_ENTRIES)]
+    near_duplicates = NearDuplicateIndex(max_entries=NEAR_DUPLICATE_ENTRIES)
+    for image_hash in hashes:
+        near_duplicates.add(image_hash, None)
+    # Two bits off a stored hash, about what a recompressed re-upload looks like
+    queries = [(image_hash ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)),) for image_hash in hashes[:1000]]
+    results[f'near_duplicate_find_{NEAR_DUPLICATE_ENTRIES}'] = time_calls(near_duplicates.find, queries, min_time)
+
+    report = {name: summarize_latencies(timings) for name, timings in results.items()}
+    report[f'retrieval_build_{RETRIEVAL_DOCUMENTS}_s'] = round(build_seconds, 3)
+
+    for width, height in image_sizes:
+        image_args = [(generate_data_url(width, height, seed=seed + idx),) for idx in range(3)]
+        # Cold: both caches are emptied before every call so the full decode and measurement are timed;
+        # near-duplicate: only the exact-bytes cache is, so images are decoded and then reused by hash
+        cold = time_calls(chatbot_api.analyze_image, image_args, min_time, min_calls=3, setup=clear_image_caches)
+        near_duplicate = time_calls(
+            chatbot_api.analyze_image, image_args, min_time, min_calls=3, setup=chatbot_api.IMAGE_CACHE.clear
+        )
+        warm = time_calls(chatbot_api.analyze_image, image_args, min_time)
+        report[f'analyze_image_{width}x{height}'] = {
+            'payload_bytes': len(image_args[0][0]),
+            'cold': summarize_latencies(cold),
+            'near_duplicate': summarize_latencies(near_duplicate),
+            'cached': summarize_latencies(warm)
+        }
+
+    return report
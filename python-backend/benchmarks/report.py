@@ -0,0 +1,103 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def summarize_latencies(seconds):
+    """Latency distribution in milliseconds"""
+    values = sorted(seconds)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values) * 1000, 4),
+        'min_ms': round(values[0] * 1000, 4),
+        'p50_ms': round(percentile(values, 0.50) * 1000, 4),
+        'p95_ms': round(percentile(values, 0.95) * 1000, 4),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 4),
+        'max_ms': round(values[-1] * 1000, 4)
+    }
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process so far, or None where unsupported"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def git_revision():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=root, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root, capture_output=True, text=True
+        ).stdout.strip()
+        return {'commit': commit, 'dirty': bool(dirty)}
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'dirty': None}
+
+
+def environment():
+    """Where and on what a run happened, so results from different commits can be lined up"""
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'git': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def write_report(report, path):
+    if path in (None, '-'):
+        print(json.dumps(report, indent=2))
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'📊 Results written to {path}')
+
+
+def flatten(report, prefix=''):
+    """Numeric leaves of a report keyed by dotted path"""
+    flat = {}
+    for key, value in report.items():
+        path = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare_reports(old, new):
+    """Rows of (metric, old, new, relative change) for metrics present in both runs"""
+    old_flat = flatten(old.get('results', {}))
+    new_flat = flatten(new.get('results', {}))
+    rows = []
+    for key in sorted(old_flat.keys() & new_flat.keys()):
+        before, after = old_flat[key], new_flat[key]
+        change = (after - before) / before if before else None
+        rows.append((key, before, after, change))
+    return rows
@@ -1,1151 +1,965 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-import os
-import base64
+import argparse
 import io
+import os
 import json
 import re
+import sys
+import time
 from datetime import datetime
-from PIL import Image
-import numpy as np
+
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from batch_triage import (
+    SERVER_START_METHOD, Throughput, add_triage_command, content_type_format, iter_batch, path_format,
+    read_records, shutdown_triage_pools, write_batch
+)
+from image_analysis import (
+    IMAGE_PRELOAD, MEASUREMENT_VERSION, check_image_type, data_url_type, decode_data_url, hash_image_bytes,
+    hash_image_file, load_image_stack, measure_image, measure_images, near_duplicate_stats, new_image_hasher,
+    open_data_url, shutdown_image_pool, spool_stream
+)
+from frozen_kb import thaw
+from keyword_matcher import KeywordMatcher
+from knowledge_base import KnowledgeBase, open_source
+from metrics import (
+    HTTP_REQUEST_SECONDS, HTTP_REQUESTS, PROMETHEUS_CONTENT_TYPE, REGISTRY, ROUTE, stage_timer, timed_iter
+)
+from response_templates import ResponseTemplates
+from query_cache import QueryCache, query_key
+from result_cache import ResultCache
+from retrieval import RetrievalIndex
+from server import add_serve_command, serve, serve_asgi
+from session_store import new_session, open_session_store, valid_session_id
+from startup_profile import print_startup_profile
+from symptom_index import SymptomIndex
+from text_normalizer import TextNormalizer
+from validation import RequestRejected, body_too_large, parse_json_object, string_field
 
 app = Flask(__name__)
 CORS(app)
 
-# Medical Knowledge Base
-MEDICAL_KNOWLEDGE = {
-    'conditions': {
-        'mosquito_bite': {
-            'name': 'Mosquito Bite',
-            'confidence': 0.92,
-            'category': 'Dermatology',
-            'symptoms': ['itching', 'redness', 'small bump', 'swelling'],
-            'description': 'A mosquito bite is a small, itchy bump that appears after a mosquito feeds on blood.',
-            'treatment': [
-                'Apply cold compress to reduce swelling',
-                'Use over-the-counter anti-itch cream (Hydrocortisone 1%)',
-                'Take oral antihistamine (Diphenhydramine 25-50mg) if needed',
-                'Avoid scratching to prevent infection'
-            ],
-            'prevention': [
-                'Use EPA-registered insect repellent',
-                'Wear long sleeves and pants outdoors',
-                'Use mosquito nets when sleeping',
-                'Eliminate standing water near home'
-            ]
-        },
-        'acne': {
-            'name': 'Acne Vulgaris',
-            'confidence': 0.89,
-            'category': 'Dermatology',
-            'symptoms': ['pimples', 'blackheads', 'whiteheads', 'oily skin', 'inflammation'],
-            'description': 'Acne is a skin condition that occurs when hair follicles become clogged with oil and dead skin cells.',
-            'treatment': [
-                'Cleanse face twice daily with gentle cleanser',
-                'Apply Benzoyl Peroxide 2.5-5% topically',
-                'Use Salicylic Acid 0.5-2% for exfoliation',
-                'Consider Retinoid cream (Adapalene 0.1%)',
-                'Avoid touching or picking at lesions'
-            ],
-            'prevention': [
-                'Maintain consistent skincare routine',
-                'Remove makeup before bed',
-                'Avoid oil-based cosmetics',
-                'Change pillowcases regularly',
-                'Reduce stress levels'
-            ]
-        },
-        'rash': {
-            'name': 'Contact Dermatitis',
-            'confidence': 0.85,
-            'category': 'Dermatology',
-            'symptoms': ['redness', 'itching', 'burning', 'dry patches', 'bumps'],
-            'description': 'A rash caused by direct contact with a substance that causes an allergic reaction or irritation.',
-            'treatment': [
-                'Identify and avoid irritant/allergen',
-                'Apply cool, wet compresses for 15-20 minutes',
-                'Use Hydrocortisone cream 1% twice daily',
-                'Take oral antihistamine for severe itching',
-                'Keep affected area moisturized'
-            ],
-            'prevention': [
-                'Wear protective clothing when necessary',
-                'Use hypoallergenic products',
-                'Perform patch test before using new products',
-                'Avoid known allergens'
-            ]
-        },
-        'eczema': {
-            'name': 'Atopic Dermatitis (Eczema)',
-            'confidence': 0.91,
-            'category': 'Dermatology',
-            'symptoms': ['dry skin', 'itching', 'red patches', 'thickened skin', 'cracking'],
-            'description': 'A chronic condition that makes skin inflamed, itchy, and prone to developing rashes.',
-            'treatment': [
-                'Apply fragrance-free moisturizer 2-3 times daily',
-                'Use Hydrocortisone 1% or prescribed steroid cream',
-                'Take lukewarm (not hot) baths',
-                'Apply wet wraps for severe flare-ups',
-                'Consider Tacrolimus ointment for sensitive areas'
-            ],
-            'prevention': [
-                'Moisturize immediately after bathing',
-                'Use gentle, fragrance-free products',
-                'Avoid triggers (stress, allergens, irritants)',
-                'Maintain comfortable room temperature',
-                'Wear soft, breathable fabrics'
-            ]
-        },
-        'burn': {
-            'name': 'First-Degree Burn',
-            'confidence': 0.88,
-            'category': 'Emergency Medicine',
-            'symptoms': ['redness', 'pain', 'swelling', 'dry skin', 'no blisters'],
-            'description': 'A minor burn affecting only the outer layer of skin (epidermis).',
-            'treatment': [
-                '🚨 Cool burn with running water for 10-20 minutes',
-                'Apply Aloe Vera gel or burn cream',
-                'Cover with sterile, non-stick bandage',
-                'Take Ibuprofen 400-600mg for pain',
-                'Keep burn clean and dry'
-            ],
-            'prevention': [
-                'Use caution with hot objects and liquids',
-                'Test water temperature before use',
-                'Use sunscreen (SPF 30+) outdoors',
-                'Keep hot items away from edges'
-            ]
-        },
-        'bedbug_bite': {
-            'name': 'Bedbug Bite',
-            'confidence': 0.87,
-            'category': 'Dermatology',
-            'symptoms': ['red bumps', 'itching', 'burning', 'arranged in line', 'multiple bites'],
-            'description': 'Small, itchy bumps caused by bedbug feeding, often appearing in clusters or lines.',
-            'treatment': [
-                'Apply anti-itch cream (Hydrocortisone 1%)',
-                'Use oral antihistamine for severe itching',
-                'Apply cold compress to reduce swelling',
-                'Avoid scratching to prevent infection',
-                '🚨 Treat home for bedbugs immediately'
-            ],
-            'prevention': [
-                'Inspect hotel rooms before unpacking',
-                'Use protective mattress covers',
-                'Vacuum regularly and thoroughly',
-                'Seal cracks and crevices in walls',
-                'Wash bedding in hot water weekly'
-            ]
-        }
-    },
-    'symptoms': {
-        'headache': {
-            'name': 'Headache Assessment',
-            'category': 'Neurology',
-            'types': {
-                'tension': {
-                    'description': 'Tension-type headache - most common type',
-                    'symptoms': ['pressure around head', 'muscle tension', 'bilateral pain'],
-                    'treatment': [
-                        'Rest in quiet, dark room',
-                        'Ibuprofen 400-600mg or Acetaminophen 1000mg',
-                        'Apply cool or warm compress',
-                        'Gentle neck and shoulder stretches',
-                        'Stay hydrated (8-10 glasses water daily)'
-                    ]
-                },
-                'migraine': {
-                    'description': 'Migraine - severe, throbbing headache',
-                    'symptoms': ['one-sided pain', 'nausea', 'light sensitivity', 'aura'],
-                    'treatment': [
-                        '🚨 Take medication at first sign',
-                        'Rest in dark, quiet environment',
-                        'Cold compress on forehead',
-                        'Triptans (Sumatriptan) if prescribed',
-                        'Avoid triggers (certain foods, stress, bright lights)'
-                    ]
-                },
-                'cluster': {
-                    'description': 'Cluster headache - severe pain around one eye',
-                    'symptoms': ['severe pain', 'eye watering', 'nasal congestion', 'restlessness'],
-                    'treatment': [
-                        '🚨 Seek immediate medical attention',
-                        'Oxygen therapy (100% oxygen, 12-15 L/min)',
-                        'Sumatriptan injection if prescribed',
-                        'Avoid alcohol during cluster periods'
-                    ]
-                }
-            },
-            'red_flags': [
-                'Sudden, severe "thunderclap" headache',
-                'Headache with fever, stiff neck, or confusion',
-                'Vision changes or difficulty speaking',
-                'Weakness or numbness on one side',
-                'Headache after head injury'
-            ]
-        },
-        'fever': {
-            'name': 'Fever Management',
-            'category': 'General Medicine',
-            'ranges': {
-                'low_grade': {'range': '100.4-102°F (38-39°C)', 'severity': 'Mild'},
-                'moderate': {'range': '102-104°F (39-40°C)', 'severity': 'Moderate'},
-                'high': {'range': '>104°F (>40°C)', 'severity': 'High'}
-            },
-            'treatment': [
-                'Stay hydrated - drink plenty of fluids',
-                'Rest and avoid strenuous activity',
-                'Acetaminophen 650-1000mg every 6 hours',
-                'Ibuprofen 400-600mg every 6-8 hours',
-                'Lukewarm sponge bath (not cold)',
-                'Wear lightweight clothing',
-                'Monitor temperature every 2-4 hours'
-            ],
-            'red_flags': [
-                '🚨 Fever >103°F (39.4°C) lasting >3 days',
-                'Difficulty breathing or chest pain',
-                'Severe headache or stiff neck',
-                'Persistent vomiting or diarrhea',
-                'Confusion or altered mental state',
-                'Rash with fever',
-                'Infants <3 months with any fever'
-            ]
-        },
-        'cough': {
-            'name': 'Cough Assessment',
-            'category': 'Pulmonology',
-            'types': {
-                'dry': {
-                    'description': 'Non-productive cough without mucus',
-                    'causes': ['viral infection', 'allergies', 'irritants', 'asthma'],
-                    'treatment': [
-                        'Honey (1-2 teaspoons) for soothing',
-                        'Warm fluids (tea, broth)',
-                        'Use humidifier in room',
-                        'Cough drops or lozenges',
-                        'Avoid irritants (smoke, perfumes)'
-                    ]
-                },
-                'productive': {
-                    'description': 'Wet cough with mucus/phlegm',
-                    'causes': ['respiratory infection', 'bronchitis', 'pneumonia'],
-                    'treatment': [
-                        'Stay well hydrated (8-10 glasses water)',
-                        'Use expectorant (Guaifenesin 200-400mg)',
-                        'Steam inhalation 2-3 times daily',
-                        'Elevate head while sleeping',
-                        '🚨 See doctor if yellow/green mucus persists'
-                    ]
-                }
-            },
-            'red_flags': [
-                'Cough lasting >3 weeks',
-                'Coughing up blood',
-                'Shortness of breath or wheezing',
-                'High fever with productive cough',
-                'Chest pain when coughing',
-                'Thick, colored mucus (yellow/green/brown)'
-            ]
-        }
+# Bodies over this size get a 413 while they stream in; 'serve --max-body-bytes' overrides it
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('CHATBOT_MAX_BODY_BYTES', 16 * 1024 * 1024))
+
+# Refusals the endpoints let through to the JSON error handlers below
+REJECTIONS = (RequestRejected, RequestEntityTooLarge)
+
+# Largest ranked list /api/analyze-symptoms will return
+MAX_TOP_K = 20
+
+# Most images accepted by one /api/analyze-images request
+MAX_BATCH_IMAGES = 20
+
+# Batch triage: worker processes per request or CLI run, and messages handed to a worker at a time
+TRIAGE_WORKERS = int(os.environ.get('TRIAGE_WORKERS', 0)) or os.cpu_count() or 1
+TRIAGE_CHUNK_SIZE = int(os.environ.get('TRIAGE_CHUNK_SIZE', 500))
+
+# Batch triage bodies are whole message files and spool to disk, so they get their own, larger cap
+TRIAGE_MAX_BODY_BYTES = int(os.environ.get('TRIAGE_MAX_BODY_BYTES', 256 * 1024 * 1024))
+
+class ApiRequest(Request):
+    """Flask request whose body cap depends on the endpoint it was routed to"""
+    
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'analyze_symptoms_batch_endpoint':
+            return TRIAGE_MAX_BODY_BYTES
+        return super().max_content_length
+
+app.request_class = ApiRequest
+
+# Lowest cosine similarity at which retrieval alone picks a question category
+MIN_CATEGORY_SCORE = 0.075
+
+# Image analysis results keyed by a hash of the image bytes
+IMAGE_CACHE = ResultCache(
+    max_entries=int(os.environ.get('IMAGE_CACHE_MAX_ENTRIES', 256)),
+    max_bytes=int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 8 * 1024 * 1024)),
+    ttl=int(os.environ.get('IMAGE_CACHE_TTL', 3600)),
+    path=os.environ.get('IMAGE_CACHE_PATH') or None
+)
+
+# Routing results of text-only chats keyed by normalized query; 0 entries disables it
+QUERY_CACHE = QueryCache(ResultCache(
+    max_entries=int(os.environ.get('QUERY_CACHE_MAX_ENTRIES', 4096)),
+    max_bytes=int(os.environ.get('QUERY_CACHE_MAX_BYTES', 16 * 1024 * 1024)),
+    ttl=int(os.environ.get('QUERY_CACHE_TTL', 600))
+))
+
+# Conversations of clients that send a session_id; a SQLite path shares them between workers
+SESSIONS = open_session_store(
+    os.environ.get('SESSION_STORE_PATH') or None,
+    max_sessions=int(os.environ.get('SESSION_MAX_ENTRIES', 10000)),
+    ttl=int(os.environ.get('SESSION_TTL', 1800))
+)
+
+# What a session record keeps: the last few turns, each message truncated, and recent categories
+SESSION_MAX_TURNS = 6
+SESSION_MAX_MESSAGE_CHARS = 500
+SESSION_MAX_CATEGORIES = 5
+
+# Messages this short that find no topic of their own are read as follow-ups ("what about for kids?")
+FOLLOW_UP_MAX_WORDS = 8
+
+# Replies that only acknowledge the last answer; with nothing else in them they are not follow-ups
+ACKNOWLEDGEMENTS = frozenset("""
+alright appreciate awesome bye cool fine gotcha goodbye great k kk lol nice no nope ok okay perfect right
+sure thx ty understood yeah yep yes
+""".split())
+
+# Knowledge base content lives in files (JSON/YAML directory or SQLite) and reloads when edited
+KNOWLEDGE_PATH = os.environ.get(
+    'KNOWLEDGE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'knowledge')
+)
+
+# Artifact written by 'compile-kb': sections plus prebuilt indexes, memory-mapped at startup.
+# When it is missing, corrupt or of another format, KNOWLEDGE_PATH is used instead
+KNOWLEDGE_ARTIFACT = os.environ.get('KNOWLEDGE_ARTIFACT') or None
+
+# Bump whenever an index's to_data() layout changes; artifacts of another version get their indexes rebuilt
+KNOWLEDGE_INDEX_VERSION = 2
+
+KNOWLEDGE_BASE = KnowledgeBase(
+    open_source(KNOWLEDGE_PATH, KNOWLEDGE_ARTIFACT),
+    reload_interval=float(os.environ.get('KNOWLEDGE_RELOAD_INTERVAL', 2)),
+    index_version=KNOWLEDGE_INDEX_VERSION
+)
+
+def build_symptom_index(kb):
+    """Inverted index over the condition entries"""
+    return SymptomIndex(kb['conditions'])
+
+def load_symptom_index(kb, data):
+    return SymptomIndex.from_data(kb['conditions'], data)
+
+def load_keyword_matcher(kb, data):
+    return KeywordMatcher.from_data(data)
+
+def load_retrieval_index(kb, data):
+    return RetrievalIndex.from_data(data, kb.index('text_normalizer').content_tokens)
+
+def load_response_templates(kb, data):
+    return ResponseTemplates.from_data(data)
+
+def build_text_normalizer(kb):
+    """Tokenizer shared by messages and keyword patterns, with the lexicon's synonyms"""
+    # Knowledge bases without a lexicon section still get stemming and word boundaries
+    lexicon = kb['lexicon'] if 'lexicon' in kb.versions else {}
+    return TextNormalizer(lexicon.get('synonyms', {}), lexicon.get('keep', ()))
+
+def build_keyword_matcher(kb):
+    """Compile the knowledge base and keyword tables into a single matcher over normalized tokens"""
+    matcher = KeywordMatcher()
+    tokens = kb.index('text_normalizer').tokens
+    
+    for term in kb.index('symptom_index').terms:
+        matcher.add(tokens(term), 'condition_term', term)
+    
+    for symptom_key in kb['symptoms']:
+        matcher.add(tokens(symptom_key), 'symptom_query', symptom_key)
+    
+    for keyword in kb['health_keywords']:
+        matcher.add(tokens(keyword), 'health_keyword', keyword)
+    
+    for category, keywords in kb['question_patterns'].items():
+        for keyword in keywords:
+            matcher.add(tokens(keyword), 'question_pattern', category)
+    
+    return matcher.build()
+
+def build_routing_order(kb):
+    """Table order decides ties, so keep each key's position for ranking hits"""
+    return {
+        'symptom_query': {key: idx for idx, key in enumerate(kb['symptoms'])},
+        'health_keyword': {key: idx for idx, key in enumerate(kb['health_keywords'])},
+        'question_pattern': {key: idx for idx, key in enumerate(kb['question_patterns'])}
     }
-}
+
+def flatten_text(value):
+    """Every string inside a nested knowledge base entry"""
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, dict):
+        return [text for item in value.values() for text in flatten_text(item)]
+    if isinstance(value, list):
+        return [text for item in value for text in flatten_text(item)]
+    return []
+
+def build_retrieval_index(kb):
+    """One TF-IDF document per question category, condition, symptom topic and health keyword"""
+    documents = []
+    for category, keywords in kb['question_patterns'].items():
+        # Keywords only: names like 'mental_health' would tie 'health' questions to one category
+        documents.append(('category', category, ' '.join(keywords)))
+    for condition_key, condition in kb['conditions'].items():
+        documents.append(('condition', condition_key, ' '.join(
+            [condition_key.replace('_', ' '), condition['name'], condition['category'], condition['description']]
+            + list(condition['symptoms'])
+        )))
+    for symptom_key, symptom in kb['symptoms'].items():
+        documents.append(('symptom', symptom_key, ' '.join(
+            [symptom_key, symptom['name'], symptom['category']] + flatten_text(thaw(symptom.get('types', {})))
+        )))
+    for keyword, text in kb['health_keywords'].items():
+        # The heading is enough; the body is generic advice shared by every topic
+        documents.append(('health_keyword', keyword, keyword + ' ' + text.splitlines()[0]))
+    return RetrievalIndex(documents, kb.index('text_normalizer').content_tokens)
+
+def register_indexes(knowledge_base):
+    """Declare every derived index; the costly ones can also be loaded prebuilt from an artifact"""
+    knowledge_base.register_index('symptom_index', ['conditions'], build_symptom_index, load_symptom_index)
+    knowledge_base.register_index('text_normalizer', ['lexicon'], build_text_normalizer)
+    knowledge_base.register_index(
+        'keyword_matcher', ['conditions', 'symptoms', 'health_keywords', 'question_patterns', 'lexicon'],
+        build_keyword_matcher, load_keyword_matcher
+    )
+    knowledge_base.register_index(
+        'routing_order', ['symptoms', 'health_keywords', 'question_patterns'], build_routing_order
+    )
+    knowledge_base.register_index(
+        'retrieval', ['conditions', 'symptoms', 'health_keywords', 'question_patterns', 'lexicon'],
+        build_retrieval_index, load_retrieval_index
+    )
+    knowledge_base.register_index(
+        'response_templates',
+        ['conditions', 'symptoms', 'health_keywords', 'contextual_responses', 'messages'],
+        ResponseTemplates, load_response_templates
+    )
+
+register_indexes(KNOWLEDGE_BASE)
+
+# Metric children resolved once; the routing path is only tens of microseconds
+KEYWORD_MATCH_TIMER = stage_timer('keyword_match')
+ROUTING_TIMER = stage_timer('routing')
+RENDER_TIMER = stage_timer('render')
+ROUTE_BRANCHES = ('image', 'symptom_query', 'condition', 'health_keyword', 'intelligent_category', 'general', 'welcome')
+ROUTE_COUNTERS = {branch: ROUTE.labels(branch=branch) for branch in ROUTE_BRANCHES}
+
+def find_keywords(text, kb=None, tokens=None):
+    """Normalize a message once and run the compiled matcher over its tokens; returns all hits by group"""
+    kb = kb or KNOWLEDGE_BASE.current()
+    started = time.perf_counter()
+    if tokens is None:
+        tokens = kb.index('text_normalizer').tokens(text)
+    hits = kb.index('keyword_matcher').search(tokens)
+    KEYWORD_MATCH_TIMER.observe(time.perf_counter() - started)
+    return hits
 
 def analyze_image(image_data):
     """Analyze uploaded medical image using basic image processing"""
+    check_image_type(data_url_type(image_data))
+    
     try:
-        # Decode base64 image
-        image_bytes = base64.b64decode(image_data.split(',')[1])
-        image = Image.open(io.BytesIO(image_bytes))
-        
-        # Convert to RGB if necessary
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Get image properties
-        width, height = image.size
-        img_array = np.array(image)
-        
-        # Calculate color metrics
-        avg_red = np.mean(img_array[:,:,0])
-        avg_green = np.mean(img_array[:,:,1])
-        avg_blue = np.mean(img_array[:,:,2])
-        
-        # Simple heuristic analysis based on color
-        redness_score = avg_red - (avg_green + avg_blue) / 2
-        
-        # Determine likely condition based on color analysis
-        if redness_score > 30:
-            # High redness - likely inflammation
-            if avg_red > 150:
-                condition_key = 'burn'
-            else:
-                condition_key = 'rash'
-        elif redness_score > 15:
-            # Moderate redness
-            condition_key = 'mosquito_bite'
-        elif redness_score > 5:
-            condition_key = 'acne'
-        else:
-            # Low redness
-            condition_key = 'eczema'
-        
-        condition = MEDICAL_KNOWLEDGE['conditions'][condition_key]
-        
+        image_file = open_data_url(image_data)
+    except Exception as e:
         return {
-            'success': True,
-            'condition': condition,
-            'analysis': {
-                'width': width,
-                'height': height,
-                'redness_level': float(redness_score),
-                'color_profile': {
-                    'red': float(avg_red),
-                    'green': float(avg_green),
-                    'blue': float(avg_blue)
-                }
-            }
+            'success': False,
+            'error': str(e)
         }
+    
+    return analyze_image_file(image_file)
+
+def analyze_image_file(image_file, digest=None):
+    """Analyze an image file object, decoding it at reduced resolution"""
+    try:
+        if digest is None:
+            digest = hash_image_file(image_file)
+        
+        # Repeat uploads of the same bytes skip decoding entirely
+        cache_key = f'{MEASUREMENT_VERSION}:{digest}'
+        measurement = IMAGE_CACHE.get(cache_key)
+        if measurement is None:
+            measurement = measure_image(image_file)
+            IMAGE_CACHE.set(cache_key, measurement)
+        
+        return build_image_result(measurement)
+    except RequestRejected:
+        raise
     except Exception as e:
         return {
             'success': False,
             'error': str(e)
         }
 
-def analyze_symptoms(text):
-    """Analyze text for symptoms and match to conditions"""
-    text_lower = text.lower()
+def measure_image_payloads(payloads):
+    """Measure data URLs or raw bytes, pooling only the images not already cached"""
+    measurements = [None] * len(payloads)
+    misses = []
     
-    # Score each condition based on symptom matches
-    scores = {}
-    for condition_key, condition_data in MEDICAL_KNOWLEDGE['conditions'].items():
-        score = 0
-        matched_symptoms = []
-        
-        # Check symptoms
-        for symptom in condition_data['symptoms']:
-            if symptom in text_lower:
-                score += 3
-                matched_symptoms.append(symptom)
-        
-        # Check condition name
-        if condition_data['name'].lower() in text_lower:
-            score += 5
-        
-        # Check category
-        if condition_data['category'].lower() in text_lower:
-            score += 2
+    for idx, payload in enumerate(payloads):
+        try:
+            if isinstance(payload, str):
+                check_image_type(data_url_type(payload))
+                image_bytes = decode_data_url(payload)
+            elif isinstance(payload, bytes):
+                image_bytes = payload
+            else:
+                raise RequestRejected('image must be a base64 data URL', 422, 'invalid_image')
+        except RequestRejected as e:
+            measurements[idx] = {'error': str(e), 'reason': e.reason}
+            continue
+        except Exception as e:
+            measurements[idx] = {'error': str(e)}
+            continue
         
-        if score > 0:
-            scores[condition_key] = {
-                'score': score,
-                'condition': condition_data,
-                'matched_symptoms': matched_symptoms
-            }
+        cache_key = f'{MEASUREMENT_VERSION}:{hash_image_bytes(image_bytes)}'
+        measurements[idx] = IMAGE_CACHE.get(cache_key)
+        if measurements[idx] is None:
+            misses.append((idx, cache_key, image_bytes))
+    
+    fresh = measure_images([image_bytes for _, _, image_bytes in misses])
+    for (idx, cache_key, _), measurement in zip(misses, fresh):
+        if 'error' not in measurement:
+            IMAGE_CACHE.set(cache_key, measurement)
+        measurements[idx] = measurement
+    
+    return measurements
+
+def build_image_result(measurement, kb=None):
+    """Attach the knowledge base entry for an image measurement's condition"""
+    kb = kb or KNOWLEDGE_BASE.current()
+    return {
+        'success': True,
+        'condition_key': measurement['condition_key'],
+        'condition': thaw(kb['conditions'][measurement['condition_key']]),
+        'analysis': measurement['analysis']
+    }
+
+def rank_conditions(text, top_k=None, hits=None, kb=None):
+    """Rank conditions sharing a symptom, name or category term with the text"""
+    kb = kb or KNOWLEDGE_BASE.current()
+    if hits is None:
+        hits = find_keywords(text, kb)
+    
+    return kb.index('symptom_index').rank(hits.get('condition_term', {}), top_k)
+
+def rank_conditions_batch(texts, top_k=None, hits=None, kb=None):
+    """rank_conditions for many messages, scored together in one matrix product"""
+    kb = kb or KNOWLEDGE_BASE.current()
+    if hits is None:
+        hits = [find_keywords(text, kb) for text in texts]
+    
+    return kb.index('symptom_index').rank_batch([text_hits.get('condition_term', {}) for text_hits in hits], top_k)
+
+def analyze_symptoms(text, hits=None, kb=None):
+    """Analyze text for symptoms and match to conditions"""
+    matches = rank_conditions(text, 1, hits, kb)
     
     # Return best match
-    if scores:
-        best_match = max(scores.items(), key=lambda x: x[1]['score'])
-        return best_match[1]
+    if matches:
+        return matches[0]
     
     return None
 
-def analyze_symptom_query(text):
+def analyze_symptom_query(text, hits=None, kb=None):
     """Analyze symptom-specific queries (headache, fever, cough)"""
-    text_lower = text.lower()
+    kb = kb or KNOWLEDGE_BASE.current()
+    if hits is None:
+        hits = find_keywords(text, kb)
     
-    for symptom_key, symptom_data in MEDICAL_KNOWLEDGE['symptoms'].items():
-        if symptom_key in text_lower:
-            return {
-                'symptom': symptom_key,
-                'data': symptom_data
-            }
+    symptom_hits = hits.get('symptom_query')
+    if symptom_hits:
+        symptom_key = min(symptom_hits, key=kb.index('routing_order')['symptom_query'].get)
+        return {
+            'symptom': symptom_key,
+            'data': kb['symptoms'][symptom_key]
+        }
     
     return None
 
-def generate_intelligent_response(user_message):
-    """Generate intelligent response for any medical question using pattern matching and context"""
-    message_lower = user_message.lower()
-    
-    # Common medical question patterns
-    question_patterns = {
-        'pain': ['pain', 'ache', 'hurt', 'sore', 'discomfort', 'tender'],
-        'infection': ['infection', 'infected', 'pus', 'discharge', 'swollen', 'inflamed'],
-        'allergy': ['allergy', 'allergic', 'reaction', 'hives', 'sneezing', 'runny nose'],
-        'cold_flu': ['cold', 'flu', 'runny nose', 'congestion', 'sniffle'],
-        'digestive': ['stomach', 'nausea', 'vomit', 'diarrhea', 'constipation', 'bloat', 'indigestion'],
-        'respiratory': ['breath', 'breathing', 'wheezing', 'asthma', 'chest'],
-        'mental_health': ['anxiety', 'depression', 'stress', 'mental', 'worry', 'panic', 'sad'],
-        'injury': ['injury', 'wound', 'cut', 'bruise', 'sprain', 'fracture', 'broken'],
-        'pregnancy': ['pregnant', 'pregnancy', 'prenatal', 'expecting'],
-        'pediatric': ['baby', 'infant', 'child', 'kid', 'toddler'],
-        'chronic': ['diabetes', 'hypertension', 'arthritis', 'chronic'],
-        'preventive': ['prevent', 'prevention', 'avoid', 'protect', 'vaccine', 'vaccination']
+def triage_result(symptom_match, condition_match):
+    """Batch triage fields for a message's symptom-query and best condition matches"""
+    # Same precedence as the chat routing: a symptom question outranks a condition match
+    if symptom_match:
+        route = 'symptom_query'
+    elif condition_match:
+        route = 'condition'
+    else:
+        route = None
+    
+    return {
+        'route': route,
+        'symptom': symptom_match['symptom'] if symptom_match else None,
+        'condition_key': condition_match['condition_key'] if condition_match else None,
+        'condition': condition_match['condition']['name'] if condition_match else None,
+        'matched_symptoms': condition_match['matched_symptoms'] if condition_match else [],
+        'confidence': min(95, 65 + condition_match['score'] * 5) if condition_match else None
     }
+
+def triage_messages(texts, kb=None):
+    """Symptom and condition routing of many messages, without rendering replies"""
+    kb = kb or KNOWLEDGE_BASE.current()
+    hits = [find_keywords(text, kb) for text in texts]
+    condition_matches = rank_conditions_batch(texts, 1, hits, kb)
+    return [
+        triage_result(analyze_symptom_query(text, text_hits, kb), matches[0] if matches else None)
+        for text, text_hits, matches in zip(texts, hits, condition_matches)
+    ]
+
+def triage_records(records):
+    """Process pool entry point: triage a chunk of (id, text, error) records"""
+    triaged = iter(triage_messages([text for _, text, error in records if not error]))
+    return [
+        {'id': record_id, 'error': error} if error else {'id': record_id, **next(triaged)}
+        for record_id, _, error in records
+    ]
+
+def iter_triage_lines(body, fmt, field='message'):
+    """JSONL results for a spooled JSONL or CSV body, closing with a throughput summary line"""
+    with body:
+        lines = io.TextIOWrapper(body, encoding='utf-8', errors='replace', newline='')
+        throughput = Throughput()
+        records = read_records(lines, fmt, field)
+        for result in iter_batch(records, triage_records, TRIAGE_WORKERS, TRIAGE_CHUNK_SIZE, SERVER_START_METHOD):
+            throughput.count(result)
+            yield json.dumps(result) + '\n'
+        yield json.dumps({'summary': throughput.summary()}) + '\n'
+
+def start_triage_stream(body, fmt, field='message'):
+    """iter_triage_lines with its first line already produced, so a bad CSV header is refused before streaming"""
+    lines = iter_triage_lines(body, fmt, field)
+    try:
+        first = next(lines)
+    except ValueError as e:
+        body.close()
+        raise RequestRejected(str(e), 422, 'invalid_batch')
+    
+    # A generator rather than a chain, so closing it also closes the spool and cancels queued chunks
+    def stream():
+        yield first
+        yield from lines
+    
+    return stream()
+
+def triage_batch_format(mimetype, field):
+    """Input format of a batch triage body; refuses unknown content types and bad field names"""
+    fmt = content_type_format(mimetype)
+    if fmt is None:
+        raise RequestRejected(
+            'Send JSON Lines (application/x-ndjson) or CSV (text/csv)', 415, 'unsupported_media_type'
+        )
+    if not field:
+        raise RequestRejected('field must be a non-empty column or key name', 400, 'invalid_field')
+    return fmt
+
+def rank_question_categories(user_message, hits=None, kb=None):
+    """Question categories for the message, best first"""
+    kb = kb or KNOWLEDGE_BASE.current()
+    if hits is None:
+        hits = find_keywords(user_message, kb)
+    
+    retrieval = kb.index('retrieval')
+    
+    # Several categories mentioned: the one most similar to the whole message wins, table order breaks ties
+    detected_categories = hits.get('question_pattern')
+    if detected_categories:
+        scores = dict(retrieval.rank(user_message, 'category', top_k=len(retrieval)))
+        order = kb.index('routing_order')['question_pattern']
+        return sorted(detected_categories, key=lambda category: (-scores.get(category, 0.0), order[category]))
+    
+    # No keyword at all: fall back to the closest category if it is similar enough and shares a whole
+    # normalized token with the message; n-grams alone let 'painting' reach 'pain' and 'nothing' 'breathing'
+    ranked = retrieval.rank(user_message, 'category', 1, MIN_CATEGORY_SCORE, token_match=True)
+    return [category for category, _ in ranked]
+
+def detect_question_category(user_message, hits=None, kb=None):
+    """Best question category that has a dedicated response, or None"""
+    kb = kb or KNOWLEDGE_BASE.current()
+    contextual = kb.index('response_templates').contextual
+    for category in rank_question_categories(user_message, hits, kb):
+        if category in contextual:
+            return category
+    return None
+
+def generate_intelligent_response(user_message, hits=None, kb=None):
+    """Generate intelligent response for any medical question using pattern matching and context"""
+    kb = kb or KNOWLEDGE_BASE.current()
     
     # Detect question category
-    detected_categories = []
-    for category, keywords in question_patterns.items():
-        if any(keyword in message_lower for keyword in keywords):
-            detected_categories.append(category)
+    category = detect_question_category(user_message, hits, kb)
     
     # If specific categories detected, generate targeted response
-    if detected_categories:
-        return generate_contextual_response(user_message, detected_categories[0], message_lower)
+    if category:
+        return generate_contextual_response(user_message, category, kb)
     
     # General medical guidance for any question
-    return generate_general_medical_response(user_message, message_lower)
+    return generate_general_medical_response(user_message, kb)
 
-def generate_contextual_response(original_message, category, message_lower):
+def generate_contextual_response(original_message, category, kb=None):
     """Generate contextual medical response based on detected category"""
+    kb = kb or KNOWLEDGE_BASE.current()
     
-    responses = {
-        'pain': f"""## 💊 Pain Assessment & Management
-
-Based on your question: "{original_message}"
-
-### 🔍 Understanding Your Pain
-Pain is your body's signal that something needs attention. The location, severity, and duration are important factors.
-
-### 🩺 Recommended Actions:
-
-1. **Assess Severity**
-   - Mild (1-3/10): Usually manageable at home
-   - Moderate (4-6/10): May need medical evaluation
-   - Severe (7-10/10): Seek immediate medical care
-
-2. **Initial Management**
-   - Rest the affected area
-   - Apply ice for acute injuries (first 48 hours)
-   - Apply heat for chronic pain/muscle tension
-   - Over-the-counter pain relief: Ibuprofen 400-600mg or Acetaminophen 500-1000mg
-
-3. **When to See a Doctor**
-   - Pain persists >72 hours
-   - Pain worsens despite treatment
-   - Associated with fever, swelling, or redness
-   - Difficulty moving the affected area
-   - Numbness or tingling
-
-### 💡 Self-Care Tips:
-- Stay hydrated
-- Get adequate rest
-- Avoid activities that worsen pain
-- Practice gentle stretching (if appropriate)
-- Keep a pain diary to track patterns
-
-🚨 **Seek Emergency Care If:**
-- Chest pain or pressure
-- Severe abdominal pain
-- Pain after trauma/injury
-- Loss of consciousness
-- Difficulty breathing
-
-*This is general guidance. Please consult a healthcare provider for personalized assessment and treatment.*""",
-
-        'infection': f"""## 🦠 Infection Assessment & Care
-
-Based on your question: "{original_message}"
-
-### 🔍 Signs of Infection
-Infections occur when harmful bacteria, viruses, or fungi enter the body.
-
-### 🩺 Common Infection Symptoms:
-- Redness and warmth at the site
-- Swelling or inflammation
-- Pain or tenderness
-- Pus or discharge
-- Fever (>100.4°F / 38°C)
-- Fatigue or malaise
-
-### 💊 General Treatment Approach:
-
-1. **Clean the Area** (for skin infections)
-   - Wash with mild soap and water
-   - Pat dry gently
-   - Apply antibiotic ointment (Neosporin)
-   - Cover with clean bandage
-
-2. **Monitor Symptoms**
-   - Check temperature regularly
-   - Watch for spreading redness
-   - Note any worsening symptoms
-
-3. **Home Care**
-   - Rest and stay hydrated
-   - Take acetaminophen for fever/pain
-   - Keep the area clean and dry
-   - Avoid touching or scratching
-
-### 🚨 Seek Medical Care If:
-- Fever >102°F (38.9°C) or lasting >3 days
-- Red streaks spreading from the area
-- Increased swelling or severe pain
-- Pus or foul-smelling discharge
-- Signs of systemic infection (chills, confusion)
-- Wound not healing after 48-72 hours
-
-### 💡 Prevention:
-- Wash hands frequently
-- Keep wounds clean and covered
-- Don't share personal items
-- Practice good hygiene
-- Stay current with vaccinations
-
-*Antibiotics may be needed for bacterial infections. Consult a healthcare provider for proper diagnosis.*""",
-
-        'allergy': f"""## 🤧 Allergy Information & Management
-
-Based on your question: "{original_message}"
-
-### 🔍 Understanding Allergies
-Allergies occur when your immune system reacts to substances that are usually harmless.
-
-### 🩺 Common Allergy Symptoms:
-- Sneezing and runny nose
-- Itchy, watery eyes
-- Skin rashes or hives
-- Swelling
-- Difficulty breathing (severe cases)
-
-### 💊 Treatment Options:
-
-1. **Antihistamines** (Most Common)
-   - Loratadine (Claritin) 10mg once daily
-   - Cetirizine (Zyrtec) 10mg once daily
-   - Diphenhydramine (Benadryl) 25-50mg every 4-6 hours (causes drowsiness)
-
-2. **Nasal Sprays**
-   - Fluticasone (Flonase) - for nasal symptoms
-   - Saline nasal rinse - natural relief
-
-3. **Eye Drops**
-   - Artificial tears for relief
-   - Antihistamine eye drops
-
-4. **Skin Reactions**
-   - Hydrocortisone cream 1% for itching
-   - Cool compresses
-   - Oatmeal baths for widespread rash
-
-### 🛡️ Prevention Strategies:
-- Identify and avoid triggers
-- Keep windows closed during high pollen days
-- Use HEPA air filters
-- Shower after being outdoors
-- Wash bedding in hot water weekly
-- Remove shoes at door
-
-### 🚨 Emergency Signs (Call 911):
-- Difficulty breathing or wheezing
-- Swelling of face, lips, or throat
-- Rapid pulse
-- Dizziness or fainting
-- Severe rash covering large area
-- **These may indicate anaphylaxis**
-
-### 💡 Long-Term Management:
-- Consider allergy testing
-- Ask about immunotherapy (allergy shots)
-- Keep emergency antihistamines handy
-- Wear medical alert bracelet if severe allergies
-
-*For persistent or severe allergies, consult an allergist for comprehensive testing and treatment plan.*""",
-
-        'cold_flu': f"""## 🤒 Cold & Flu Care Guide
-
-Based on your question: "{original_message}"
-
-### 🔍 Cold vs. Flu
-
-**Common Cold:**
-- Gradual onset
-- Mild symptoms
-- Rarely causes fever
-- Mainly affects nose/throat
-
-**Influenza (Flu):**
-- Sudden onset
-- Severe symptoms
-- High fever common
-- Full-body aches
-
-### 💊 Treatment & Relief:
-
-1. **Symptom Relief**
-   - Acetaminophen or Ibuprofen for fever/aches
-   - Decongestants (Pseudoephedrine 30-60mg)
-   - Cough suppressant (Dextromethorphan)
-   - Throat lozenges
-
-2. **Home Remedies**
-   - Rest (7-9 hours sleep)
-   - Fluids (8-10 glasses water daily)
-   - Warm liquids (tea, soup, broth)
-   - Honey for cough (1-2 teaspoons)
-   - Humidifier for congestion
-   - Saltwater gargle for sore throat
-
-3. **Duration**
-   - Cold: 7-10 days
-   - Flu: 1-2 weeks
-
-### 🛡️ Prevention:
-- Wash hands frequently (20 seconds with soap)
-- Avoid touching face
-- Get annual flu vaccine
-- Stay away from sick people
-- Disinfect common surfaces
-- Cover coughs and sneezes
-
-### 🚨 See a Doctor If:
-- Fever >103°F (39.4°C) or lasting >3 days
-- Difficulty breathing or chest pain
-- Persistent vomiting
-- Severe headache or neck stiffness
-- Symptoms worsen after improving
-- High-risk groups: elderly, pregnant, chronic conditions
-
-### 💡 Recovery Tips:
-- Don't rush back to activities
-- Continue fluids even after feeling better
-- Gradually increase activity
-- Finish full course of any prescribed medications
-
-*Most colds/flu resolve without antibiotics. Antibiotics only work for bacterial infections, not viruses.*""",
-
-        'digestive': f"""## 🍽️ Digestive Health Guidance
-
-Based on your question: "{original_message}"
-
-### 🔍 Common Digestive Issues
-The digestive system can be affected by diet, stress, infections, and various conditions.
-
-### 🩺 Symptom Management:
-
-**For Nausea:**
-- Sip clear fluids slowly
-- Eat bland foods (BRAT diet: Bananas, Rice, Applesauce, Toast)
-- Ginger tea or ginger ale
-- Avoid strong odors
-- Take small, frequent meals
-
-**For Diarrhea:**
-- Stay hydrated (water, electrolyte drinks)
-- BRAT diet
-- Avoid dairy, caffeine, alcohol
-- Probiotics may help
-- Loperamide (Imodium) if needed
-
-**For Constipation:**
-- Increase fiber intake (25-30g daily)
-- Drink plenty of water
-- Exercise regularly
-- Prune juice
-- Consider fiber supplement (Psyllium)
-
-**For Heartburn/Indigestion:**
-- Antacids (Tums, Rolaids)
-- H2 blockers (Famotidine)
-- Avoid trigger foods (spicy, fatty, acidic)
-- Eat smaller meals
-- Don't lie down after eating
-- Elevate head of bed
-
-### 💊 Over-the-Counter Options:
-- **Nausea:** Bismuth subsalicylate (Pepto-Bismol)
-- **Gas/Bloating:** Simethicone (Gas-X)
-- **Acid:** Omeprazole (Prilosec)
-- **Constipation:** Polyethylene glycol (MiraLAX)
-
-### 🚨 Seek Medical Care If:
-- Severe abdominal pain
-- Blood in stool or vomit
-- Persistent vomiting (>24 hours)
-- Signs of dehydration (dark urine, dizziness)
-- High fever with digestive symptoms
-- Unexplained weight loss
-- Symptoms lasting >2 weeks
-
-### 💡 Digestive Health Tips:
-- Eat regular meals
-- Chew food thoroughly
-- Manage stress
-- Stay physically active
-- Limit alcohol and caffeine
-- Don't smoke
-
-*Digestive issues can have many causes. Consult a gastroenterologist for persistent or severe symptoms.*""",
-
-        'mental_health': f"""## 🧠 Mental Health Support & Resources
-
-Based on your question: "{original_message}"
-
-### 🔍 Understanding Mental Health
-Mental health is just as important as physical health. It's okay to ask for help.
-
-### 🩺 Common Mental Health Concerns:
-
-**Anxiety:**
-- Excessive worry
-- Restlessness
-- Difficulty concentrating
-- Sleep problems
-- Physical symptoms (rapid heart rate, sweating)
-
-**Depression:**
-- Persistent sad mood
-- Loss of interest in activities
-- Changes in appetite/sleep
-- Fatigue
-- Difficulty concentrating
-- Thoughts of self-harm
-
-### 💊 Self-Care Strategies:
-
-1. **Immediate Relief**
-   - Deep breathing (4-7-8 technique)
-   - Grounding exercises (5-4-3-2-1)
-   - Physical activity
-   - Talk to someone you trust
-   - Journal your thoughts
-
-2. **Daily Habits**
-   - Regular sleep schedule (7-9 hours)
-   - Exercise (30 minutes, most days)
-   - Healthy diet
-   - Limit alcohol and caffeine
-   - Practice mindfulness or meditation
-   - Stay connected with others
-
-3. **Professional Help**
-   - Therapy/Counseling (CBT, DBT)
-   - Medication (if prescribed by doctor)
-   - Support groups
-   - Crisis hotlines
-
-### 🆘 Crisis Resources:
-
-**National Suicide Prevention Lifeline:**
-📞 988 (call or text)
-Available 24/7, free and confidential
-
-**Crisis Text Line:**
-📱 Text "HELLO" to 741741
-
-**National Alliance on Mental Illness (NAMI):**
-📞 1-800-950-NAMI (6264)
-
-### 🚨 Seek Immediate Help If:
-- Thoughts of harming yourself or others
-- Hearing voices or seeing things
-- Unable to care for yourself
-- Severe panic attacks
-- Substance abuse crisis
-
-### 💡 Remember:
-- Mental health challenges are common
-- Treatment works
-- You're not alone
-- Asking for help is a sign of strength
-- Recovery is possible
-
-**Helpful Apps:**
-- Headspace (meditation)
-- Calm (relaxation)
-- Moodfit (mood tracking)
-- Sanvello (anxiety/depression)
-
-*Please reach out to a mental health professional for personalized care. Your mental health matters.*"""
-    }
+    # Only the selected category is rendered
+    templates = kb.index('response_templates')
+    if category in templates.contextual:
+        return ''.join(templates.iter_contextual(category, original_message))
     
-    # Return category-specific response or generate custom one
-    return responses.get(category, generate_general_medical_response(original_message, message_lower))
+    # No dedicated response for this category, generate custom one
+    return generate_general_medical_response(original_message, kb)
 
-def generate_general_medical_response(original_message, message_lower):
+def generate_general_medical_response(original_message, kb=None):
     """Generate intelligent response for any medical question"""
-    
-    # Extract key medical terms
-    medical_terms = []
-    common_terms = ['symptom', 'treatment', 'cure', 'help', 'what', 'how', 'why', 'when', 'should', 'can', 'need']
-    
-    words = message_lower.split()
-    medical_terms = [word for word in words if len(word) > 3 and word not in common_terms]
-    
-    response = f"""## 🩺 Medical Information Response
-
-Based on your question: **"{original_message}"**
-
-### 🔍 Understanding Your Concern
-
-Thank you for reaching out with your health question. While I can provide general medical information, please remember that this is educational guidance and not a substitute for professional medical advice.
-
-### 💊 General Recommendations:
-
-1. **Assess the Situation**
-   - Note when symptoms started
-   - Track severity and progression
-   - Identify any triggers or patterns
-   - Document any associated symptoms
-
-2. **First-Line Actions**
-   - Rest and adequate sleep
-   - Stay well hydrated (8-10 glasses of water)
-   - Maintain a balanced diet
-   - Avoid known irritants or triggers
-   - Practice good hygiene
-
-3. **Over-the-Counter Options** (if appropriate)
-   - Pain/Fever: Acetaminophen (Tylenol) 500-1000mg or Ibuprofen (Advil) 400-600mg
-   - Always follow package directions
-   - Check for medication interactions
-   - Consult pharmacist if unsure
-
-4. **Monitoring**
-   - Keep track of symptoms
-   - Note what makes it better or worse
-   - Watch for warning signs
-   - Take temperature if applicable
-
-### 🚨 When to Seek Medical Care:
-
-**See a doctor if you experience:**
-- Symptoms persisting >72 hours without improvement
-- Symptoms that worsen despite home treatment
-- High fever (>103°F / 39.4°C)
-- Severe pain or discomfort
-- Unusual or concerning symptoms
-- Symptoms affecting daily activities
-
-**Seek Emergency Care (Call 911) if:**
-- Difficulty breathing
-- Chest pain or pressure
-- Severe bleeding
-- Loss of consciousness
-- Sudden severe headache
-- Confusion or altered mental state
-- Signs of allergic reaction (face/throat swelling)
-
-### 💡 Additional Resources:
-
-**Telehealth Options:**
-- Virtual doctor consultations
-- Nurse advice lines (often provided by insurance)
-- Urgent care video visits
-
-**Preventive Care:**
-- Schedule regular check-ups
-- Stay current with vaccinations
-- Practice healthy lifestyle habits
-- Know your family medical history
-
-### 📋 Questions to Ask Your Doctor:
-1. What is causing my symptoms?
-2. What tests or exams do I need?
-3. What are my treatment options?
-4. Are there potential side effects?
-5. When should I follow up?
-6. What warning signs should I watch for?
-
-### 🔬 For More Specific Guidance:
-
-To provide more targeted advice, you can:
-- Upload an image (for visible conditions)
-- Describe specific symptoms in detail
-- Mention duration and severity
-- Note any treatments already tried
-
----
-
-*Remember: This AI provides general health information. For diagnosis and treatment, please consult with a qualified healthcare provider who can evaluate your specific situation.*
-
-**Would you like me to provide information about:**
-- Specific symptoms you're experiencing?
-- Treatment options for a condition?
-- When to seek emergency care?
-- Finding healthcare providers?
+    kb = kb or KNOWLEDGE_BASE.current()
+    return ''.join(kb.index('response_templates').iter_general(original_message))
 
-Feel free to ask any follow-up questions!"""
-    
-    return response
-
-def generate_ai_response(user_message, image_analysis=None):
-    """Generate intelligent medical response"""
-    message_lower = user_message.lower()
+def route_ai_response(user_message, image_analysis=None, kb=None, hits=None):
+    """Decide which branch answers the message; returns the branch name and what it was routed on"""
+    kb = kb or KNOWLEDGE_BASE.current()
     
     # Handle image analysis
     if image_analysis and image_analysis.get('success'):
-        condition = image_analysis['condition']
-        analysis = image_analysis['analysis']
-        
-        response = f"""## 🔬 Medical Image Analysis Complete
-
-**Condition Identified:** {condition['name']}  
-**Confidence Level:** {int(condition['confidence'] * 100)}%  
-**Medical Specialty:** {condition['category']}
-
-### 📊 Image Analysis Results
-- **Resolution:** {analysis['width']}x{analysis['height']} pixels
-- **Redness Level:** {analysis['redness_level']:.1f}/100
-- **Color Profile:** R:{analysis['color_profile']['red']:.0f} G:{analysis['color_profile']['green']:.0f} B:{analysis['color_profile']['blue']:.0f}
-
-### 📋 Clinical Assessment
-{condition['description']}
-
-### 💊 Recommended Treatment
-"""
-        for idx, treatment in enumerate(condition['treatment'], 1):
-            response += f"{idx}. {treatment}\n"
-        
-        response += f"\n### 🛡️ Prevention Measures\n"
-        for idx, prevention in enumerate(condition['prevention'], 1):
-            response += f"{idx}. {prevention}\n"
-        
-        if 'whenToSeek' in condition:
-            response += f"\n### 🚨 Seek Medical Attention If:\n"
-            for warning in condition['whenToSeek']:
-                response += f"- {warning}\n"
-        
-        response += "\n\n*⚕️ This analysis uses computer vision algorithms. Please consult a healthcare provider for definitive diagnosis.*"
-        return response
+        return 'image', image_analysis
+    
+    # One matcher pass feeds every routing stage below
+    if hits is None:
+        hits = find_keywords(user_message, kb)
     
     # Check for symptom analysis (headache, fever, cough)
-    symptom_match = analyze_symptom_query(user_message)
+    symptom_match = analyze_symptom_query(user_message, hits, kb)
     if symptom_match:
-        symptom_data = symptom_match['data']
-        symptom_key = symptom_match['symptom']
-        
-        response = f"""## {symptom_data['name']}
-**Medical Specialty:** {symptom_data['category']}
-
-"""
-        
-        if 'types' in symptom_data:
-            response += "### Types & Management\n\n"
-            for type_key, type_info in symptom_data['types'].items():
-                response += f"**{type_info['description']}**\n"
-                if 'symptoms' in type_info:
-                    response += "Symptoms: " + ", ".join(type_info['symptoms']) + "\n\n"
-                response += "Treatment:\n"
-                for idx, treatment in enumerate(type_info['treatment'], 1):
-                    response += f"{idx}. {treatment}\n"
-                response += "\n"
-        
-        if 'treatment' in symptom_data:
-            response += "### 💊 Treatment Recommendations\n"
-            for idx, treatment in enumerate(symptom_data['treatment'], 1):
-                response += f"{idx}. {treatment}\n"
-            response += "\n"
-        
-        if 'red_flags' in symptom_data:
-            response += "### 🚨 Warning Signs - Seek Immediate Medical Care\n"
-            for flag in symptom_data['red_flags']:
-                response += f"- {flag}\n"
-        
-        response += "\n\n*⚕️ This information is for educational purposes. Always consult a healthcare professional for personalized medical advice.*"
-        return response
+        return 'symptom_query', symptom_match['symptom']
     
     # Check for skin condition symptoms
-    condition_match = analyze_symptoms(user_message)
+    condition_match = analyze_symptoms(user_message, hits, kb)
     if condition_match:
-        condition = condition_match['condition']
-        matched = condition_match['matched_symptoms']
-        score = condition_match['score']
-        
-        response = f"""## 🔍 Symptom Analysis Results
-
-**Likely Condition:** {condition['name']}  
-**Match Confidence:** {min(95, 65 + score * 5)}%  
-**Medical Specialty:** {condition['category']}  
-**Symptoms Detected:** {', '.join(matched)}
-
-### 📋 Condition Overview
-{condition['description']}
-
-### 💊 Treatment Protocol
-"""
-        for idx, treatment in enumerate(condition['treatment'], 1):
-            response += f"{idx}. {treatment}\n"
-        
-        response += f"\n### 🛡️ Prevention Guidelines\n"
-        for idx, prevention in enumerate(condition['prevention'], 1):
-            response += f"{idx}. {prevention}\n"
-        
-        response += "\n\n*⚕️ AI-powered symptom analysis. Please consult a healthcare provider for proper diagnosis and treatment.*"
-        return response
+        return 'condition', condition_match
     
     # General health queries
-    health_keywords = {
-        'appointment': """## 📅 Book Medical Appointment
-
-I can help you schedule an appointment with a healthcare provider:
-
-1. **Primary Care Physician** - General health concerns
-2. **Specialist** - Specific conditions (Dermatology, Cardiology, etc.)
-3. **Urgent Care** - Non-emergency issues requiring prompt attention
-4. **Emergency Room** - Life-threatening conditions
-
-Please specify:
-- Type of appointment needed
-- Preferred date and time
-- Reason for visit
-- Any specific doctor or specialty
-
-Would you like me to connect you with our appointment booking system?""",
-        
-        'medication': """## 💊 Medication Information & Safety
-
-**Safe Medication Practices:**
+    keyword_hits = hits.get('health_keyword')
+    if keyword_hits:
+        return 'health_keyword', min(keyword_hits, key=kb.index('routing_order')['health_keyword'].get)
+    
+    # If no specific match found, use intelligent response generation
+    if user_message and len(user_message.strip()) > 3:
+        category = detect_question_category(user_message, hits, kb)
+        if category:
+            return 'intelligent_category', category
+        return 'general', None
+    
+    # Default welcome message for empty or very short queries
+    return 'welcome', None
+
+# These branches quote the user's message back, so only the routing decision is cached for them
+ECHO_BRANCHES = frozenset(['intelligent_category', 'general'])
+
+def cached_route(user_message, kb):
+    """Route a text-only message through the normalized query cache; returns (branch, detail, sections)"""
+    templates = kb.index('response_templates')
+    # The key is built from the same tokens and matcher hits routing uses, so a miss reuses them
+    normalizer = kb.index('text_normalizer')
+    tokens = normalizer.tokens(user_message)
+    hits = find_keywords(user_message, kb, tokens)
+    key = query_key(user_message, normalizer.without_stopwords(tokens), hits)
+    
+    entry = QUERY_CACHE.get(kb, key)
+    if entry is None:
+        branch, detail = route_ai_response(user_message, None, kb, hits)
+        if branch in ECHO_BRANCHES:
+            entry = {'branch': branch, 'detail': detail}
+            QUERY_CACHE.set(kb, key, entry, len(key) + 64)
+        else:
+            entry = {'branch': branch, 'sections': tuple(templates.iter_branch(branch, detail, user_message))}
+            QUERY_CACHE.set(kb, key, entry, len(key) + sum(len(section) for section in entry['sections']))
+    
+    # Fully rendered entries only need their branch; the detail is kept for echo branches
+    if 'sections' in entry:
+        return entry['branch'], None, entry['sections']
+    return entry['branch'], entry['detail'], templates.iter_branch(entry['branch'], entry['detail'], user_message)
+
+def is_follow_up(user_message, branch, session, kb):
+    """A short message with no topic of its own but something to ask, in a session that has a topic"""
+    if branch != 'general' or session['topic'] is None:
+        return False
+    normalizer = kb.index('text_normalizer')
+    tokens = normalizer.tokens(user_message)
+    if len(tokens) > FOLLOW_UP_MAX_WORDS:
+        return False
+    
+    # 'thanks' or 'ok got it' would otherwise repeat the previous answer
+    acknowledgements = {normalizer.stem(word) for word in ACKNOWLEDGEMENTS}
+    return any(token not in acknowledgements for token in normalizer.without_stopwords(tokens))
+
+def follow_up_route(user_message, topic, kb):
+    """Route a follow-up as if it had been asked together with the session's topic"""
+    if topic['branch'] == 'image' and topic['image']['condition_key'] in kb['conditions']:
+        # The stored measurement stands in for the image, so nothing is decoded again
+        return 'image', build_image_result(topic['image'], kb)
+    return route_ai_response(f"{topic['message']} {user_message}", None, kb)
+
+def remember_turn(session, user_message, branch, detail, follow_up=False):
+    """Record a turn in a session; follow-ups keep the topic they continued"""
+    message = user_message[:SESSION_MAX_MESSAGE_CHARS]
+    session['turns'] = (session['turns'] + [{
+        'message': message,
+        'branch': branch,
+        'follow_up': follow_up,
+        'timestamp': datetime.now().isoformat()
+    }])[-SESSION_MAX_TURNS:]
+    
+    if follow_up or branch in ('general', 'welcome'):
+        return
+    if branch == 'image':
+        session['topic'] = {
+            'branch': branch,
+            'message': message,
+            'image': {'condition_key': detail['condition_key'], 'analysis': detail['analysis']}
+        }
+    else:
+        session['topic'] = {'branch': branch, 'message': message}
+    if branch == 'intelligent_category':
+        others = [category for category in session['categories'] if category != detail]
+        session['categories'] = ([detail] + others)[:SESSION_MAX_CATEGORIES]
+
+def routed_sections(user_message, image_analysis, kb, session=None):
+    """Route a message, recording the routing time and the branch that answered"""
+    started = time.perf_counter()
+    if image_analysis is None and QUERY_CACHE.enabled:
+        branch, detail, sections = cached_route(user_message, kb)
+    else:
+        branch, detail = route_ai_response(user_message, image_analysis, kb)
+        sections = kb.index('response_templates').iter_branch(branch, detail, user_message)
+    
+    if session is not None:
+        follow_up = is_follow_up(user_message, branch, session, kb)
+        if follow_up:
+            topic = session['topic']
+            branch, detail = follow_up_route(user_message, topic, kb)
+            sections = kb.index('response_templates').iter_follow_up(topic['message'], branch, detail, user_message)
+        remember_turn(session, user_message, branch, detail, follow_up)
+    
+    ROUTING_TIMER.observe(time.perf_counter() - started)
+    ROUTE_COUNTERS[branch].inc()
+    return sections
+
+def iter_ai_response(user_message, image_analysis=None, kb=None, session=None):
+    """Yield the medical response section by section, routing before the first chunk"""
+    # Pin one snapshot so a reload mid-request cannot mix knowledge base versions
+    kb = kb or KNOWLEDGE_BASE.current()
+    sections = routed_sections(user_message, image_analysis, kb, session)
+    yield from timed_iter(sections, RENDER_TIMER)
+
+def generate_ai_response(user_message, image_analysis=None, kb=None, session=None):
+    """Generate intelligent medical response; a session record supplies and collects conversation context"""
+    kb = kb or KNOWLEDGE_BASE.current()
+    sections = routed_sections(user_message, image_analysis, kb, session)
+    
+    started = time.perf_counter()
+    response = ''.join(sections)
+    RENDER_TIMER.observe(time.perf_counter() - started)
+    return response
 
-1. **Always follow prescribed dosages**
-2. **Take with food or water as directed**
-3. **Complete full course of antibiotics**
-4. **Never share prescription medications**
-5. **Check expiration dates regularly**
+# Response bodies shared by the Flask routes and the ASGI app
 
-**Common Over-the-Counter Medications:**
+def session_id_error(session_id):
+    """Error body for a malformed session_id, or None when it is usable or absent"""
+    if session_id is None or valid_session_id(session_id):
+        return None
+    return {
+        'success': False,
+        'error': 'session_id must be 8-128 letters, digits, "-" or "_"'
+    }
 
-- **Pain Relief:** Ibuprofen (200-400mg), Acetaminophen (500-1000mg)
-- **Allergy:** Loratadine (10mg), Diphenhydramine (25-50mg)
-- **Digestive:** Antacids, Loperamide (as directed)
+def load_session(session_id):
+    """The stored record of a session, a fresh one for a new id, or None when there is no id"""
+    if session_id is None:
+        return None
+    return SESSIONS.get(session_id) or new_session()
 
-🚨 **Seek pharmacist advice if:**
-- Taking multiple medications
-- Pregnant or breastfeeding
-- Have chronic conditions
-- Experience side effects
+def chat_result(user_message, image_analysis=None, session_id=None):
+    """Body of a /api/chat reply"""
+    session = load_session(session_id)
+    
+    # Generate AI response
+    response = generate_ai_response(user_message, image_analysis, session=session)
+    
+    result = {
+        'success': True,
+        'response': response,
+        'timestamp': datetime.now().isoformat(),
+        'hasImageAnalysis': image_analysis is not None
+    }
+    if session is not None:
+        SESSIONS.save(session_id, session)
+        result['session_id'] = session_id
+    return result
+
+def sse_event(data, event=None):
+    """Encode one Server-Sent Event; JSON keeps the markdown's newlines out of the framing"""
+    prefix = f"event: {event}\n" if event else ''
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+def chat_event_stream(user_message, image_analysis=None, session_id=None):
+    """Server-Sent Events of a streamed /api/chat reply: start, one delta per section, done"""
+    start = {
+        'timestamp': datetime.now().isoformat(),
+        'hasImageAnalysis': image_analysis is not None
+    }
+    if session_id is not None:
+        start['session_id'] = session_id
+    yield sse_event(start, 'start')
+    
+    session = load_session(session_id)
+    try:
+        for section in iter_ai_response(user_message, image_analysis, session=session):
+            yield sse_event({'delta': section})
+    except Exception as e:
+        yield sse_event({
+            'success': False,
+            'error': str(e)
+        }, 'error')
+        return
+    finally:
+        # Routing has recorded the turn by the first delta, so a dropped stream still keeps it
+        if session is not None:
+            SESSIONS.save(session_id, session)
+    
+    yield sse_event({'success': True}, 'done')
 
-*Always consult your healthcare provider before starting new medications.*""",
-        
-        'emergency': """## 🚨 EMERGENCY MEDICAL GUIDANCE
-
-**Call 911 or Emergency Services IMMEDIATELY if experiencing:**
-
-- **Chest pain or pressure**
-- **Difficulty breathing or shortness of breath**
-- **Severe bleeding that won't stop**
-- **Loss of consciousness or severe confusion**
-- **Severe allergic reaction (anaphylaxis)**
-- **Stroke symptoms (FAST: Face drooping, Arm weakness, Speech difficulty, Time to call 911)**
-- **Severe burns or head injuries**
-- **Poisoning or overdose**
-- **Suicidal thoughts or behaviors**
-
-**For Non-Emergency Urgent Care:**
-- High fever (>103°F)
-- Moderate injuries
-- Severe cold/flu symptoms
-- Minor fractures
-- Severe allergic reactions (non-life-threatening)
-
-Stay calm, provide your location, and follow dispatcher instructions.""",
+def analyze_images_result(user_message, payloads):
+    """Body and status of a /api/analyze-images reply"""
+    if not isinstance(payloads, list) or not payloads:
+        return {
+            'success': False,
+            'error': 'images must be a non-empty list'
+        }, 400
+    
+    if len(payloads) > MAX_BATCH_IMAGES:
+        return {
+            'success': False,
+            'error': f'At most {MAX_BATCH_IMAGES} images can be analyzed per request'
+        }, 400
+    
+    kb = KNOWLEDGE_BASE.current()
+    results = []
+    for measurement in measure_image_payloads(payloads):
+        if 'error' in measurement:
+            result = {
+                'success': False,
+                'error': measurement['error']
+            }
+            if 'reason' in measurement:
+                result['reason'] = measurement['reason']
+            results.append(result)
+            continue
         
-        'wellness': """## 🌟 Health & Wellness Tips
-
-**Daily Habits for Optimal Health:**
-
-### 🏃 Physical Activity
-- 150 minutes moderate exercise weekly
-- Strength training 2-3 times per week
-- Daily stretching for flexibility
-
-### 🥗 Nutrition
-- Eat 5 servings of fruits/vegetables daily
-- Choose whole grains over refined
-- Stay hydrated (8-10 glasses water)
-- Limit processed foods and added sugars
-
-### 😴 Sleep Hygiene
-- 7-9 hours of quality sleep nightly
-- Consistent sleep schedule
-- Avoid screens 1 hour before bed
-- Keep bedroom cool and dark
-
-### 🧘 Mental Health
-- Practice stress management techniques
-- Maintain social connections
-- Seek help when needed
-- Regular relaxation or meditation
-
-### 🏥 Preventive Care
-- Annual physical examinations
-- Regular dental check-ups
-- Stay up-to-date on vaccinations
-- Skin cancer screenings
-
-*Small, consistent changes lead to lasting health improvements.*"""
-    }
+        image_analysis = build_image_result(measurement, kb)
+        image_analysis['response'] = generate_ai_response(user_message, image_analysis, kb)
+        results.append(image_analysis)
     
-    for keyword, response in health_keywords.items():
-        if keyword in message_lower:
-            return response
+    return {
+        'success': True,
+        'results': results,
+        'analyzed': sum(1 for result in results if result['success']),
+        'timestamp': datetime.now().isoformat()
+    }, 200
+
+def analyze_symptoms_result(data):
+    """Body and status of a /api/analyze-symptoms reply"""
+    symptoms_text = string_field(data, 'symptoms')
     
-    # If no specific match found, use intelligent response generation
-    if user_message and len(user_message.strip()) > 3:
-        return generate_intelligent_response(user_message)
+    top_k = data.get('top_k', 1)
+    if isinstance(top_k, bool) or not isinstance(top_k, int) or not 1 <= top_k <= MAX_TOP_K:
+        return {
+            'success': False,
+            'error': f'top_k must be an integer between 1 and {MAX_TOP_K}'
+        }, 400
     
-    # Default welcome message for empty or very short queries
-    return """## 👋 Welcome to AI Medical Assistant
+    matches = rank_conditions(symptoms_text, top_k)
+    
+    if matches:
+        result = matches[0]
+        return {
+            'success': True,
+            'condition': thaw(result['condition']),
+            'matched_symptoms': result['matched_symptoms'],
+            'confidence': min(95, 65 + result['score'] * 5),
+            'matches': [{
+                'condition_key': match['condition_key'],
+                'condition': thaw(match['condition']),
+                'matched_symptoms': match['matched_symptoms'],
+                'score': match['score'],
+                'confidence': min(95, 65 + match['score'] * 5)
+            } for match in matches]
+        }, 200
+    
+    return {
+        'success': False,
+        'message': 'No matching conditions found'
+    }, 200
+
+def search_result(data):
+    """Body and status of a /api/search reply"""
+    query = data.get('query', '')
+    if not isinstance(query, str) or not query.strip():
+        return {
+            'success': False,
+            'error': 'query must be a non-empty string'
+        }, 400
+    
+    top_k = data.get('top_k', 5)
+    if isinstance(top_k, bool) or not isinstance(top_k, int) or not 1 <= top_k <= MAX_TOP_K:
+        return {
+            'success': False,
+            'error': f'top_k must be an integer between 1 and {MAX_TOP_K}'
+        }, 400
+    
+    results = KNOWLEDGE_BASE.current().index('retrieval').search(query, top_k)
+    return {
+        'success': True,
+        'query': query,
+        'results': {
+            kind: [{'key': key, 'score': score} for key, score in ranked]
+            for kind, ranked in results.items()
+        }
+    }, 200
 
-I'm here to help you with **ANY medical question**!
+def health_result():
+    """Body of a /api/health reply"""
+    return {
+        'status': 'healthy',
+        'message': 'AI Medical Chatbot API is running',
+        'timestamp': datetime.now().isoformat(),
+        'knowledge_base': KNOWLEDGE_BASE.current().summary(),
+        'image_cache': IMAGE_CACHE.stats(),
+        'near_duplicates': near_duplicate_stats(),
+        'query_cache': QUERY_CACHE.stats(),
+        'sessions': SESSIONS.stats(),
+        'metrics': REGISTRY.summary()
+    }
+
+def observe_http_request(route, method, status, elapsed):
+    HTTP_REQUESTS.inc(route=route, method=method, status=status)
+    HTTP_REQUEST_SECONDS.observe(elapsed, route=route)
 
-### 🤖 What I Can Do:
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
 
-**Answer Any Health Question:**
-- Symptoms and conditions
-- Treatment options
-- Medication information
-- Prevention strategies
-- When to seek care
-- Emergency guidance
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    observe_http_request(route, request.method, response.status_code, time.perf_counter() - g.request_started)
+    return response
 
-**Medical Image Analysis:**
-Upload photos for AI-powered skin condition analysis
+@app.errorhandler(RequestRejected)
+def request_rejected(error):
+    """Structured 4xx reply for a request refused by validation"""
+    body, status = error.result()
+    return jsonify(body), status
 
-**Examples of Questions I Can Answer:**
-- "I have a severe headache with nausea"
-- "What should I do for a fever?"
-- "How to treat a mosquito bite?"
-- "I'm feeling anxious, what helps?"
-- "My stomach hurts after eating"
-- "What are signs of infection?"
-- "How to prevent the flu?"
-- "Is this rash serious?"
-- **...or ANY other medical question!**
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(error):
+    """Werkzeug raises this as soon as the body passes the request's max_content_length"""
+    return request_rejected(body_too_large(request.max_content_length))
 
-### 💬 Try Asking Me Anything!
+def read_json():
+    """The request's JSON object; the size cap applies while the body is read, before parsing"""
+    return parse_json_object(request.get_data(cache=False))
 
-Just type your question in plain English. I'll provide:
-- ✅ Evidence-based medical information
-- ✅ Treatment recommendations
-- ✅ Warning signs to watch for
-- ✅ When to see a doctor
-- ✅ Self-care strategies
+def read_chat_request():
+    """Message, image analysis and session id from a JSON, multipart or raw image chat request"""
+    image_analysis = None
+    
+    if request.mimetype == 'multipart/form-data':
+        # Form upload: the file part is already spooled by the form parser
+        user_message = request.form.get('message', '')
+        session_id = request.form.get('session_id')
+        upload = request.files.get('image')
+        if upload:
+            image_analysis = analyze_image_file(upload.stream)
+    
+    elif request.mimetype.startswith('image/'):
+        # Raw image body: stream it into a spooled file for the decoder
+        user_message = request.args.get('message', '')
+        session_id = request.args.get('session_id')
+        # Refused before a single body byte is read
+        check_image_type(request.mimetype)
+        hasher = new_image_hasher()
+        with spool_stream(request.stream, hasher) as upload:
+            image_analysis = analyze_image_file(upload, hasher.hexdigest())
+    
+    else:
+        data = read_json()
+        user_message = string_field(data, 'message')
+        session_id = string_field(data, 'session_id', None, nullable=True)
+        image_data = string_field(data, 'image', None, nullable=True)
+        
+        # Analyze image if provided
+        if image_data:
+            image_analysis = analyze_image(image_data)
+    
+    return user_message, image_analysis, session_id
 
-*This AI provides educational information. Always consult healthcare professionals for personalized medical advice.*"""
+def event_stream_response(events):
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """Handle chat messages"""
     try:
-        data = request.json
-        user_message = data.get('message', '')
-        image_data = data.get('image', None)
+        user_message, image_analysis, session_id = read_chat_request()
         
-        # Analyze image if provided
-        image_analysis = None
-        if image_data:
-            image_analysis = analyze_image(image_data)
+        error = session_id_error(session_id)
+        if error:
+            return jsonify(error), 400
         
-        # Generate AI response
-        response = generate_ai_response(user_message, image_analysis)
+        if 'text/event-stream' in request.headers.get('Accept', ''):
+            return event_stream_response(chat_event_stream(user_message, image_analysis, session_id))
         
+        return jsonify(chat_result(user_message, image_analysis, session_id))
+    
+    except REJECTIONS:
+        raise
+    except Exception as e:
         return jsonify({
-            'success': True,
-            'response': response,
-            'timestamp': datetime.now().isoformat(),
-            'hasImageAnalysis': image_analysis is not None
-        })
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Stream the chat reply as Server-Sent Events, one markdown section per event"""
+    try:
+        user_message, image_analysis, session_id = read_chat_request()
+        
+        error = session_id_error(session_id)
+        if error:
+            return jsonify(error), 400
+        
+        return event_stream_response(chat_event_stream(user_message, image_analysis, session_id))
+    
+    except REJECTIONS:
+        raise
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/analyze-images', methods=['POST'])
+def analyze_images_endpoint():
+    """Analyze several images at once, spread across worker processes"""
+    try:
+        if request.mimetype == 'multipart/form-data':
+            user_message = request.form.get('message', '')
+            payloads = [upload.read() for upload in request.files.getlist('images')]
+        else:
+            data = read_json()
+            user_message = string_field(data, 'message')
+            payloads = data.get('images', [])
+        
+        body, status = analyze_images_result(user_message, payloads)
+        return jsonify(body), status
     
+    except REJECTIONS:
+        raise
     except Exception as e:
         return jsonify({
             'success': False,
@@ -1156,24 +970,52 @@ def chat():
 def analyze_symptoms_endpoint():
     """Dedicated symptom analysis endpoint"""
     try:
-        data = request.json
-        symptoms_text = data.get('symptoms', '')
+        body, status = analyze_symptoms_result(read_json())
+        return jsonify(body), status
+    
+    except REJECTIONS:
+        raise
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/analyze-symptoms/batch', methods=['POST'])
+def analyze_symptoms_batch_endpoint():
+    """Triage a JSONL or CSV body of messages, streaming one JSONL result per message back"""
+    try:
+        field = request.args.get('field', 'message')
+        fmt = triage_batch_format(request.mimetype, field)
         
-        result = analyze_symptoms(symptoms_text)
+        # The whole body is spooled (to disk past 1MB) before any result is written, so clients
+        # that finish uploading before reading the response cannot deadlock against the stream;
+        # ApiRequest caps it at TRIAGE_MAX_BODY_BYTES rather than CHATBOT_MAX_BODY_BYTES
+        lines = start_triage_stream(spool_stream(request.stream), fmt, field)
         
-        if result:
-            return jsonify({
-                'success': True,
-                'condition': result['condition'],
-                'matched_symptoms': result['matched_symptoms'],
-                'confidence': min(95, 65 + result['score'] * 5)
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'message': 'No matching conditions found'
-            })
+        return Response(
+            stream_with_context(lines),
+            mimetype='application/x-ndjson',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    
+    except REJECTIONS:
+        raise
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/search', methods=['POST'])
+def search_endpoint():
+    """Ranked knowledge base entries (conditions, symptoms, categories) for a free-text query"""
+    try:
+        body, status = search_result(read_json())
+        return jsonify(body), status
     
+    except REJECTIONS:
+        raise
     except Exception as e:
         return jsonify({
             'success': False,
@@ -1183,15 +1025,106 @@ def analyze_symptoms_endpoint():
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
-        'status': 'healthy',
-        'message': 'AI Medical Chatbot API is running',
-        'timestamp': datetime.now().isoformat()
-    })
-
-if __name__ == '__main__':
+    return jsonify(health_result())
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Stage latencies, routing branches and request counts in Prometheus text format"""
+    return Response(REGISTRY.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+def run_triage(args):
+    """Triage a JSONL or CSV message log into JSONL results, reporting throughput on stderr"""
+    # Loaded before the pool forks so every worker shares one copy
+    KNOWLEDGE_BASE.warm()
+    fmt = args.format or path_format(args.input)
+    
+    def report(summary):
+        print(f"⏱️ {summary['messages']} messages, {summary['messages_per_second']:.0f}/s", file=sys.stderr)
+    
+    source = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8', newline='')
+    target = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    try:
+        records = read_records(source, fmt, args.field)
+        results = iter_batch(records, triage_records, args.workers or TRIAGE_WORKERS, args.chunk_size)
+        summary = write_batch(results, target, report)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+    
+    print(f"✅ Triaged {summary['messages']} messages ({summary['errors']} errors) in {summary['seconds']:.1f}s, "
+          f"{summary['messages_per_second']:.0f}/s", file=sys.stderr)
+
+def run_compile_kb(args):
+    """Compile a knowledge base source and its indexes into a memory-mappable artifact"""
+    started = time.perf_counter()
+    knowledge_base = KnowledgeBase(open_source(args.source), reload_interval=0, index_version=KNOWLEDGE_INDEX_VERSION)
+    register_indexes(knowledge_base)
+    size = knowledge_base.compile(args.output, {'source': args.source})
+    print(f"📦 Compiled {args.source} into {args.output} ({size / 1024:.0f} KiB) in {time.perf_counter() - started:.2f}s",
+          file=sys.stderr)
+    
+    # Time what a server pays at startup: opening the artifact and restoring every index
+    started = time.perf_counter()
+    restored = KnowledgeBase(open_source(args.source, args.output), reload_interval=0, index_version=KNOWLEDGE_INDEX_VERSION)
+    register_indexes(restored)
+    snapshot = restored.warm()
+    print(f"✅ Loads in {(time.perf_counter() - started) * 1000:.0f}ms "
+          f"({len(snapshot.summary()['prebuilt_indexes'])} prebuilt indexes)", file=sys.stderr)
+
+def shutdown_worker_pools():
+    """Stop the image and triage process pools, e.g. when a server worker exits"""
+    shutdown_image_pool()
+    shutdown_triage_pools()
+
+def preload_state(preload_images=IMAGE_PRELOAD):
+    """Build what server workers share: the knowledge base, plus the image stack unless serving text only"""
+    KNOWLEDGE_BASE.warm()
+    if preload_images:
+        load_image_stack()
+
+def main(argv=None):
+    """Command line entry point: development server by default, plus 'serve', 'triage' and 'compile-kb'"""
+    parser = argparse.ArgumentParser(description='AI Medical Chatbot API')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='Report import, knowledge base and index build times of a cold start, then exit')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('run', help='Start the development server (default)')
+    add_serve_command(commands)
+    add_triage_command(commands, TRIAGE_CHUNK_SIZE)
+    compile_kb = commands.add_parser('compile-kb', help='Compile the knowledge base and its indexes into an artifact')
+    compile_kb.add_argument('--source', default=KNOWLEDGE_PATH, help='Knowledge base directory or SQLite file')
+    compile_kb.add_argument('--output', '-o', default=KNOWLEDGE_ARTIFACT or 'knowledge.kb', help='Artifact to write')
+    args = parser.parse_args(argv)
+    
+    if args.profile_startup:
+        print_startup_profile('chatbot_api', os.path.dirname(os.path.abspath(__file__)), KNOWLEDGE_BASE, load_image_stack)
+        return
+    
+    if args.command == 'triage':
+        run_triage(args)
+        return
+    
+    if args.command == 'compile-kb':
+        run_compile_kb(args)
+        return
+    
+    if args.command == 'serve' and args.asgi:
+        serve_asgi(args)
+        return
+    
+    if args.command == 'serve':
+        serve(app, args, preload=lambda: preload_state(args.preload_images), on_worker_exit=shutdown_worker_pools)
+        return
+    
     print("🏥 Starting AI Medical Chatbot API...")
     print("📡 Server running on http://localhost:5000")
     print("🔬 Medical knowledge base loaded")
     print("✅ Ready to accept requests")
     app.run(debug=True, port=5000, host='0.0.0.0')
+
+if __name__ == '__main__':
+    main()
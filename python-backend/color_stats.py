@@ -0,0 +1,66 @@
+import numpy as np
+
+# Rows processed per tile; keeps temporaries small for large images
+TILE_ROWS = 256
+
+# A pixel counts as red when R - (G + B) / 2 exceeds this
+RED_PIXEL_THRESHOLD = 30
+
+# Offsets that place the R, G and B values in separate histogram ranges
+_CHANNEL_OFFSETS = np.array([0, 256, 512], dtype=np.intp)
+_LEVELS = np.arange(256, dtype=np.int64)
+
+
+def redness_map(pixels):
+    """Per-pixel 2R - G - B as int16 (twice R - (G + B) / 2, kept integral)"""
+    pixels = pixels.astype(np.int16, copy=False)
+    return 2 * pixels[..., 0] - pixels[..., 1] - pixels[..., 2]
+
+
+def _iter_tiles(image, tile_rows):
+    """Yield HxWx3 uint8 row strips from a PIL image or an ndarray"""
+    if isinstance(image, np.ndarray):
+        for top in range(0, image.shape[0], tile_rows):
+            yield image[top:top + tile_rows]
+        return
+
+    width, height = image.size
+    for top in range(0, height, tile_rows):
+        yield np.asarray(image.crop((0, top, width, min(top + tile_rows, height))))
+
+
+def compute_color_stats(image, tile_rows=TILE_ROWS):
+    """Histograms, sums, means and redness metrics in one pass over RGB row tiles"""
+    histograms = np.zeros(768, dtype=np.int64)
+    red_pixels = 0
+    max_redness = None
+
+    for tile in _iter_tiles(image, tile_rows):
+        if not tile.size:
+            continue
+        # One bincount gives all three channel histograms for the tile
+        histograms += np.bincount((tile.reshape(-1, 3) + _CHANNEL_OFFSETS).ravel(), minlength=768)
+
+        redness = redness_map(tile)
+        red_pixels += int(np.count_nonzero(redness > 2 * RED_PIXEL_THRESHOLD))
+        tile_max = int(redness.max())
+        max_redness = tile_max if max_redness is None else max(max_redness, tile_max)
+
+    histograms = histograms.reshape(3, 256)
+    pixel_count = int(histograms[0].sum())
+    if not pixel_count:
+        raise ValueError('Image has no pixels')
+
+    # Channel sums fall out of the histograms, so the pixels are read only once
+    sums = histograms @ _LEVELS
+    avg_red, avg_green, avg_blue = (int(total) / pixel_count for total in sums)
+
+    return {
+        'pixel_count': pixel_count,
+        'sums': [int(total) for total in sums],
+        'means': [avg_red, avg_green, avg_blue],
+        'histograms': histograms,
+        'redness_level': avg_red - (avg_green + avg_blue) / 2,
+        'red_pixel_ratio': red_pixels / pixel_count,
+        'max_redness': max_redness / 2
+    }
@@ -0,0 +1,430 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections.abc import ItemsView, Mapping, Sequence, ValuesView
+
+MAGIC = b'MEDKB\x00\x00\x00'
+FORMAT_VERSION = 2
+
+# Magic, format version and length of the JSON header that follows
+PREAMBLE = struct.Struct('<8sII')
+
+# Node kinds
+NULL, FALSE, TRUE, INT, FLOAT, STRING, LIST, DICT, BYTES = range(9)
+
+# Arrays of the image, by name: element type and what they hold
+ARRAYS = {
+    'string_offsets': 'I',  # string i is the UTF-8 in string_data[offsets[i]:offsets[i + 1]]
+    'string_data': 'B',
+    'kinds': 'B',           # per node
+    'values': 'I',          # per node: string id, index into ints, floats or blobs, or first entry
+    'sizes': 'I',           # per node: entry count of a list or dict
+    'ints': 'q',
+    'floats': 'd',
+    'blob_starts': 'Q',     # blob i is blob_data[starts[i]:starts[i] + sizes[i]], 8-byte aligned
+    'blob_sizes': 'Q',
+    'blob_data': 'B',
+    'list_nodes': 'I',      # per list entry, in order
+    'dict_keys': 'I',       # per dict entry, in source order: key string id...
+    'dict_nodes': 'I',      # ...and value node
+    'sorted_keys': 'I',     # per dict entry: the dict's key ids in ascending order...
+    'sorted_entries': 'I'   # ...and the position of the entry holding each
+}
+
+# Offsets and ids are 32-bit
+MAX_STRING_BYTES = (1 << 32) - 1
+INT_MIN, INT_MAX = -(1 << 63), (1 << 63) - 1
+
+
+def section_digest(value):
+    """Version token of a section: a hash of its canonical JSON"""
+    encoded = json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode()
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def pack_array(values):
+    """A one-dimensional NumPy or array.array array as frozen data; unpack_array maps it back without copying"""
+    view = memoryview(values)
+    if view.ndim != 1:
+        raise ValueError('Only one-dimensional arrays can be packed')
+    return {'format': view.format, 'data': view.tobytes()}
+
+
+def unpack_array(data):
+    """Typed memoryview over packed array data (np.asarray() of it shares the same memory)"""
+    return memoryview(data['data']).cast('B').cast(data['format'])
+
+
+def _collect_strings(value, strings):
+    if isinstance(value, str):
+        strings.add(value)
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            if not isinstance(key, str):
+                raise TypeError(f'Knowledge base keys must be strings, not {key!r}')
+            strings.add(key)
+            _collect_strings(item, strings)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _collect_strings(item, strings)
+
+
+class _Encoder:
+    """Flattens JSON values into the node arrays; a container's entries are contiguous"""
+
+    def __init__(self, string_ids):
+        self.string_ids = string_ids
+        self.arrays = {name: array(code) for name, code in ARRAYS.items() if not name.startswith('string')}
+        self.blobs = []
+        self.blob_bytes = 0
+
+    def node(self, value):
+        arrays = self.arrays
+        node = len(arrays['kinds'])
+        arrays['kinds'].append(NULL)
+        arrays['values'].append(0)
+        arrays['sizes'].append(0)
+
+        if value is None:
+            return node
+        if isinstance(value, bool):
+            arrays['kinds'][node] = TRUE if value else FALSE
+        elif isinstance(value, int):
+            if not INT_MIN <= value <= INT_MAX:
+                raise ValueError(f'Integer out of range: {value}')
+            arrays['kinds'][node] = INT
+            arrays['values'][node] = len(arrays['ints'])
+            arrays['ints'].append(value)
+        elif isinstance(value, float):
+            arrays['kinds'][node] = FLOAT
+            arrays['values'][node] = len(arrays['floats'])
+            arrays['floats'].append(value)
+        elif isinstance(value, str):
+            arrays['kinds'][node] = STRING
+            arrays['values'][node] = self.string_ids[value]
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            data = bytes(value)
+            arrays['kinds'][node] = BYTES
+            arrays['values'][node] = len(arrays['blob_sizes'])
+            arrays['blob_starts'].append(self.blob_bytes)
+            arrays['blob_sizes'].append(len(data))
+            self.blobs.append(data + b'\x00' * (-len(data) % 8))
+            self.blob_bytes += len(self.blobs[-1])
+        elif isinstance(value, dict):
+            start = len(arrays['dict_nodes'])
+            arrays['kinds'][node] = DICT
+            arrays['values'][node] = start
+            arrays['sizes'][node] = len(value)
+
+            # Reserve the entry range first so nested containers land after it
+            key_ids = [self.string_ids[key] for key in value]
+            arrays['dict_keys'].extend(key_ids)
+            arrays['sorted_keys'].extend(sorted(key_ids))
+            arrays['sorted_entries'].extend(sorted(range(len(key_ids)), key=key_ids.__getitem__))
+            arrays['dict_nodes'].extend([0] * len(value))
+            for position, item in enumerate(value.values()):
+                arrays['dict_nodes'][start + position] = self.node(item)
+        elif isinstance(value, (list, tuple)):
+            start = len(arrays['list_nodes'])
+            arrays['kinds'][node] = LIST
+            arrays['values'][node] = start
+            arrays['sizes'][node] = len(value)
+            arrays['list_nodes'].extend([0] * len(value))
+            for position, item in enumerate(value):
+                arrays['list_nodes'][start + position] = self.node(item)
+        else:
+            raise TypeError(f'Cannot freeze {type(value).__name__} values')
+        return node
+
+
+def freeze(sections, indexes=None, metadata=None):
+    """Encode {section: JSON value} and prebuilt index data as a frozen knowledge base image"""
+    root = {'sections': dict(sections), 'indexes': dict(indexes or {})}
+    strings = set()
+    _collect_strings(root, strings)
+
+    # Sorted by code point, which is also UTF-8 byte order, so ids can be found by binary search
+    strings = sorted(strings)
+    encoded = [text.encode() for text in strings]
+    if sum(map(len, encoded)) > MAX_STRING_BYTES:
+        raise ValueError('Knowledge base strings exceed 4 GiB')
+    offsets = array('I', [0])
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data))
+
+    encoder = _Encoder({text: idx for idx, text in enumerate(strings)})
+    encoder.node(root)
+    arrays = dict(
+        encoder.arrays,
+        string_offsets=offsets,
+        string_data=array('B', b''.join(encoded)),
+        blob_data=array('B', b''.join(encoder.blobs))
+    )
+
+    # Arrays start at 8-byte aligned offsets after the header
+    layout, parts, offset = {}, [], 0
+    for name in ARRAYS:
+        data = arrays[name].tobytes()
+        layout[name] = [offset, len(arrays[name])]
+        parts.append(data + b'\x00' * (-len(data) % 8))
+        offset += len(parts[-1])
+    body = b''.join(parts)
+
+    header = {
+        'byteorder': sys.byteorder,
+        'sections': {name: section_digest(value) for name, value in sections.items()},
+        'metadata': metadata or {},
+        'arrays': layout,
+        'checksum': hashlib.sha256(body).hexdigest()
+    }
+    header_bytes = json.dumps(header, sort_keys=True).encode()
+    header_bytes += b' ' * (-(PREAMBLE.size + len(header_bytes)) % 8)
+    return PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)) + header_bytes + body
+
+
+def write_frozen(sections, path, indexes=None, metadata=None):
+    """Freeze sections into a file, replaced atomically so running readers keep their mapping"""
+    data = freeze(sections, indexes, metadata)
+    temporary = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(temporary, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.unlink(temporary)
+        raise
+    return len(data)
+
+
+class FrozenKnowledge:
+    """A frozen knowledge base image: sections are read-only views over shared arrays"""
+
+    # Nothing is unpacked up front. Nodes are decoded on access into short-lived objects, so
+    # refcounting never writes to the mapped pages and forked workers share one physical copy.
+
+    def __init__(self, buffer, verify=True):
+        self._buffer = buffer
+        view = memoryview(buffer)
+        magic, version, header_length = PREAMBLE.unpack_from(view) if len(view) >= PREAMBLE.size else (b'', 0, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a frozen knowledge base')
+        if version != FORMAT_VERSION:
+            raise ValueError(f'Frozen knowledge base format {version} is not {FORMAT_VERSION}')
+        header = json.loads(bytes(view[PREAMBLE.size:PREAMBLE.size + header_length]))
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError(f"Frozen knowledge base is {header['byteorder']}-endian")
+
+        base = PREAMBLE.size + header_length
+        if verify and hashlib.sha256(view[base:]).hexdigest() != header['checksum']:
+            raise ValueError('Frozen knowledge base checksum mismatch')
+
+        self.digests = header['sections']
+        self.metadata = header['metadata']
+        for name, code in ARRAYS.items():
+            offset, count = header['arrays'][name]
+            size = count * array(code).itemsize
+            setattr(self, '_' + name, view[base + offset:base + offset + size].cast(code))
+
+        self._string_ids = {}
+        root = FrozenDict(self, 0)
+        self._sections = root['sections']
+        self._indexes = root['indexes']
+
+    @property
+    def sections(self):
+        return list(self._sections)
+
+    @property
+    def indexes(self):
+        return list(self._indexes)
+
+    def section(self, name):
+        return self._sections[name]
+
+    def index(self, name):
+        """Prebuilt data stored for an index, or None"""
+        return self._indexes.get(name)
+
+    def string(self, string_id):
+        offsets = self._string_offsets
+        return str(self._string_data[offsets[string_id]:offsets[string_id + 1]], 'utf-8')
+
+    def string_id(self, text):
+        """Integer id of a string in the table, or None when the knowledge base never uses it"""
+        try:
+            return self._string_ids[text]
+        except KeyError:
+            pass
+        if not isinstance(text, str):
+            return None
+
+        encoded = text.encode()
+        offsets, data = self._string_offsets, self._string_data
+        low, high = 0, len(offsets) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if bytes(data[offsets[middle]:offsets[middle + 1]]) < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        if low == len(offsets) - 1 or bytes(data[offsets[low]:offsets[low + 1]]) != encoded:
+            return None
+
+        # Only hits are remembered, so lookups of arbitrary input cannot grow this
+        self._string_ids[text] = low
+        return low
+
+    def value(self, node):
+        """The Python value of a node: scalars as is, containers as frozen views"""
+        kind = self._kinds[node]
+        if kind == STRING:
+            return self.string(self._values[node])
+        if kind == DICT:
+            return FrozenDict(self, node)
+        if kind == LIST:
+            return FrozenList(self, node)
+        if kind == INT:
+            return self._ints[self._values[node]]
+        if kind == FLOAT:
+            return self._floats[self._values[node]]
+        if kind == BYTES:
+            start = self._blob_starts[self._values[node]]
+            return self._blob_data[start:start + self._blob_sizes[self._values[node]]]
+        return (None, False, True)[kind]
+
+
+def open_frozen(path, verify=True):
+    """Memory-map a frozen knowledge base file, checking its checksum unless told not to"""
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return FrozenKnowledge(buffer, verify)
+
+
+class FrozenDict(Mapping):
+    """Read-only dict view of a frozen node; keys are found by binary search over interned ids"""
+
+    __slots__ = ('_kb', '_node')
+
+    def __init__(self, kb, node):
+        self._kb = kb
+        self._node = node
+
+    def __getitem__(self, key):
+        kb = self._kb
+        key_id = kb.string_id(key)
+        if key_id is not None:
+            start = kb._values[self._node]
+            end = start + kb._sizes[self._node]
+            rank = bisect_left(kb._sorted_keys, key_id, start, end)
+            if rank < end and kb._sorted_keys[rank] == key_id:
+                return kb.value(kb._dict_nodes[start + kb._sorted_entries[rank]])
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self):
+        return self._kb._sizes[self._node]
+
+    def _entries(self):
+        kb = self._kb
+        start = kb._values[self._node]
+        return range(start, start + kb._sizes[self._node])
+
+    def __iter__(self):
+        kb = self._kb
+        for entry in self._entries():
+            yield kb.string(kb._dict_keys[entry])
+
+    def items(self):
+        return FrozenItems(self)
+
+    def values(self):
+        return FrozenValues(self)
+
+    def __reduce__(self):
+        # Pickles (process pools, caches) get a plain dict; the mapping itself cannot travel
+        return dict, (thaw(self),)
+
+    def __repr__(self):
+        return f'FrozenDict({thaw(self)!r})'
+
+
+class FrozenItems(ItemsView):
+    __slots__ = ()
+
+    def __iter__(self):
+        kb = self._mapping._kb
+        for entry in self._mapping._entries():
+            yield kb.string(kb._dict_keys[entry]), kb.value(kb._dict_nodes[entry])
+
+
+class FrozenValues(ValuesView):
+    __slots__ = ()
+
+    def __iter__(self):
+        kb = self._mapping._kb
+        for entry in self._mapping._entries():
+            yield kb.value(kb._dict_nodes[entry])
+
+
+class FrozenList(Sequence):
+    """Read-only list view of a frozen node"""
+
+    __slots__ = ('_kb', '_node')
+
+    def __init__(self, kb, node):
+        self._kb = kb
+        self._node = node
+
+    def __len__(self):
+        return self._kb._sizes[self._node]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[idx] for idx in range(*index.indices(len(self)))]
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError('FrozenList index out of range')
+        kb = self._kb
+        return kb.value(kb._list_nodes[kb._values[self._node] + index])
+
+    def __iter__(self):
+        kb = self._kb
+        start = kb._values[self._node]
+        for entry in range(start, start + kb._sizes[self._node]):
+            yield kb.value(kb._list_nodes[entry])
+
+    def __eq__(self, other):
+        if isinstance(other, (list, tuple, FrozenList)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return list, (thaw(self),)
+
+    def __repr__(self):
+        return f'FrozenList({thaw(self)!r})'
+
+
+def thaw(value):
+    """Plain dicts and lists for a frozen value; anything else comes back unchanged"""
+    if isinstance(value, FrozenDict):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, FrozenList):
+        return [thaw(item) for item in value]
+    return value
@@ -0,0 +1,381 @@
+import base64
+import hashlib
+import io
+import os
+import tempfile
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from metrics import stage_timer
+from validation import RequestRejected
+
+# Longest side the color statistics are computed on
+ANALYSIS_MAX_SIDE = 512
+
+# Lesions covering at least this share of the frame are diffuse redness, classified by their color
+DIFFUSE_LESION_AREA = 0.3
+
+# Content types an image may be declared as, and the format its header must then show
+IMAGE_TYPES = {
+    'image/jpeg': 'JPEG',
+    'image/jpg': 'JPEG',
+    'image/png': 'PNG',
+    'image/webp': 'WEBP',
+    'image/gif': 'GIF',
+    'image/bmp': 'BMP'
+}
+IMAGE_FORMATS = frozenset(IMAGE_TYPES.values())
+
+# Largest image a header may declare, and the most pixels decoded once draft() has scaled it;
+# JPEGs decode at up to 1/8 scale, every other format at full size
+IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', 50_000_000))
+IMAGE_MAX_DECODE_PIXELS = int(os.environ.get('IMAGE_MAX_DECODE_PIXELS', 16_000_000))
+
+# Upload bodies stay in memory up to this size, then spill to a temp file
+SPOOL_MAX_MEMORY = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+# Batch analysis fans out over one process per core unless overridden
+IMAGE_POOL_WORKERS = int(os.environ.get('IMAGE_POOL_WORKERS', 0)) or os.cpu_count() or 1
+
+# Bump whenever measure_image output changes so cached results are not reused
+MEASUREMENT_VERSION = 6
+
+# Recently measured images, found again by perceptual hash when a recompressed copy arrives
+NEAR_DUPLICATE_MAX_ENTRIES = int(os.environ.get('NEAR_DUPLICATE_MAX_ENTRIES', 4096))
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.environ.get('NEAR_DUPLICATE_MAX_DISTANCE', 6))
+
+# A near-duplicate must also share the reduced size and have no redness thumbnail cell this far off;
+# recompressed copies stay within 6, while one small bite moves its cell by 13 or more
+NEAR_DUPLICATE_MAX_REDNESS_DELTA = 10
+
+# Whether servers import the image stack before forking workers; text-only deployments set 0
+# and never load Pillow unless an image actually arrives
+IMAGE_PRELOAD = os.environ.get('CHATBOT_PRELOAD_IMAGES', '1') != '0'
+
+_image_pool = None
+_pillow = None
+_near_duplicates = None
+
+# Stage timers; images measured inside pool workers are recorded in those processes
+DECODE_TIMER = stage_timer('image_decode')
+HASH_TIMER = stage_timer('image_hash')
+OPEN_TIMER = stage_timer('image_open')
+STATS_TIMER = stage_timer('image_stats')
+PHASH_TIMER = stage_timer('image_phash')
+LESION_TIMER = stage_timer('image_lesions')
+
+
+def new_image_hasher():
+    """Fast content hash used to key cached image results"""
+    return hashlib.blake2b(digest_size=16)
+
+
+def hash_image_bytes(image_bytes):
+    """Hash an in-memory image"""
+    with HASH_TIMER.time():
+        hasher = new_image_hasher()
+        hasher.update(image_bytes)
+        return hasher.hexdigest()
+
+
+def hash_image_file(image_file, chunk_size=CHUNK_SIZE):
+    """Hash a file object's remaining bytes and rewind it"""
+    with HASH_TIMER.time():
+        start = image_file.tell()
+        hasher = new_image_hasher()
+        while True:
+            chunk = image_file.read(chunk_size)
+            if not chunk:
+                break
+            hasher.update(chunk)
+        image_file.seek(start)
+        return hasher.hexdigest()
+
+
+def spool_stream(stream, hasher=None, chunk_size=CHUNK_SIZE):
+    """Copy a request body into a seekable spooled file one chunk at a time"""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        if hasher is not None:
+            hasher.update(chunk)
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+def check_image_type(content_type):
+    """Refuse an upload whose declared content type is not a supported image"""
+    if content_type not in IMAGE_TYPES:
+        raise RequestRejected(
+            f"Unsupported image type: {content_type or 'none'}", 422, 'unsupported_image_type'
+        )
+
+
+def data_url_type(image_data):
+    """Declared content type of a data URL such as 'data:image/png;base64,...'"""
+    if not isinstance(image_data, str) or not image_data.startswith('data:') or ',' not in image_data:
+        raise RequestRejected('image must be a base64 data URL', 422, 'invalid_image')
+    return image_data[5:image_data.index(',')].split(';')[0].strip().lower()
+
+
+def decode_data_url(image_data):
+    """Decode the base64 payload of a data URL"""
+    with DECODE_TIMER.time():
+        return base64.b64decode(image_data.split(',')[1])
+
+
+def open_data_url(image_data):
+    """Decode a base64 data URL into an in-memory file"""
+    return io.BytesIO(decode_data_url(image_data))
+
+
+def load_image_stack():
+    """Import and configure Pillow and the NumPy measuring modules on first use; returns PIL.Image"""
+    global _pillow, _near_duplicates
+    if _pillow is None:
+        from PIL import Image
+
+        import color_stats
+        import lesion_segmentation
+        from perceptual_hash import NearDuplicateIndex
+
+        # One table per process; pool workers each remember the images they measured
+        _near_duplicates = NearDuplicateIndex(NEAR_DUPLICATE_MAX_ENTRIES, NEAR_DUPLICATE_MAX_DISTANCE)
+
+        # Pillow's own decompression bomb guard backs up the check in open_image; its warning for
+        # images just over the limit is dropped because open_image refuses those right after
+        Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+        warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+        _pillow = Image
+    return _pillow
+
+
+def near_duplicate_stats():
+    """Counters of this process's near-duplicate table, or None before the image stack is loaded"""
+    return _near_duplicates.stats() if _near_duplicates is not None else None
+
+
+def clear_near_duplicates():
+    """Forget the images this process has measured, e.g. to time cold analyses"""
+    if _near_duplicates is not None:
+        _near_duplicates.clear()
+
+
+def open_image(image_file):
+    """Open an image lazily, checking its format and declared size from the header alone"""
+    Image = load_image_stack()
+    try:
+        image = Image.open(image_file)
+    except Image.DecompressionBombError as e:
+        raise RequestRejected(str(e), 422, 'image_too_large')
+    except Image.UnidentifiedImageError:
+        raise RequestRejected('Upload is not a readable image', 422, 'invalid_image')
+
+    if image.format not in IMAGE_FORMATS:
+        raise RequestRejected(f'Unsupported image format: {image.format}', 422, 'unsupported_image_format')
+
+    width, height = image.size
+    if width * height > IMAGE_MAX_PIXELS:
+        raise RequestRejected(
+            f'Image is {width}x{height}; at most {IMAGE_MAX_PIXELS} pixels are accepted', 422, 'image_too_large'
+        )
+    return image
+
+
+def load_reduced(image_file, max_side=ANALYSIS_MAX_SIDE):
+    """Decode an image at reduced resolution and return it with its original size"""
+    image = open_image(image_file)
+    width, height = image.size
+
+    # JPEG decodes straight to a DCT-scaled size, never to the full frame
+    image.draft('RGB', (max_side, max_side))
+
+    # Nothing has been decoded yet; refuse what would still decode too large
+    if image.size[0] * image.size[1] > IMAGE_MAX_DECODE_PIXELS:
+        raise RequestRejected(
+            f'Image is {width}x{height}; at most {IMAGE_MAX_DECODE_PIXELS} pixels can be decoded', 422,
+            'image_too_large'
+        )
+
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    # Formats without draft support are box-reduced right after decoding; rounded up so the
+    # longest side really ends up at most max_side
+    factor = -(-max(image.size) // max_side)
+    if factor > 1:
+        image = image.reduce(factor)
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    # Decode here if nothing above forced it, so the cost is not hidden in the stats
+    image.load()
+    return image, width, height
+
+
+def classify_colors(redness_score, avg_red):
+    """Map color metrics to the most likely condition key"""
+    if redness_score > 30:
+        # High redness - likely inflammation
+        if avg_red > 150:
+            return 'burn'
+        return 'rash'
+    elif redness_score > 15:
+        # Moderate redness
+        return 'mosquito_bite'
+    elif redness_score > 5:
+        return 'acne'
+    # Low redness
+    return 'eczema'
+
+
+def classify_lesions(lesions):
+    """Condition key from segmented lesions, or None when there are none to go by"""
+    if not lesions or not lesions['count']:
+        return None
+    if lesions['area_ratio'] >= DIFFUSE_LESION_AREA:
+        return classify_colors(lesions['redness_level'], lesions['color_profile']['red'])
+    if lesions['layout'] in ('line', 'cluster'):
+        # Bed bugs bite several times along their path ("breakfast, lunch and dinner") or in a tight group
+        return 'bedbug_bite'
+    if lesions['count'] >= 5:
+        return 'acne'
+    # One or a few isolated bumps
+    return 'mosquito_bite'
+
+
+def find_near_duplicate(image, image_hash):
+    """((distance, earlier measurement), None) on a match, else (None, what to store this image under or None)"""
+    from perceptual_hash import low_detail, redness_delta, redness_grid
+
+    # Flat or evenly shaded frames hash alike whatever is on them
+    if low_detail(image_hash) or not _near_duplicates.max_entries:
+        return None, None
+    redness = redness_grid(image)
+
+    def same_content(earlier):
+        # dHash only sees brightness; a few small red bites barely move it but do move their cells
+        return (
+            earlier['size'] == image.size
+            and redness_delta(earlier['redness'], redness) <= NEAR_DUPLICATE_MAX_REDNESS_DELTA
+        )
+
+    match = _near_duplicates.find(image_hash, same_content)
+    if match is None:
+        return None, {'size': image.size, 'redness': redness}
+    _, distance, earlier = match
+    return (distance, earlier['measurement']), None
+
+
+def measure_image(image_file):
+    """Decode an image downscaled and return its color analysis and condition key"""
+    # Already imported by load_reduced through load_image_stack
+    from color_stats import compute_color_stats
+    from lesion_segmentation import segment_lesions
+    from perceptual_hash import difference_hash
+
+    # Original size comes from the header; pixels are decoded downscaled
+    with OPEN_TIMER.time():
+        image, width, height = load_reduced(image_file)
+
+    # Hashed first, so a recompressed copy of a recent image skips stats and segmentation
+    with PHASH_TIMER.time():
+        image_hash = difference_hash(image)
+        match, fingerprint = find_near_duplicate(image, image_hash)
+    if match is not None:
+        distance, earlier = match
+        return {
+            'condition_key': earlier['condition_key'],
+            'analysis': dict(
+                earlier['analysis'],
+                width=width,
+                height=height,
+                perceptual_hash=f'{image_hash:016x}',
+                near_duplicate={'perceptual_hash': earlier['analysis']['perceptual_hash'], 'distance': distance}
+            )
+        }
+
+    # Calculate color metrics in a single pass
+    with STATS_TIMER.time():
+        stats = compute_color_stats(image)
+    avg_red, avg_green, avg_blue = stats['means']
+    redness_score = stats['redness_level']
+
+    # Background skin, clothing and lighting dominate whole-frame means; lesions decide when found
+    with LESION_TIMER.time():
+        lesions = segment_lesions(image)
+
+    measurement = {
+        'condition_key': classify_lesions(lesions) or classify_colors(redness_score, avg_red),
+        'analysis': {
+            'width': width,
+            'height': height,
+            'redness_level': float(redness_score),
+            'red_pixel_ratio': stats['red_pixel_ratio'],
+            'max_redness': stats['max_redness'],
+            'color_profile': {
+                'red': float(avg_red),
+                'green': float(avg_green),
+                'blue': float(avg_blue)
+            },
+            'perceptual_hash': f'{image_hash:016x}',
+            'lesions': lesions
+        }
+    }
+    if fingerprint is not None:
+        # Only first sightings are stored, so matches never drift away from an original
+        _near_duplicates.add(image_hash, dict(fingerprint, measurement=measurement))
+    return measurement
+
+
+def measure_image_payload(payload):
+    """Process pool entry point: measure a data URL string or raw image bytes"""
+    if isinstance(payload, str):
+        return measure_image(open_data_url(payload))
+    return measure_image(io.BytesIO(payload))
+
+
+def get_image_pool():
+    """Create the image worker pool on first use (after any server fork)"""
+    global _image_pool
+    if _image_pool is None:
+        _image_pool = ProcessPoolExecutor(max_workers=IMAGE_POOL_WORKERS)
+    return _image_pool
+
+
+def shutdown_image_pool():
+    """Stop the image workers, e.g. when a server worker exits"""
+    global _image_pool
+    if _image_pool is not None:
+        _image_pool.shutdown(wait=True, cancel_futures=True)
+        _image_pool = None
+
+
+def measure_images(payloads):
+    """Measure several images across the process pool, keeping input order"""
+    global _image_pool
+    if len(payloads) <= 1 or IMAGE_POOL_WORKERS == 1:
+        pending = [None] * len(payloads)
+    else:
+        pool = get_image_pool()
+        pending = [pool.submit(measure_image_payload, payload) for payload in payloads]
+
+    results = []
+    for payload, future in zip(payloads, pending):
+        try:
+            results.append(future.result() if future else measure_image_payload(payload))
+        except BrokenProcessPool as e:
+            # A worker died (e.g. out of memory); start a fresh pool next time
+            _image_pool = None
+            results.append({'error': str(e) or 'Image worker crashed'})
+        except RequestRejected as e:
+            results.append({'error': str(e), 'reason': e.reason})
+        except Exception as e:
+            results.append({'error': str(e)})
+    return results
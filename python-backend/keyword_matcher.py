@@ -0,0 +1,137 @@
+from array import array
+from collections import deque
+
+from frozen_kb import pack_array, unpack_array
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton that finds every registered keyword in one pass"""
+
+    # Symbols are whatever patterns are made of: characters, or whole tokens when patterns are
+    # token tuples, in which case matches can only start and end on token boundaries
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        self._built = False
+
+    def add(self, pattern, group, key):
+        """Register a pattern; hits are reported as (group, key, pattern)"""
+        if not pattern:
+            return
+        state = 0
+        for symbol in pattern:
+            next_state = self._goto[state].get(symbol)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][symbol] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append((group, key, pattern))
+        self._built = False
+
+    def build(self):
+        """Compute failure links breadth-first and merge outputs along them"""
+        queue = deque()
+        for state in self._goto[0].values():
+            self._fail[state] = 0
+            queue.append(state)
+
+        while queue:
+            state = queue.popleft()
+            for symbol, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and symbol not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fallback = self._goto[fail].get(symbol, 0)
+                self._fail[next_state] = fallback if fallback != next_state else 0
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+        self._built = True
+        return self
+
+    def search(self, text):
+        """Return {group: {key: set(patterns)}} for every keyword found in a symbol sequence"""
+        if not self._built:
+            self.build()
+
+        goto, fail, output = self._goto, self._fail, self._output
+        hits = {}
+        state = 0
+        for symbol in text:
+            while state and symbol not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(symbol, 0)
+            for group, key, pattern in output[state]:
+                hits.setdefault(group, {}).setdefault(key, set()).add(pattern)
+        return hits
+
+    @property
+    def state_count(self):
+        return len(self._goto)
+
+    def to_data(self):
+        """The built automaton as flat arrays over symbol and pattern tables, for a compiled artifact"""
+        if not self._built:
+            self.build()
+
+        symbols = {}
+        edges = array('I')
+        for state, transitions in enumerate(self._goto):
+            for symbol, next_state in transitions.items():
+                edges.extend((state, symbols.setdefault(symbol, len(symbols)), next_state))
+
+        hits = {}
+        output_counts, outputs = array('I'), array('I')
+        for state_output in self._output:
+            output_counts.append(len(state_output))
+            outputs.extend(hits.setdefault(hit, len(hits)) for hit in state_output)
+
+        # Every pattern symbol labels some edge, so patterns are stored as symbol ids
+        pattern_lengths, pattern_symbols = array('I'), array('I')
+        for _, _, pattern in hits:
+            pattern_lengths.append(len(pattern))
+            pattern_symbols.extend(symbols[symbol] for symbol in pattern)
+
+        return {
+            'symbols': list(symbols),
+            'edges': pack_array(edges),
+            'fail': pack_array(array('I', self._fail)),
+            'output_counts': pack_array(output_counts),
+            'outputs': pack_array(outputs),
+            'groups': [group for group, _, _ in hits],
+            'keys': [key for _, key, _ in hits],
+            'pattern_lengths': pack_array(pattern_lengths),
+            'pattern_symbols': pack_array(pattern_symbols)
+        }
+
+    @classmethod
+    def from_data(cls, data):
+        """Rebuild a matcher saved by to_data() without re-adding patterns or recomputing failure links"""
+        matcher = cls()
+        symbols = list(data['symbols'])
+        matcher._fail = unpack_array(data['fail']).tolist()
+        matcher._goto = [{} for _ in matcher._fail]
+        edges = unpack_array(data['edges']).tolist()
+        for state, symbol, next_state in zip(edges[0::3], edges[1::3], edges[2::3]):
+            matcher._goto[state][symbols[symbol]] = next_state
+
+        hits, position = [], 0
+        pattern_symbols = unpack_array(data['pattern_symbols']).tolist()
+        for group, key, length in zip(data['groups'], data['keys'], unpack_array(data['pattern_lengths']).tolist()):
+            pattern = tuple(symbols[symbol] for symbol in pattern_symbols[position:position + length])
+            hits.append((group, key, pattern))
+            position += length
+
+        matcher._output, position = [], 0
+        outputs = unpack_array(data['outputs']).tolist()
+        for count in unpack_array(data['output_counts']).tolist():
+            matcher._output.append([hits[hit] for hit in outputs[position:position + count]])
+            position += count
+
+        matcher._built = True
+        return matcher
@@ -0,0 +1,300 @@
+import abc
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from frozen_kb import open_frozen, thaw, write_frozen
+
+logger = logging.getLogger(__name__)
+
+SECTION_EXTENSIONS = ('.json', '.yaml', '.yml')
+SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+FROZEN_EXTENSIONS = ('.kb',)
+
+
+class KnowledgeSource(abc.ABC):
+    """Where knowledge base sections are read from"""
+
+    @abc.abstractmethod
+    def versions(self):
+        """Return {section: version token}; a new token means the section changed"""
+
+    @abc.abstractmethod
+    def load(self, section):
+        """Parse and return one section"""
+
+    def prebuilt_index(self, name, version, sections, versions):
+        """Data of an index compiled into the source from exactly these section versions, or None"""
+        return None
+
+
+class DirectorySource(KnowledgeSource):
+    """One JSON or YAML file per section, e.g. knowledge/conditions.json"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _files(self):
+        files = {}
+        for filename in sorted(os.listdir(self.path)):
+            section, extension = os.path.splitext(filename)
+            if extension in SECTION_EXTENSIONS:
+                files[section] = os.path.join(self.path, filename)
+        return files
+
+    def versions(self):
+        versions = {}
+        for section, filename in self._files().items():
+            stat = os.stat(filename)
+            versions[section] = (stat.st_mtime_ns, stat.st_size)
+        return versions
+
+    def load(self, section):
+        filename = self._files()[section]
+        with open(filename, encoding='utf-8') as f:
+            if filename.endswith('.json'):
+                return json.load(f)
+            # Imported here so JSON and compiled knowledge bases never load PyYAML
+            try:
+                import yaml
+            except ImportError:
+                raise RuntimeError(f'PyYAML is required to read {filename}')
+            return yaml.safe_load(f)
+
+
+class SQLiteSource(KnowledgeSource):
+    """Sections stored as JSON documents in a SQLite 'sections' table"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _query(self, sql, params=()):
+        # Short-lived connections keep this safe across threads and forks
+        with sqlite3.connect(self.path) as db:
+            return db.execute(sql, params).fetchall()
+
+    def versions(self):
+        return {name: updated_at for name, updated_at in self._query('SELECT name, updated_at FROM sections')}
+
+    def load(self, section):
+        rows = self._query('SELECT body FROM sections WHERE name = ?', (section,))
+        if not rows:
+            raise KeyError(section)
+        return json.loads(rows[0][0])
+
+
+class FrozenSource(KnowledgeSource):
+    """Sections served from a memory-mapped frozen knowledge base file (see frozen_kb)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._stat = None
+        self._frozen = None
+        self._warned_version = None
+        self._lock = threading.Lock()
+        # Opened right away so an unusable file is known before anything is served from it
+        self._current()
+
+    def _current(self):
+        # The file is replaced atomically, so a new inode means a new image; the old mapping
+        # stays valid for snapshots still using it
+        stat = os.stat(self.path)
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if key != self._stat:
+                self._frozen = open_frozen(self.path)
+                self._stat = key
+            return self._frozen
+
+    def versions(self):
+        return dict(self._current().digests)
+
+    def load(self, section):
+        return self._current().section(section)
+
+    def prebuilt_index(self, name, version, sections, versions):
+        frozen = self._current()
+        compiled_version = frozen.metadata.get('index_version')
+        if compiled_version != version:
+            if self._warned_version != compiled_version:
+                self._warned_version = compiled_version
+                logger.warning(
+                    'Knowledge base artifact %s has index version %s, not %s; rebuilding its indexes',
+                    self.path, compiled_version, version
+                )
+            return None
+        if any(frozen.digests.get(section) != versions.get(section) for section in sections):
+            return None
+        return frozen.index(name)
+
+
+def open_source(path, artifact=None):
+    """Pick a source implementation from the configured path; a usable compiled artifact comes first"""
+    if artifact:
+        try:
+            return FrozenSource(artifact)
+        except (OSError, ValueError) as e:
+            logger.warning('Knowledge base artifact %s is unusable (%s); building from %s', artifact, e, path)
+    if path.endswith(SQLITE_EXTENSIONS):
+        return SQLiteSource(path)
+    if path.endswith(FROZEN_EXTENSIONS):
+        return FrozenSource(path)
+    return DirectorySource(path)
+
+
+class KnowledgeSnapshot:
+    """Immutable view of the knowledge base; sections and indexes load on first access"""
+
+    def __init__(self, store, versions, generation):
+        self.store = store
+        self.versions = versions
+        self.generation = generation
+        self.loaded_at = time.time()
+        self._sections = {}
+        self._indexes = {}
+        self._prebuilt = set()
+        self._lock = threading.RLock()
+
+    def __getitem__(self, section):
+        return self.section(section)
+
+    def section(self, name):
+        """Return a section, reading it from the source the first time"""
+        try:
+            return self._sections[name]
+        except KeyError:
+            pass
+
+        with self._lock:
+            if name not in self._sections:
+                if name not in self.versions:
+                    raise KeyError(f'Unknown knowledge base section: {name}')
+                self._sections[name] = self.store.source.load(name)
+            return self._sections[name]
+
+    def index(self, name):
+        """Return a derived index, building it the first time"""
+        try:
+            return self._indexes[name]
+        except KeyError:
+            pass
+
+        with self._lock:
+            if name not in self._indexes:
+                sections, builder, loader = self.store.index_builders[name]
+                data = None
+                if loader is not None:
+                    data = self.store.source.prebuilt_index(name, self.store.index_version, sections, self.versions)
+                if data is None:
+                    self._indexes[name] = builder(self)
+                else:
+                    self._indexes[name] = loader(self, data)
+                    self._prebuilt.add(name)
+            return self._indexes[name]
+
+    def summary(self):
+        return {
+            'generation': self.generation,
+            'loaded_at': self.loaded_at,
+            'sections': sorted(self.versions),
+            'loaded_sections': sorted(self._sections),
+            'built_indexes': sorted(self._indexes),
+            'prebuilt_indexes': sorted(self._prebuilt)
+        }
+
+
+class KnowledgeBase:
+    """Serves knowledge base snapshots and swaps in a new one when the source changes"""
+
+    def __init__(self, source, reload_interval=2.0, index_version=None):
+        self.source = source
+        self.reload_interval = reload_interval
+        self.index_version = index_version
+        self.index_builders = {}
+
+        self._reload_lock = threading.Lock()
+        self._checked_at = time.monotonic()
+        self._failed_versions = None
+        self._snapshot = KnowledgeSnapshot(self, source.versions(), 1)
+
+    def register_index(self, name, sections, builder, loader=None):
+        """Declare a derived index and the sections it is built from"""
+        # With a loader, compile() stores the index's to_data() and loader(snapshot, data) restores it
+        self.index_builders[name] = (frozenset(sections), builder, loader)
+
+    def warm(self):
+        """Load every section and build every index of the live snapshot"""
+        snapshot = self._snapshot
+        for name in snapshot.versions:
+            snapshot.section(name)
+        for name in self.index_builders:
+            snapshot.index(name)
+        return snapshot
+
+    def compile(self, path, metadata=None):
+        """Write every section, and every index that has a loader, into a frozen artifact; returns its size"""
+        snapshot = self.warm()
+        sections = {name: thaw(snapshot.section(name)) for name in snapshot.versions}
+        indexes = {
+            name: snapshot.index(name).to_data()
+            for name, (_, _, loader) in self.index_builders.items() if loader is not None
+        }
+        return write_frozen(sections, path, indexes, dict(metadata or {}, index_version=self.index_version))
+
+    def current(self):
+        """Return the live snapshot, kicking off a background reload check when due"""
+        if self.reload_interval and time.monotonic() - self._checked_at >= self.reload_interval:
+            self._checked_at = time.monotonic()
+            if not self._reload_lock.locked():
+                threading.Thread(target=self.reload, daemon=True).start()
+        return self._snapshot
+
+    def reload(self):
+        """Rebuild what changed and swap snapshots; returns True when a swap happened"""
+        # Only one rebuild at a time; requests keep using the old snapshot meanwhile
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+
+        versions = None
+        try:
+            old = self._snapshot
+            versions = self.source.versions()
+            changed = {
+                name for name in set(versions) | set(old.versions)
+                if versions.get(name) != old.versions.get(name)
+            }
+            if not changed or versions == self._failed_versions:
+                return False
+
+            new = KnowledgeSnapshot(self, versions, old.generation + 1)
+
+            # Carry over everything the changes did not touch
+            for name, data in old._sections.items():
+                if name in versions and name not in changed:
+                    new._sections[name] = data
+            for name, index in old._indexes.items():
+                if not self.index_builders[name][0] & changed:
+                    new._indexes[name] = index
+
+            # Warm whatever the old snapshot had in use before it goes live
+            for name in list(old._sections):
+                if name in versions:
+                    new.section(name)
+            for name in list(old._indexes):
+                new.index(name)
+
+            self._snapshot = new
+            logger.info('Knowledge base reloaded (generation %d, changed: %s)', new.generation, ', '.join(sorted(changed)))
+            return True
+
+        except Exception:
+            # A half-edited file must not take the service down; keep serving the old snapshot
+            self._failed_versions = versions
+            logger.exception('Knowledge base reload failed; keeping generation %d', self._snapshot.generation)
+            return False
+
+        finally:
+            self._reload_lock.release()
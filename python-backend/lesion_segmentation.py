@@ -0,0 +1,168 @@
+import time
+
+import numpy as np
+
+from color_stats import RED_PIXEL_THRESHOLD, redness_map
+
+# Longest side of the view segmentation runs on; lesions smaller than a few pixels here are noise anyway
+SEGMENTATION_MAX_SIDE = 256
+
+# Per-image wall-clock budget; past it segmentation gives up and whole-image stats are used
+SEGMENTATION_BUDGET_SECONDS = 0.05
+
+# A lesion pixel is at least this much redder than the median (background) pixel, in R - (G + B) / 2,
+# and red in absolute terms too
+LESION_CONTRAST = 20
+LESION_MIN_REDNESS = RED_PIXEL_THRESHOLD
+
+# Components covering less of the frame than this are dropped as speckle
+LESION_MIN_AREA = 0.0002
+
+# A mask with more row runs than this is texture, not discrete lesions
+MAX_RUNS = 8192
+
+# Components listed individually in the result, largest first
+MAX_REPORTED_COMPONENTS = 10
+
+# Three or more lesions whose centroids spread this little across their main axis form a line
+LINE_MAX_SPREAD_RATIO = 0.25
+
+# Lesions whose centroids all fall within this share of the frame diagonal form a cluster
+CLUSTER_MAX_EXTENT = 0.35
+
+
+def segmentation_view(image, max_side=SEGMENTATION_MAX_SIDE):
+    """Box-filtered RGB array of the image with its longest side at most max_side"""
+    factor = -(-max(image.size) // max_side)
+    if factor > 1:
+        image = image.reduce(factor)
+    return np.asarray(image)
+
+
+def lesion_mask(pixels):
+    """Pixels clearly redder than the image's median pixel"""
+    # redness_map is 2R - G - B, twice R - (G + B) / 2
+    redness = redness_map(pixels)
+    background = np.median(redness)
+    threshold = max(background + 2 * LESION_CONTRAST, 2 * LESION_MIN_REDNESS)
+    return redness > threshold
+
+
+def mask_runs(mask):
+    """Horizontal runs of set pixels as (row, start, end) arrays, end exclusive, in row-major order"""
+    height, width = mask.shape
+    padded = np.zeros((height, width + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    return rows, starts, ends
+
+
+def touching_runs(rows, starts, ends, width):
+    """Index pairs of runs on adjacent rows that touch, diagonals included"""
+    # Runs sort by (row, column) when keyed as row * stride + column; a run on the row below touches
+    # the runs above whose end reaches its start - 1 and whose start is at most its end
+    stride = width + 4
+    start_keys = rows * stride + starts
+    end_keys = rows * stride + ends - 1
+    below = np.flatnonzero(rows > 0)
+    above_row = (rows[below] - 1) * stride
+    first = np.searchsorted(end_keys, above_row + starts[below] - 1, side='left')
+    last = np.searchsorted(start_keys, above_row + ends[below], side='right')
+    counts = np.maximum(last - first, 0)
+    lower = np.repeat(below, counts)
+    upper = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(int(counts.sum()))
+    return upper, lower
+
+
+def label_runs(run_count, upper, lower, deadline):
+    """Component label per run: min-label propagation with pointer jumping; None past the deadline"""
+    labels = np.arange(run_count)
+    while True:
+        if time.perf_counter() > deadline:
+            return None
+        merged = np.minimum(labels[upper], labels[lower])
+        updated = labels.copy()
+        np.minimum.at(updated, upper, merged)
+        np.minimum.at(updated, lower, merged)
+        # Each run then adopts its label's label, collapsing chains in a few rounds
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+def lesion_layout(centroids, width, height):
+    """How the lesions are arranged: none, single, pair, line, cluster or scattered"""
+    if len(centroids) < 3:
+        return ('none', 'single', 'pair')[len(centroids)]
+
+    centered = centroids - centroids.mean(axis=0)
+    spreads = np.linalg.svd(centered, compute_uv=False)
+    if spreads[1] <= LINE_MAX_SPREAD_RATIO * spreads[0]:
+        return 'line'
+
+    extent = np.hypot(*(centroids.max(axis=0) - centroids.min(axis=0)))
+    return 'cluster' if extent <= CLUSTER_MAX_EXTENT * np.hypot(width, height) else 'scattered'
+
+
+def segment_lesions(image, budget=SEGMENTATION_BUDGET_SECONDS):
+    """Lesion count, area, centroid, layout and lesion-only color of an RGB image; None if over budget"""
+    deadline = time.perf_counter() + budget
+    pixels = segmentation_view(image)
+    height, width = pixels.shape[:2]
+    pixel_count = width * height
+
+    rows, starts, ends = mask_runs(lesion_mask(pixels))
+    if len(rows) > MAX_RUNS or time.perf_counter() > deadline:
+        return None
+
+    labels = label_runs(len(rows), *touching_runs(rows, starts, ends, width), deadline)
+    if labels is None:
+        return None
+
+    # Per-component sums straight from the runs: area, x and y moments
+    lengths = ends - starts
+    _, components = np.unique(labels, return_inverse=True)
+    areas = np.bincount(components, weights=lengths)
+    sum_x = np.bincount(components, weights=lengths * (starts + ends - 1) / 2)
+    sum_y = np.bincount(components, weights=lengths * rows)
+
+    keep = np.flatnonzero(areas >= max(1, LESION_MIN_AREA * pixel_count))
+    keep = keep[np.argsort(-areas[keep], kind='stable')]
+    if not len(keep):
+        return {
+            'count': 0,
+            'area_ratio': 0.0,
+            'centroid': None,
+            'layout': 'none',
+            'redness_level': None,
+            'color_profile': None,
+            'components': []
+        }
+
+    # Lesion-only color: the kept runs' pixels, gathered without a Python loop
+    kept_runs = np.flatnonzero(np.isin(components, keep))
+    run_lengths = lengths[kept_runs]
+    offsets = rows[kept_runs] * width + starts[kept_runs]
+    flat = np.repeat(offsets - np.cumsum(run_lengths) + run_lengths, run_lengths) + np.arange(int(run_lengths.sum()))
+    lesion_pixels = pixels.reshape(-1, 3)[flat].astype(np.float64)
+    red, green, blue = lesion_pixels.mean(axis=0)
+
+    centroids = np.column_stack((sum_x[keep] / areas[keep], sum_y[keep] / areas[keep]))
+    lesion_area = areas[keep].sum()
+    scale = np.array([width, height], dtype=np.float64)
+
+    return {
+        'count': len(keep),
+        'area_ratio': round(float(lesion_area / pixel_count), 4),
+        'centroid': [round(float(value), 4) for value in (areas[keep] @ centroids) / lesion_area / scale],
+        'layout': lesion_layout(centroids, width, height),
+        'redness_level': float(red - (green + blue) / 2),
+        'color_profile': {'red': float(red), 'green': float(green), 'blue': float(blue)},
+        'components': [{
+            'area_ratio': round(float(areas[idx] / pixel_count), 4),
+            'centroid': [round(float(value), 4) for value in centroid / scale]
+        } for idx, centroid in zip(keep[:MAX_REPORTED_COMPONENTS], centroids)]
+    }
@@ -0,0 +1,255 @@
+import abc
+import bisect
+import math
+import threading
+import time
+
+# Seconds; spans sub-millisecond routing up to multi-second image decodes
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0
+)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in labels) + '}'
+
+
+class _Timer:
+    """Context manager observing the elapsed time into a histogram child"""
+    __slots__ = ('child', 'started')
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.child.observe(time.perf_counter() - self.started)
+        return False
+
+
+class CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # counts[i] holds observations in (bounds[i-1], bounds[i]]; the last slot is +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        slot = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[slot] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+    def quantile(self, fraction):
+        """Upper bucket bound holding the given fraction of observations"""
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return math.inf
+
+
+class _Metric(abc.ABC):
+    """A named metric with one child per label combination"""
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self.labels()
+
+    @abc.abstractmethod
+    def _new_child(self):
+        """A fresh child holding one label combination's values"""
+
+    def labels(self, **labels):
+        """Return the child for a label combination; keep it around on hot paths"""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def children(self):
+        with self._lock:
+            return sorted(self._children.items())
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return CounterChild()
+
+    def inc(self, amount=1, **labels):
+        self.labels(**labels).inc(amount)
+
+    def render(self):
+        for key, child in self.children():
+            yield f'{self.name}{_format_labels(zip(self.labelnames, key))} {_format_value(child.value)}'
+
+    def summary(self):
+        return {','.join(key) or 'total': child.value for key, child in self.children()}
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value, **labels):
+        self.labels(**labels).observe(value)
+
+    def time(self, **labels):
+        return self.labels(**labels).time()
+
+    def render(self):
+        for key, child in self.children():
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += count
+                yield f'{self.name}_bucket{_format_labels(labels + [("le", _format_value(bound))])} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(labels)} {_format_value(child.sum)}'
+            yield f'{self.name}_count{_format_labels(labels)} {child.count}'
+
+    def summary(self):
+        summary = {}
+        for key, child in self.children():
+            p50, p95 = child.quantile(0.5), child.quantile(0.95)
+            summary[','.join(key) or 'total'] = {
+                'count': child.count,
+                'mean_ms': round(child.sum / child.count * 1000, 4) if child.count else 0.0,
+                # Bucket upper bounds, so these over-estimate by at most one bucket
+                'p50_ms_le': None if p50 is None or p50 == math.inf else p50 * 1000,
+                'p95_ms_le': None if p95 is None or p95 == math.inf else p95 * 1000
+            }
+        return summary
+
+
+class MetricsRegistry:
+    """Process-local metrics; each server worker process keeps and serves its own"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Metric already registered: {metric.name}')
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        return {name: metric.summary() for name, metric in self._metrics.items()}
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'chatbot_stage_seconds',
+    'Time spent in each processing stage (routing includes keyword_match)',
+    ['stage']
+)
+ROUTE = REGISTRY.counter(
+    'chatbot_route_total',
+    'Chat replies by the routing branch that answered',
+    ['branch']
+)
+HTTP_REQUESTS = REGISTRY.counter(
+    'chatbot_http_requests_total',
+    'HTTP requests by route, method and status',
+    ['route', 'method', 'status']
+)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'chatbot_http_request_seconds',
+    'Time to build each HTTP response (streamed bodies: until the first byte)',
+    ['route']
+)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def stage_timer(stage):
+    """Timer for one named stage; call once at import time and reuse"""
+    return STAGE_SECONDS.labels(stage=stage)
+
+
+def timed_iter(iterable, child):
+    """Yield from iterable, timing only the work done inside it (not the consumer's)"""
+    elapsed = 0.0
+    started = time.perf_counter()
+    try:
+        for item in iterable:
+            elapsed += time.perf_counter() - started
+            yield item
+            started = time.perf_counter()
+        elapsed += time.perf_counter() - started
+    finally:
+        child.observe(elapsed)
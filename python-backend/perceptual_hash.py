@@ -0,0 +1,156 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from color_stats import redness_map
+
+HASH_BITS = 64
+
+# The hash is split into this many 16-bit chunks, each indexed in its own table
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+# Luma weights (ITU-R BT.601), the same mix Pillow's 'L' mode uses
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+_BIT_WEIGHTS = 1 << np.arange(HASH_BITS - 1, -1, -1, dtype=np.uint64)
+
+# Hashes with fewer set or fewer clear bits than this come from flat or evenly shaded frames;
+# unrelated photos of plain skin share them, so they never count as near-duplicates
+MIN_DETAIL_BITS = 8
+
+# Side of the redness thumbnail compared before a near-duplicate's analysis is reused
+REDNESS_GRID_SIDE = 32
+
+
+def difference_hash(image):
+    """64-bit dHash: whether brightness rises left to right across a 9x8 grayscale thumbnail"""
+    # Box-filtered down from the already reduced analysis image, so this costs microseconds
+    thumbnail = np.asarray(image.resize((9, 8), Image.BOX), dtype=np.float32)
+    gray = thumbnail @ _LUMA if thumbnail.ndim == 3 else thumbnail
+    bits = (gray[:, 1:] > gray[:, :-1]).ravel()
+    return int(np.dot(bits.astype(np.uint64), _BIT_WEIGHTS))
+
+
+def low_detail(image_hash):
+    """Whether a hash is (nearly) all zeros or all ones and says little about the photo"""
+    set_bits = image_hash.bit_count()
+    return min(set_bits, HASH_BITS - set_bits) < MIN_DETAIL_BITS
+
+
+def redness_grid(image, side=REDNESS_GRID_SIDE):
+    """2R - G - B of a side x side box-filtered thumbnail; a small bite moves its cell by tens of levels"""
+    thumbnail = np.asarray(image.resize((side, side), Image.BOX), dtype=np.int16)
+    return redness_map(thumbnail)
+
+
+def redness_delta(a, b):
+    """Largest per-cell difference between two redness grids"""
+    return int(np.abs(a - b).max())
+
+
+def hamming_distance(a, b):
+    return (a ^ b).bit_count()
+
+
+def _chunks(image_hash):
+    return [(image_hash >> (CHUNK_BITS * idx)) & CHUNK_MASK for idx in range(CHUNKS)]
+
+
+def _neighbors(chunk, radius):
+    """Every chunk value within radius bits of chunk (radius 0 or 1)"""
+    yield chunk
+    if radius >= 1:
+        for bit in range(CHUNK_BITS):
+            yield chunk ^ (1 << bit)
+
+
+class NearDuplicateIndex:
+    """Values keyed by perceptual hash, found again by any hash within max_distance bits (LRU-bounded)"""
+
+    # Multi-index hashing: each hash is filed under its CHUNKS chunks, one table per chunk.
+    # Two hashes at most max_distance bits apart differ in at most max_distance // CHUNKS bits
+    # in some chunk (pigeonhole), so probing every table within that radius finds all of them.
+    # A lookup is a fixed 68 probes into buckets holding about entries / 65536 hashes each,
+    # and unlike a BK-tree, entries can be evicted without rebuilding anything.
+
+    def __init__(self, max_entries=4096, max_distance=6):
+        if max_distance // CHUNKS > 1:
+            raise ValueError(f'max_distance must be below {2 * CHUNKS}')
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self._entries = OrderedDict()
+        self._tables = [{} for _ in range(CHUNKS)]
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def find(self, image_hash, accept=None):
+        """Nearest stored (hash, distance, value) within max_distance that accept() agrees to, or None"""
+        radius = self.max_distance // CHUNKS
+        with self._lock:
+            found = set()
+            for table, chunk in zip(self._tables, _chunks(image_hash)):
+                for probe in _neighbors(chunk, radius):
+                    found.update(table.get(probe, ()))
+
+            matches = sorted(
+                (distance, stored) for stored in found
+                if (distance := hamming_distance(image_hash, stored)) <= self.max_distance
+            )
+            for distance, stored in matches:
+                value = self._entries[stored]
+                if accept is None or accept(value):
+                    self._entries.move_to_end(stored)
+                    self.hits += 1
+                    return stored, distance, value
+
+            self.misses += 1
+            return None
+
+    def add(self, image_hash, value):
+        """Store a value under a hash, evicting the least recently used past max_entries"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if image_hash in self._entries:
+                self._entries.move_to_end(image_hash)
+            else:
+                for table, chunk in zip(self._tables, _chunks(image_hash)):
+                    table.setdefault(chunk, set()).add(image_hash)
+            self._entries[image_hash] = value
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._remove(evicted)
+
+    def _remove(self, image_hash):
+        for table, chunk in zip(self._tables, _chunks(image_hash)):
+            bucket = table[chunk]
+            bucket.discard(image_hash)
+            if not bucket:
+                del table[chunk]
+
+    def clear(self):
+        """Forget every stored hash"""
+        with self._lock:
+            self._entries.clear()
+            for table in self._tables:
+                table.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'max_distance': self.max_distance,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,48 @@
+import threading
+
+
+def query_key(message, content_tokens, hits):
+    """Cache key under which messages always route and render identically"""
+    # Retrieval scores the set of content tokens; the rule-based branches only see matcher hits,
+    # which also capture whatever word order a phrase pattern or phrase synonym depended on
+    words = sorted(set(content_tokens))
+    patterns = sorted({
+        ' '.join(pattern) for group in hits.values() for patterns in group.values() for pattern in patterns
+    })
+    # Very short messages get the welcome text, so the length check is part of the key
+    long_enough = bool(message and len(message.strip()) > 3)
+    return f"{int(long_enough)}|{' '.join(words)}|{'|'.join(patterns)}"
+
+
+class QueryCache:
+    """Per-query routing results, discarded whenever the knowledge base generation changes"""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.generation = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.cache.max_entries > 0
+
+    def _key(self, snapshot, key):
+        # Requests still pinned to an older snapshot use their own generation's keys
+        if self.generation is None or snapshot.generation > self.generation:
+            with self._lock:
+                if self.generation is None or snapshot.generation > self.generation:
+                    self.cache.clear()
+                    self.generation = snapshot.generation
+        return f'{snapshot.generation}:{key}'
+
+    def get(self, snapshot, key):
+        return self.cache.get(self._key(snapshot, key))
+
+    def set(self, snapshot, key, value, size=None):
+        self.cache.set(self._key(snapshot, key), value, size)
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        return dict(self.cache.stats(), generation=self.generation)
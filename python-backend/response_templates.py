@@ -0,0 +1,231 @@
+IMAGE_RESPONSE = """## 🔬 Medical Image Analysis Complete
+
+**Condition Identified:** {name}  
+**Confidence Level:** {confidence}%  
+**Medical Specialty:** {category}
+
+### 📊 Image Analysis Results
+- **Resolution:** {{width}}x{{height}} pixels
+- **Redness Level:** {{redness_level:.1f}}/100
+- **Color Profile:** R:{{red:.0f}} G:{{green:.0f}} B:{{blue:.0f}}{{lesion_summary}}
+
+### 📋 Clinical Assessment
+{description}
+
+### 💊 Recommended Treatment
+{treatment}
+### 🛡️ Prevention Measures
+{prevention}{when_to_seek}
+
+*⚕️ This analysis uses computer vision algorithms. Please consult a healthcare provider for definitive diagnosis.*"""
+
+CONDITION_RESPONSE = """## 🔍 Symptom Analysis Results
+
+**Likely Condition:** {name}  
+**Match Confidence:** {{confidence}}%  
+**Medical Specialty:** {category}  
+**Symptoms Detected:** {{matched_symptoms}}
+
+### 📋 Condition Overview
+{description}
+
+### 💊 Treatment Protocol
+{treatment}
+### 🛡️ Prevention Guidelines
+{prevention}
+
+*⚕️ AI-powered symptom analysis. Please consult a healthcare provider for proper diagnosis and treatment.*"""
+
+# Responses stream section by section: each '### ' heading and the closing disclaimer start a new chunk
+SECTION_MARKERS = ('\n### ', '\n*⚕️')
+
+
+def _escape(text):
+    """Protect literal braces in knowledge base text from str.format"""
+    return str(text).replace('{', '{{').replace('}', '}}')
+
+
+def numbered_list(items):
+    return ''.join(f"{idx}. {item}\n" for idx, item in enumerate(items, 1))
+
+
+def bullet_list(items):
+    return ''.join(f"- {item}\n" for item in items)
+
+
+def lesion_summary(lesions):
+    """Extra result line describing segmented lesions; empty when none were found"""
+    if not lesions or not lesions['count']:
+        return ''
+    count = lesions['count']
+    arrangement = {
+        'line': f'{count} lesions in a line',
+        'cluster': f'{count} lesions in a cluster',
+        'scattered': f'{count} scattered lesions'
+    }.get(lesions['layout'], f"{count} lesion{'s' if count > 1 else ''}")
+    return f"\n- **Lesions:** {arrangement}, {lesions['area_ratio'] * 100:.1f}% of the image"
+
+
+def compile_condition_fields(condition):
+    """Render the static parts of a condition entry once"""
+    when_to_seek = ''
+    if 'whenToSeek' in condition:
+        when_to_seek = "\n### 🚨 Seek Medical Attention If:\n" + bullet_list(condition['whenToSeek'])
+
+    return {
+        'name': _escape(condition['name']),
+        'confidence': int(condition['confidence'] * 100),
+        'category': _escape(condition['category']),
+        'description': _escape(condition['description']),
+        'treatment': _escape(numbered_list(condition['treatment'])),
+        'prevention': _escape(numbered_list(condition['prevention'])),
+        'when_to_seek': _escape(when_to_seek)
+    }
+
+
+def split_sections(text):
+    """Split a response at its section headings; joining the parts gives the text back"""
+    starts = {0}
+    for marker in SECTION_MARKERS:
+        idx = text.find(marker)
+        while idx != -1:
+            starts.add(idx + 1)
+            idx = text.find(marker, idx + 1)
+    bounds = sorted(starts) + [len(text)]
+    return tuple(text[start:end] for start, end in zip(bounds, bounds[1:]) if start < end)
+
+
+def compile_image_template(condition):
+    return split_sections(IMAGE_RESPONSE.format(**compile_condition_fields(condition)))
+
+
+def compile_condition_template(condition):
+    return split_sections(CONDITION_RESPONSE.format(**compile_condition_fields(condition)))
+
+
+def iter_symptom_sections(symptom_data):
+    """Yield a symptom entry's response section by section"""
+    yield f"""## {symptom_data['name']}
+**Medical Specialty:** {symptom_data['category']}
+
+"""
+
+    if 'types' in symptom_data:
+        section = "### Types & Management\n\n"
+        for type_info in symptom_data['types'].values():
+            section += f"**{type_info['description']}**\n"
+            if 'symptoms' in type_info:
+                section += "Symptoms: " + ", ".join(type_info['symptoms']) + "\n\n"
+            section += "Treatment:\n" + numbered_list(type_info['treatment']) + "\n"
+        yield section
+
+    if 'treatment' in symptom_data:
+        yield "### 💊 Treatment Recommendations\n" + numbered_list(symptom_data['treatment']) + "\n"
+
+    if 'red_flags' in symptom_data:
+        yield "### 🚨 Warning Signs - Seek Immediate Medical Care\n" + bullet_list(symptom_data['red_flags'])
+
+    yield "\n\n*⚕️ This information is for educational purposes. Always consult a healthcare professional for personalized medical advice.*"
+
+
+def render_symptom_response(symptom_data):
+    """Fully render a symptom entry; it has no per-request fields"""
+    return ''.join(iter_symptom_sections(symptom_data))
+
+
+class ResponseTemplates:
+    """Responses pre-rendered from the knowledge base, leaving only per-request fields"""
+
+    FIELDS = ('image', 'condition', 'symptom', 'health_keyword', 'contextual', 'general', 'welcome', 'follow_up')
+
+    def __init__(self, knowledge):
+        conditions = knowledge['conditions']
+        self.image = {key: compile_image_template(data) for key, data in conditions.items()}
+        self.condition = {key: compile_condition_template(data) for key, data in conditions.items()}
+        self.symptom = {key: tuple(iter_symptom_sections(data)) for key, data in knowledge['symptoms'].items()}
+        self.health_keyword = {key: split_sections(text) for key, text in knowledge['health_keywords'].items()}
+        self.contextual = {key: split_sections(text) for key, text in knowledge['contextual_responses'].items()}
+        self.general = split_sections(knowledge['messages']['general'])
+        self.welcome = split_sections(knowledge['messages']['welcome'])
+        self.follow_up = knowledge['messages'].get('follow_up', '')
+
+    def to_data(self):
+        """Every pre-rendered response, for a compiled knowledge base artifact"""
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    @classmethod
+    def from_data(cls, data):
+        """Templates saved by to_data(), served straight from the artifact without copying"""
+        templates = cls.__new__(cls)
+        for name in cls.FIELDS:
+            setattr(templates, name, data[name])
+        return templates
+
+    def iter_contextual(self, category, original_message):
+        """Yield a question category's response with the user's message quoted back"""
+        for section in self.contextual[category]:
+            yield section.format(original_message=original_message)
+
+    def iter_general(self, original_message):
+        """Yield the general guidance response with the user's message quoted back"""
+        for section in self.general:
+            yield section.format(original_message=original_message)
+
+    def iter_image(self, image_analysis):
+        """Yield a condition's image template section by section, filled with the measured metrics"""
+        condition_key = image_analysis.get('condition_key')
+        sections = self.image.get(condition_key) or compile_image_template(image_analysis['condition'])
+        analysis = image_analysis['analysis']
+        color_profile = analysis['color_profile']
+        fields = {
+            'width': analysis['width'],
+            'height': analysis['height'],
+            'redness_level': analysis['redness_level'],
+            'red': color_profile['red'],
+            'green': color_profile['green'],
+            'blue': color_profile['blue'],
+            'lesion_summary': lesion_summary(analysis.get('lesions'))
+        }
+        for section in sections:
+            yield section.format(**fields)
+
+    def iter_condition(self, condition_match):
+        """Yield a condition's symptom-match template section by section, filled with its score and matches"""
+        condition_key = condition_match.get('condition_key')
+        sections = self.condition.get(condition_key) or compile_condition_template(condition_match['condition'])
+        fields = {
+            'confidence': min(95, 65 + condition_match['score'] * 5),
+            'matched_symptoms': ', '.join(condition_match['matched_symptoms'])
+        }
+        for section in sections:
+            yield section.format(**fields)
+
+    def iter_branch(self, branch, detail, original_message):
+        """Sections answering a routing decision; detail is whatever the branch was routed on"""
+        if branch == 'image':
+            return self.iter_image(detail)
+        if branch == 'symptom_query':
+            return self.symptom[detail]
+        if branch == 'condition':
+            return self.iter_condition(detail)
+        if branch == 'health_keyword':
+            return self.health_keyword[detail]
+        if branch == 'intelligent_category':
+            return self.iter_contextual(detail, original_message)
+        if branch == 'general':
+            return self.iter_general(original_message)
+        return self.welcome
+
+    def iter_follow_up(self, topic_message, branch, detail, original_message):
+        """Sections answering a follow-up, led by a note naming the earlier question it continues"""
+        if self.follow_up:
+            yield self.follow_up.format(topic_message=topic_message or 'your uploaded image')
+        yield from self.iter_branch(branch, detail, original_message)
+
+    def render_image(self, image_analysis):
+        """Fill a condition's image template with the measured metrics"""
+        return ''.join(self.iter_image(image_analysis))
+
+    def render_condition(self, condition_match):
+        """Fill a condition's symptom-match template with its score and matches"""
+        return ''.join(self.iter_condition(condition_match))
@@ -0,0 +1,144 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """Bounded LRU/TTL cache for JSON-serializable results, optionally persisted to SQLite"""
+
+    def __init__(self, max_entries=256, max_bytes=8 * 1024 * 1024, ttl=3600, path=None, max_disk_entries=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.path = path
+        self.max_disk_entries = max_disk_entries or max_entries * 10
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, _, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._discard(key)
+
+            value = self._disk_get(key, now) if self.path else None
+            if value is None:
+                self.misses += 1
+                return None
+
+            # Promote disk hits into memory
+            self._store(key, value, len(json.dumps(value)), now)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, size=None):
+        """Cache a value, evicting least recently used entries past the limits"""
+        # Callers that know a value's footprint can skip the encoding when there is no disk tier
+        encoded = json.dumps(value) if size is None or self.path else None
+        if size is None:
+            size = len(encoded)
+        if size > self.max_bytes:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._store(key, value, size, now)
+            if self.path:
+                self._disk_set(key, encoded, now)
+
+    def clear(self):
+        """Drop every in-memory entry (the disk backend is left alone)"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Entry, byte and hit/miss counters for health reporting"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'disk': self.path
+            }
+
+    def _store(self, key, value, size, now):
+        self._discard(key)
+        self._entries[key] = (now + self.ttl, size, value)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def _connection(self):
+        # SQLite connections must not cross a fork, so open one per process
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS results '
+                '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+            )
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _disk_get(self, key, now):
+        try:
+            db = self._connection()
+            row = db.execute('SELECT value, expires_at FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                db.execute('DELETE FROM results WHERE key = ?', (key,))
+                db.commit()
+                return None
+            db.execute('UPDATE results SET accessed_at = ? WHERE key = ?', (now, key))
+            db.commit()
+            return json.loads(row[0])
+        except sqlite3.Error:
+            return None
+
+    def _disk_set(self, key, encoded, now):
+        try:
+            db = self._connection()
+            db.execute(
+                'INSERT OR REPLACE INTO results (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, encoded, now + self.ttl, now)
+            )
+            db.execute('DELETE FROM results WHERE expires_at <= ?', (now,))
+            db.execute(
+                'DELETE FROM results WHERE key NOT IN '
+                '(SELECT key FROM results ORDER BY accessed_at DESC LIMIT ?)',
+                (self.max_disk_entries,)
+            )
+            db.commit()
+        except sqlite3.Error:
+            # The disk tier is best effort; the memory tier still works
+            pass
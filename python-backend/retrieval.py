@@ -0,0 +1,195 @@
+import math
+import zlib
+from functools import lru_cache
+
+import numpy as np
+
+from frozen_kb import pack_array, unpack_array
+from text_normalizer import TextNormalizer
+
+# Hashed feature space; collisions at this size are rare for a knowledge base vocabulary
+FEATURE_BITS = 20
+FEATURE_MASK = (1 << FEATURE_BITS) - 1
+NGRAM_SIZES = (3, 4, 5)
+
+
+def whole_word_feature(word):
+    """The feature of a word as a whole token, as opposed to its n-grams"""
+    return zlib.crc32(f'w:{word}'.encode()) & FEATURE_MASK
+
+
+@lru_cache(maxsize=65536)
+def word_features(word):
+    """Hashed features of one word: the word itself plus its padded character n-grams"""
+    padded = f' {word} '
+    features = {whole_word_feature(word)}
+    for size in NGRAM_SIZES:
+        for start in range(len(padded) - size + 1):
+            features.add(zlib.crc32(padded[start:start + size].encode()) & FEATURE_MASK)
+    return tuple(features)
+
+
+def token_features(tokens):
+    """Feature id -> count over a text's content tokens"""
+    counts = {}
+    for word in tokens:
+        for feature in word_features(word):
+            counts[feature] = counts.get(feature, 0) + 1
+    return counts
+
+
+class RetrievalIndex:
+    """TF-IDF over hashed word and character n-gram features, stored column-wise (CSC) in NumPy arrays"""
+
+    ARRAYS = ('feature_ids', 'idf', 'rows', 'weights', 'indptr')
+
+    def __init__(self, documents, tokenize=None):
+        # documents: (kind, key, text) triples; rows keep this order. tokenize turns documents and
+        # queries alike into content tokens, normally the knowledge base's TextNormalizer
+        self.tokenize = tokenize or TextNormalizer().content_tokens
+        self.keys = [key for _, key, _ in documents]
+        self.kind_rows = {}
+        for row, (kind, _, _) in enumerate(documents):
+            self.kind_rows.setdefault(kind, []).append(row)
+        self.kind_rows = {kind: np.array(rows, dtype=np.int64) for kind, rows in self.kind_rows.items()}
+
+        doc_features = [token_features(self.tokenize(text)) for _, _, text in documents]
+        document_count = len(documents)
+
+        document_frequency = {}
+        for counts in doc_features:
+            for feature in counts:
+                document_frequency[feature] = document_frequency.get(feature, 0) + 1
+
+        self.feature_ids = np.array(sorted(document_frequency), dtype=np.int64)
+        self.idf = np.array(
+            [math.log((1 + document_count) / (1 + document_frequency[f])) + 1 for f in self.feature_ids.tolist()],
+            dtype=np.float32
+        )
+        column_of = {feature: column for column, feature in enumerate(self.feature_ids.tolist())}
+
+        # Sublinear TF x IDF, L2-normalized per document so scores are cosine similarities
+        columns, rows, counts = [], [], []
+        for row, doc_counts in enumerate(doc_features):
+            columns.extend(column_of[f] for f in doc_counts)
+            counts.extend(doc_counts.values())
+            rows.extend([row] * len(doc_counts))
+        columns = np.array(columns, dtype=np.int64)
+        rows = np.array(rows, dtype=np.int32)
+        weights = (1 + np.log(np.array(counts, dtype=np.float32))) * self.idf[columns]
+        norms = np.sqrt(np.bincount(rows, weights=weights * weights, minlength=document_count))
+        weights = (weights / norms[rows]).astype(np.float32)
+
+        order = np.argsort(columns, kind='stable')
+        self.rows = rows[order]
+        self.weights = weights[order]
+        self.indptr = np.zeros(len(self.feature_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(columns, minlength=len(self.feature_ids)), out=self.indptr[1:])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def to_data(self):
+        """Keys and arrays for a compiled knowledge base artifact"""
+        return {
+            'keys': self.keys,
+            'kind_rows': {kind: pack_array(rows) for kind, rows in self.kind_rows.items()},
+            'arrays': {name: pack_array(getattr(self, name)) for name in self.ARRAYS}
+        }
+
+    @classmethod
+    def from_data(cls, data, tokenize=None):
+        """Restore an index saved by to_data(); the arrays stay in the artifact, shared between processes"""
+        index = cls.__new__(cls)
+        index.tokenize = tokenize or TextNormalizer().content_tokens
+        index.keys = list(data['keys'])
+        index.kind_rows = {kind: np.asarray(unpack_array(rows)) for kind, rows in data['kind_rows'].items()}
+        for name in cls.ARRAYS:
+            setattr(index, name, np.asarray(unpack_array(data['arrays'][name])))
+        return index
+
+    def query_vector(self, text):
+        """Column indices and weights of a binary, IDF-weighted, L2-normalized query vector"""
+        features = set()
+        for word in set(self.tokenize(text)):
+            features.update(word_features(word))
+        if not features or not len(self.feature_ids):
+            return None, None
+
+        ids = np.fromiter(features, dtype=np.int64, count=len(features))
+        columns = self._columns(ids)
+        weights = self.idf[columns]
+
+        # Features no document has get the rarest IDF: they still count toward the norm,
+        # so words the knowledge base has never seen pull the similarity down
+        unseen = len(ids) - len(columns)
+        norm = math.sqrt(float(np.dot(weights, weights)) + unseen * float(self.idf.max(initial=1.0)) ** 2)
+        return columns, weights / norm
+
+    def scores(self, text):
+        """Cosine similarity of the text to every document, as one sparse matrix-vector product"""
+        columns, query_weights = self.query_vector(text)
+        scores = np.zeros(len(self.keys), dtype=np.float32)
+        if columns is None or not len(columns):
+            return scores
+
+        offsets, lengths = self._nonzeros(columns)
+        if not len(offsets):
+            return scores
+
+        return np.bincount(
+            self.rows[offsets],
+            weights=self.weights[offsets] * np.repeat(query_weights, lengths),
+            minlength=len(self.keys)
+        ).astype(np.float32)
+
+    def token_matches(self, text):
+        """Which documents share at least one whole normalized token with the text"""
+        matches = np.zeros(len(self.keys), dtype=bool)
+        words = set(self.tokenize(text))
+        if not words or not len(self.feature_ids):
+            return matches
+        ids = np.array(sorted({whole_word_feature(word) for word in words}), dtype=np.int64)
+        offsets, _ = self._nonzeros(self._columns(ids))
+        matches[self.rows[offsets]] = True
+        return matches
+
+    def _columns(self, ids):
+        """Column indices of the feature ids the index knows; unknown ids are dropped"""
+        positions = np.searchsorted(self.feature_ids, ids)
+        positions[positions == len(self.feature_ids)] = 0
+        return positions[self.feature_ids[positions] == ids]
+
+    def _nonzeros(self, columns):
+        """Offsets of every nonzero in the given columns, and each column's nonzero count"""
+        starts, ends = self.indptr[columns], self.indptr[columns + 1]
+        lengths = ends - starts
+        # Gathered without a Python loop: each column's run of offsets, back to back
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(int(lengths.sum()))
+        return offsets, lengths
+
+    def _top(self, scores, kind, top_k, min_score):
+        rows = self.kind_rows.get(kind)
+        if rows is None or top_k <= 0:
+            return []
+        kind_scores = scores[rows]
+        candidates = np.flatnonzero(kind_scores > min_score)
+        if len(candidates) > top_k:
+            # Keep everything tied with the k-th best so the sort below can break ties fairly
+            cutoff = np.partition(kind_scores[candidates], len(candidates) - top_k)[len(candidates) - top_k]
+            candidates = candidates[kind_scores[candidates] >= cutoff]
+        # Best first; ties keep document (knowledge base) order
+        order = candidates[np.lexsort((candidates, -kind_scores[candidates]))][:top_k]
+        return [(self.keys[rows[idx]], round(float(kind_scores[idx]), 4)) for idx in order]
+
+    def rank(self, text, kind, top_k=5, min_score=0.0, token_match=False):
+        """Best documents of one kind as (key, score) pairs; token_match drops those sharing no whole token"""
+        scores = self.scores(text)
+        if token_match:
+            scores[~self.token_matches(text)] = 0.0
+        return self._top(scores, kind, top_k, min_score)
+
+    def search(self, text, top_k=5, min_score=0.0):
+        """Ranked documents of every kind from a single scoring pass"""
+        scores = self.scores(text)
+        return {kind: self._top(scores, kind, top_k, min_score) for kind in self.kind_rows}
@@ -0,0 +1,103 @@
+import argparse
+import gc
+import os
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def add_serve_command(commands):
+    """Register the 'serve' subcommand; every option can also come from the environment"""
+    parser = commands.add_parser('serve', help='Run the API under a multi-worker production server')
+    parser.add_argument('--host', default=os.environ.get('CHATBOT_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=env_int('CHATBOT_PORT', 5000))
+    parser.add_argument('--workers', type=int, default=env_int('CHATBOT_WORKERS', os.cpu_count() or 1),
+                        help='Worker processes (default: one per core)')
+    parser.add_argument('--threads', type=int, default=env_int('CHATBOT_THREADS', 4),
+                        help='Request threads per worker')
+    parser.add_argument('--keepalive', type=int, default=env_int('CHATBOT_KEEPALIVE', 5),
+                        help='Seconds to hold idle keep-alive connections')
+    parser.add_argument('--timeout', type=int, default=env_int('CHATBOT_TIMEOUT', 60),
+                        help='Seconds before a stuck worker is restarted')
+    parser.add_argument('--graceful-timeout', type=int, default=env_int('CHATBOT_GRACEFUL_TIMEOUT', 30),
+                        help='Seconds in-flight requests get to finish on shutdown')
+    parser.add_argument('--max-body-bytes', type=int, default=env_int('CHATBOT_MAX_BODY_BYTES', 16 * 1024 * 1024),
+                        help='Largest request body accepted')
+    parser.add_argument('--max-requests', type=int, default=env_int('CHATBOT_MAX_REQUESTS', 0),
+                        help='Recycle a worker after this many requests (0 disables)')
+    parser.add_argument('--asgi', action='store_true', default=os.environ.get('CHATBOT_INTERFACE') == 'asgi',
+                        help='Serve the asyncio app (asgi_app:app) with uvicorn instead of gunicorn')
+    parser.add_argument('--preload-images', action=argparse.BooleanOptionalAction,
+                        default=os.environ.get('CHATBOT_PRELOAD_IMAGES', '1') != '0',
+                        help='Import Pillow and the image code at startup (--no-preload-images for text-only workers)')
+    return parser
+
+
+def serve(app, options, preload=None, on_worker_exit=None):
+    """Run the Flask app under gunicorn with preloaded, fork-shared state"""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise SystemExit('The serve command needs gunicorn (Linux/macOS): pip install gunicorn')
+
+    app.config['MAX_CONTENT_LENGTH'] = options.max_body_bytes
+
+    # Build everything once in the master so workers share it copy-on-write
+    if preload:
+        preload()
+    # Keep the GC from touching (and un-sharing) the preloaded objects in workers
+    gc.freeze()
+
+    config = {
+        'bind': f'{options.host}:{options.port}',
+        'workers': options.workers,
+        'threads': options.threads,
+        'worker_class': 'gthread',
+        'keepalive': options.keepalive,
+        'timeout': options.timeout,
+        'graceful_timeout': options.graceful_timeout,
+        'max_requests': options.max_requests,
+        'max_requests_jitter': options.max_requests // 10,
+        'preload_app': True,
+        'accesslog': '-'
+    }
+    if on_worker_exit:
+        config['worker_exit'] = lambda server, worker: on_worker_exit()
+
+    class ChatbotServer(BaseApplication):
+        def load_config(self):
+            for key, value in config.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    print(f"🏥 Serving AI Medical Chatbot API on http://{config['bind']} "
+          f"({options.workers} workers x {options.threads} threads)")
+    ChatbotServer().run()
+
+
+def serve_asgi(options):
+    """Run the asyncio app under uvicorn; idle keep-alive connections cost no threads"""
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit('The --asgi mode needs uvicorn: pip install uvicorn')
+
+    # Worker processes import asgi_app fresh and read their limits from the environment
+    os.environ['CHATBOT_MAX_BODY_BYTES'] = str(options.max_body_bytes)
+    os.environ['CHATBOT_PRELOAD_IMAGES'] = '1' if options.preload_images else '0'
+
+    print(f"🏥 Serving AI Medical Chatbot API (ASGI) on http://{options.host}:{options.port} "
+          f"({options.workers} workers)")
+    uvicorn.run(
+        'asgi_app:app',
+        host=options.host,
+        port=options.port,
+        workers=options.workers,
+        timeout_keep_alive=options.keepalive,
+        timeout_graceful_shutdown=options.graceful_timeout,
+        limit_max_requests=options.max_requests or None,
+        lifespan='on'
+    )
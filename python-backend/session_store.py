@@ -0,0 +1,144 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Ids are chosen by the client (e.g. crypto.randomUUID()); anything else is rejected
+SESSION_ID = re.compile(r'[A-Za-z0-9_-]{8,128}')
+
+# SQLite stores trim least recently used sessions every this many saves
+PRUNE_EVERY = 64
+
+
+def valid_session_id(session_id):
+    return isinstance(session_id, str) and SESSION_ID.fullmatch(session_id) is not None
+
+
+def new_session():
+    """Empty conversation record: recent turns, the topic follow-ups refer to, detected categories"""
+    return {'turns': [], 'topic': None, 'categories': []}
+
+
+class MemorySessionStore:
+    """Sessions held by this process: LRU-bounded, dropped after ttl seconds without activity"""
+
+    def __init__(self, max_sessions=10000, ttl=1800):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        """Return a session record, or None when it is unknown or idled out"""
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            accessed_at, record = entry
+            if accessed_at + self.ttl <= now:
+                del self._sessions[session_id]
+                return None
+            # Callers mutate their copy; the stored one only changes on save
+            return json.loads(record)
+
+    def save(self, session_id, record):
+        encoded = json.dumps(record)
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._sessions[session_id] = (time.time(), encoded)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'sessions': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'ttl': self.ttl
+            }
+
+
+class SQLiteSessionStore:
+    """Sessions in a SQLite file, so every worker process sees the same conversations"""
+
+    def __init__(self, path, max_sessions=10000, ttl=1800):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._db = None
+        self._db_pid = None
+        self._saves = 0
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        # SQLite connections must not cross a fork, so open one per process
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS sessions '
+                '(id TEXT PRIMARY KEY, record TEXT NOT NULL, accessed_at REAL NOT NULL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS sessions_accessed_at ON sessions (accessed_at)')
+            self._db_pid = os.getpid()
+        return self._db
+
+    def get(self, session_id):
+        with self._lock:
+            row = self._connection().execute(
+                'SELECT record FROM sessions WHERE id = ? AND accessed_at > ?', (session_id, time.time() - self.ttl)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, session_id, record):
+        now = time.time()
+        with self._lock:
+            db = self._connection()
+            db.execute(
+                'INSERT OR REPLACE INTO sessions (id, record, accessed_at) VALUES (?, ?, ?)',
+                (session_id, json.dumps(record), now)
+            )
+            self._saves += 1
+            if self._saves % PRUNE_EVERY == 0:
+                db.execute('DELETE FROM sessions WHERE accessed_at <= ?', (now - self.ttl,))
+                db.execute(
+                    'DELETE FROM sessions WHERE id NOT IN '
+                    '(SELECT id FROM sessions ORDER BY accessed_at DESC LIMIT ?)',
+                    (self.max_sessions,)
+                )
+            db.commit()
+
+    def delete(self, session_id):
+        with self._lock:
+            db = self._connection()
+            db.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+            db.commit()
+
+    def stats(self):
+        with self._lock:
+            count, = self._connection().execute(
+                'SELECT COUNT(*) FROM sessions WHERE accessed_at > ?', (time.time() - self.ttl,)
+            ).fetchone()
+        return {
+            'backend': 'sqlite',
+            'path': self.path,
+            'sessions': count,
+            'max_sessions': self.max_sessions,
+            'ttl': self.ttl
+        }
+
+
+def open_session_store(path=None, max_sessions=10000, ttl=1800):
+    """In-process store by default; a SQLite path shares sessions between workers"""
+    if path:
+        return SQLiteSessionStore(path, max_sessions, ttl)
+    return MemorySessionStore(max_sessions, ttl)
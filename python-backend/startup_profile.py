@@ -0,0 +1,73 @@
+import os
+import subprocess
+import sys
+import time
+
+# Top-level packages listed individually in the import report; the rest are summed into one line
+REPORTED_PACKAGES = 12
+
+# Packages that make up the image stack; none of them should be imported before the first image
+IMAGE_PACKAGES = ('PIL', 'color_stats', 'lesion_segmentation', 'perceptual_hash')
+
+
+def import_times(module, path):
+    """Import microseconds of module in a fresh interpreter: (total, {top-level package: self time})"""
+    # -X importtime reports 'self | cumulative | name' per imported module, nested by indentation
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=path, capture_output=True, text=True, check=True, env=dict(os.environ, PYTHONPATH=path)
+    )
+    total = 0
+    packages = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or line.endswith('imported package'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + int(self_us)
+        if name == module:
+            total = int(cumulative_us)
+    return total, packages
+
+
+def time_calls(calls):
+    """Seconds each named call takes, in order"""
+    timings = {}
+    for name, call in calls:
+        started = time.perf_counter()
+        call()
+        timings[name] = time.perf_counter() - started
+    return timings
+
+
+def profile_knowledge_base(knowledge_base):
+    """Seconds to load each section and then build or restore each index of the live snapshot"""
+    snapshot = knowledge_base.current()
+    sections = time_calls((name, lambda name=name: snapshot.section(name)) for name in snapshot.versions)
+    indexes = time_calls((name, lambda name=name: snapshot.index(name)) for name in knowledge_base.index_builders)
+    return sections, indexes, snapshot.summary()['prebuilt_indexes']
+
+
+def print_startup_profile(module, path, knowledge_base, load_image_stack):
+    """Print where a cold start of module spends its time: imports, knowledge base, indexes, image stack"""
+    total, packages = import_times(module, path)
+    print(f"📦 import {module}: {total / 1000:.0f}ms")
+    ranked = sorted(packages.items(), key=lambda item: -item[1])
+    for package, self_us in ranked[:REPORTED_PACKAGES]:
+        print(f"   {package:<28} {self_us / 1000:8.1f}ms")
+    rest = sum(self_us for _, self_us in ranked[REPORTED_PACKAGES:])
+    print(f"   {f'({len(ranked) - REPORTED_PACKAGES} others)':<28} {rest / 1000:8.1f}ms")
+    eager = [package for package in IMAGE_PACKAGES if package in packages]
+    print(f"   image stack imported eagerly: {', '.join(eager) if eager else 'no'}")
+
+    sections, indexes, prebuilt = profile_knowledge_base(knowledge_base)
+    print(f"📚 Knowledge base sections: {sum(sections.values()) * 1000:.0f}ms")
+    for name, seconds in sections.items():
+        print(f"   {name:<28} {seconds * 1000:8.1f}ms")
+    print(f"🔎 Indexes: {sum(indexes.values()) * 1000:.0f}ms")
+    for name, seconds in indexes.items():
+        print(f"   {name:<28} {seconds * 1000:8.1f}ms  {'restored' if name in prebuilt else 'built'}")
+
+    image_stack = time_calls([('image stack', load_image_stack)])['image stack']
+    print(f"🖼️  Image stack (first image, or preload): {image_stack * 1000:.0f}ms")
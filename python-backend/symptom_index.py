@@ -0,0 +1,141 @@
+import heapq
+
+import numpy as np
+
+from frozen_kb import pack_array, unpack_array
+
+# Same weights analyze_symptoms has always used
+SYMPTOM_WEIGHT = 3
+NAME_WEIGHT = 5
+CATEGORY_WEIGHT = 2
+
+
+class SymptomIndex:
+    """Inverted index from symptom, name and category terms to condition keys"""
+
+    # Stored as a sparse term x condition weight matrix in CSR form: term_rows maps a term to its
+    # row, and indptr[row]:indptr[row + 1] spans its conditions (columns, knowledge base order) and
+    # weights. A term that is, say, both a symptom and the name of a condition carries the sum.
+
+    def __init__(self, conditions):
+        self.conditions = conditions
+        self.condition_keys = list(conditions)
+
+        postings = {}
+        for column, condition_data in enumerate(conditions.values()):
+            for symptom in condition_data['symptoms']:
+                self._post(postings, symptom, column, SYMPTOM_WEIGHT)
+            self._post(postings, condition_data['name'].lower(), column, NAME_WEIGHT)
+            self._post(postings, condition_data['category'].lower(), column, CATEGORY_WEIGHT)
+
+        self.term_rows = {term: row for row, term in enumerate(postings)}
+        indptr = np.zeros(len(postings) + 1, dtype=np.int64)
+        np.cumsum([len(weights) for weights in postings.values()], out=indptr[1:])
+        self._set_matrix(
+            indptr,
+            np.array([column for weights in postings.values() for column in weights], dtype=np.int32),
+            np.array([weight for weights in postings.values() for weight in weights.values()], dtype=np.int32)
+        )
+
+    def _set_matrix(self, indptr, columns, weights):
+        self.indptr = indptr
+        self.columns = columns
+        self.weights = weights
+        # Memoryviews index straight to Python ints, far cheaper than NumPy scalars for a few postings
+        self._views = (memoryview(indptr), memoryview(columns), memoryview(weights))
+
+    def to_data(self):
+        """Terms and CSR arrays for a compiled knowledge base artifact"""
+        return {
+            'terms': list(self.term_rows),
+            'indptr': pack_array(self.indptr),
+            'columns': pack_array(self.columns),
+            'weights': pack_array(self.weights)
+        }
+
+    @classmethod
+    def from_data(cls, conditions, data):
+        """Restore an index saved by to_data() for the same conditions; the arrays stay in the artifact"""
+        index = cls.__new__(cls)
+        index.conditions = conditions
+        index.condition_keys = list(conditions)
+        index.term_rows = {term: row for row, term in enumerate(data['terms'])}
+        index._set_matrix(*(np.asarray(unpack_array(data[name])) for name in ('indptr', 'columns', 'weights')))
+        return index
+
+    @staticmethod
+    def _post(postings, term, column, weight):
+        weights = postings.setdefault(term, {})
+        weights[column] = weights.get(column, 0) + weight
+
+    @property
+    def terms(self):
+        return self.term_rows.keys()
+
+    def _result(self, column, score, terms):
+        condition_key = self.condition_keys[column]
+        condition_data = self.conditions[condition_key]
+        return {
+            'condition_key': condition_key,
+            'score': score,
+            'condition': condition_data,
+            'matched_symptoms': [s for s in condition_data['symptoms'] if s in terms]
+        }
+
+    def rank(self, terms, top_k=None):
+        """Score only conditions sharing a term with the message, best first"""
+        indptr, columns, weights = self._views
+        scores = {}
+        for term in terms:
+            row = self.term_rows.get(term)
+            if row is None:
+                continue
+            for entry in range(indptr[row], indptr[row + 1]):
+                column = columns[entry]
+                scores[column] = scores.get(column, 0) + weights[entry]
+
+        # Ties keep knowledge base order, matching the old max() over the dict
+        sort_key = lambda item: (-item[1], item[0])
+        if top_k is None:
+            ranked = sorted(scores.items(), key=sort_key)
+        else:
+            ranked = heapq.nsmallest(top_k, scores.items(), key=sort_key)
+        return [self._result(column, score, terms) for column, score in ranked]
+
+    def score_batch(self, term_sets):
+        """Nonzero message x condition scores as (rows, columns, scores) arrays, ordered by row then column"""
+        rows, counts = [], []
+        for terms in term_sets:
+            found = [self.term_rows[term] for term in terms if term in self.term_rows]
+            rows.extend(found)
+            counts.append(len(found))
+
+        # Sparse term incidence times the weight matrix: every (message, posting) pair, gathered
+        # without a Python loop, then summed per (message, condition)
+        term_rows = np.array(rows, dtype=np.int64)
+        starts = self.indptr[term_rows]
+        lengths = self.indptr[term_rows + 1] - starts
+        entries = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(int(lengths.sum()))
+        messages = np.repeat(np.repeat(np.arange(len(term_sets)), counts), lengths)
+
+        condition_count = len(self.condition_keys)
+        keys, inverse = np.unique(messages * condition_count + self.columns[entries], return_inverse=True)
+        scores = np.bincount(inverse, weights=self.weights[entries], minlength=len(keys)).astype(np.int64)
+        return keys // condition_count, keys % condition_count, scores
+
+    def rank_batch(self, term_sets, top_k=None):
+        """rank() for many messages at once, from one sparse score matrix; results are identical"""
+        rows, columns, scores = self.score_batch(term_sets)
+
+        # Best first within each message; ties keep knowledge base order, like rank()
+        order = np.lexsort((columns, -scores, rows))
+        rows, columns, scores = rows[order], columns[order], scores[order]
+        if top_k is not None:
+            ranks = np.arange(len(rows)) - np.searchsorted(rows, rows)
+            keep = ranks < top_k
+            rows, columns, scores = rows[keep], columns[keep], scores[keep]
+
+        results = [[] for _ in term_sets]
+        for row, column, score in zip(rows.tolist(), columns.tolist(), scores.tolist()):
+            results[row].append(self._result(column, score, term_sets[row]))
+        return results
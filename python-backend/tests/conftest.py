@@ -0,0 +1,42 @@
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+# The backend is a flat set of modules; make them importable however pytest is started
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def asgi_request():
+    """Call asgi_app.app once; returns (status, JSON body), or the raw text of an event stream"""
+    import asgi_app
+
+    def request(method, path, body=b'', content_type='application/json', query=b'', accept=b'application/json'):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        scope = {
+            'type': 'http', 'method': method, 'path': path, 'query_string': query,
+            'headers': [
+                (b'content-type', content_type.encode()),
+                (b'content-length', str(len(body)).encode()),
+                (b'accept', accept)
+            ]
+        }
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(asgi_app.app(scope, receive, send))
+        status = sent[0]['status']
+        body = b''.join(message.get('body', b'') for message in sent[1:])
+        return status, body.decode() if accept == b'text/event-stream' else json.loads(body)
+
+    return request
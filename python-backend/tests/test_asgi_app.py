@@ -0,0 +1,63 @@
+import io
+
+from PIL import Image
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.test import encode_multipart
+
+import chatbot_api
+
+
+def png_bytes(color=(200, 40, 40)):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def multipart(values):
+    fields = MultiDict()
+    for name, value in values.items():
+        for item in value if isinstance(value, list) else [value]:
+            if isinstance(item, tuple):
+                item = FileStorage(item[0], item[1], content_type='image/png')
+            fields.add(name, item)
+    boundary, body = encode_multipart(fields)
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def test_multipart_chat_matches_flask(asgi_request):
+    values = {'message': 'what is this?', 'image': (io.BytesIO(png_bytes()), 'photo.png')}
+    body, content_type = multipart(values)
+    status, reply = asgi_request('POST', '/api/chat', body, content_type)
+    assert status == 200
+    assert reply['hasImageAnalysis']
+
+    values['image'] = (io.BytesIO(png_bytes()), 'photo.png')
+    flask_reply = chatbot_api.app.test_client().post('/api/chat', data=values).get_json()
+    assert reply['response'] == flask_reply['response']
+
+
+def test_raw_image_chat(asgi_request):
+    status, reply = asgi_request('POST', '/api/chat', png_bytes(), 'image/png', query=b'message=rash')
+    assert status == 200
+    assert reply['hasImageAnalysis']
+
+
+def test_multipart_batch_images(asgi_request):
+    body, content_type = multipart({
+        'message': 'compare',
+        'images': [(io.BytesIO(png_bytes()), 'a.png'), (io.BytesIO(png_bytes((90, 60, 50))), 'b.png')]
+    })
+    status, reply = asgi_request('POST', '/api/analyze-images', body, content_type)
+    assert status == 200
+    assert reply['analyzed'] == 2
+
+
+def test_event_stream_with_session(asgi_request):
+    status, events = asgi_request(
+        'POST', '/api/chat', {'message': 'I have a fever', 'session_id': 'asgi-test-session'},
+        accept=b'text/event-stream'
+    )
+    assert status == 200
+    assert events.startswith('event: start')
+    assert 'event: done' in events
+    assert chatbot_api.SESSIONS.get('asgi-test-session')['topic']['message'] == 'I have a fever'
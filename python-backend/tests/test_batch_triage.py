@@ -0,0 +1,65 @@
+import json
+
+import batch_triage
+import chatbot_api
+
+
+def triage_body(messages):
+    return ''.join(json.dumps({'id': idx, 'message': message}) + '\n' for idx, message in enumerate(messages))
+
+
+def test_batches_reuse_one_forkserver_pool(monkeypatch):
+    monkeypatch.setattr(chatbot_api, 'TRIAGE_WORKERS', 2)
+    monkeypatch.setattr(chatbot_api, 'TRIAGE_CHUNK_SIZE', 3)
+    client = chatbot_api.app.test_client()
+    messages = ['I have a fever', 'itchy red bumps', 'burn with redness and pain', 'hello'] * 3
+
+    try:
+        for _ in range(2):
+            response = client.post(
+                '/api/analyze-symptoms/batch', data=triage_body(messages), content_type='application/x-ndjson'
+            )
+            lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+            assert [line['id'] for line in lines[:-1]] == list(range(len(messages)))
+            assert lines[-1]['summary']['messages'] == len(messages)
+
+        assert list(batch_triage._pools) == [(2, batch_triage.SERVER_START_METHOD)]
+    finally:
+        batch_triage.shutdown_triage_pools()
+
+
+def test_batch_bodies_have_their_own_cap(monkeypatch):
+    monkeypatch.setitem(chatbot_api.app.config, 'MAX_CONTENT_LENGTH', 64)
+    monkeypatch.setattr(chatbot_api, 'TRIAGE_MAX_BODY_BYTES', 1024)
+    monkeypatch.setattr(chatbot_api, 'TRIAGE_WORKERS', 1)
+    client = chatbot_api.app.test_client()
+    body = triage_body(['I have a fever'] * 5)
+
+    accepted = client.post('/api/analyze-symptoms/batch', data=body, content_type='application/x-ndjson')
+    assert accepted.status_code == 200
+    assert json.loads(accepted.get_data(as_text=True).splitlines()[-1])['summary']['messages'] == 5
+
+    refused = client.post('/api/analyze-symptoms/batch', data=body * 10, content_type='application/x-ndjson')
+    assert refused.status_code == 413
+    assert refused.get_json()['error'] == 'Request body exceeds 1024 bytes'
+    assert client.post('/api/chat', json={'message': 'fever ' * 20}).status_code == 413
+
+
+def test_asgi_batch_bodies_have_their_own_cap(monkeypatch, asgi_request):
+    import asgi_app
+
+    monkeypatch.setattr(asgi_app, 'MAX_BODY_BYTES', 64)
+    monkeypatch.setattr(asgi_app, 'TRIAGE_MAX_BODY_BYTES', 1024)
+    monkeypatch.setitem(asgi_app.BODY_LIMITS, '/api/analyze-symptoms/batch', 1024)
+    monkeypatch.setattr(chatbot_api, 'TRIAGE_WORKERS', 1)
+    body = triage_body(['I have a fever'] * 5).encode()
+
+    # The event-stream accept header only makes the fixture hand back the raw JSONL
+    _, lines = asgi_request(
+        'POST', '/api/analyze-symptoms/batch', body, 'application/x-ndjson', accept=b'text/event-stream'
+    )
+    assert json.loads(lines.splitlines()[-1])['summary']['messages'] == 5
+
+    status, refused = asgi_request('POST', '/api/analyze-symptoms/batch', body * 10, 'application/x-ndjson')
+    assert (status, refused['error']) == (413, 'Request body exceeds 1024 bytes')
+    assert asgi_request('POST', '/api/chat', {'message': 'fever ' * 20})[0] == 413
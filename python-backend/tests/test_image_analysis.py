@@ -0,0 +1,89 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+import image_analysis
+from image_analysis import ANALYSIS_MAX_SIDE, load_reduced, measure_image
+
+# Three small bites that barely move the perceptual hash of the skin around them
+BITES = [(300, 300), (330, 310), (360, 320)]
+
+
+def encoded(width, height, fmt):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), (190, 120, 110)).save(buffer, fmt)
+    buffer.seek(0)
+    return buffer
+
+
+@pytest.mark.parametrize('width, height, fmt', [
+    (4032, 3024, 'JPEG'),
+    (1023, 700, 'PNG'),
+    (513, 513, 'PNG'),
+    (3000, 400, 'PNG')
+])
+def test_reduced_image_fits_analysis_size(width, height, fmt):
+    image, original_width, original_height = load_reduced(encoded(width, height, fmt))
+    assert (original_width, original_height) == (width, height)
+    assert max(image.size) <= ANALYSIS_MAX_SIDE
+    assert max(image.size) > ANALYSIS_MAX_SIDE // 2
+
+
+def test_small_image_is_not_reduced():
+    image, _, _ = load_reduced(encoded(300, 200, 'PNG'))
+    assert image.size == (300, 200)
+
+
+def skin_photo(bites=(), quality=90):
+    """Shaded skin JPEG with enough texture for a perceptual hash to tell it apart"""
+    rng = np.random.default_rng(0)
+    rows, columns = np.mgrid[0:600, 0:800]
+    shade = 20 * np.sin(columns / 37.0) * np.cos(rows / 53.0)
+    pixels = np.array([224, 172, 150], dtype=np.float32) + shade[..., None] + rng.normal(0, 4, (600, 800, 3))
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    draw = ImageDraw.Draw(image)
+    for x, y in bites:
+        draw.ellipse((x - 6, y - 6, x + 6, y + 6), fill=(200, 60, 60))
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality)
+    buffer.seek(0)
+    return buffer
+
+
+@pytest.fixture
+def near_duplicates():
+    image_analysis.load_image_stack()
+    image_analysis.clear_near_duplicates()
+    yield
+    image_analysis.clear_near_duplicates()
+
+
+def test_recompressed_copy_skips_measurement(near_duplicates, monkeypatch):
+    original = measure_image(skin_photo())
+
+    def fail(image):
+        raise AssertionError('near-duplicate was measured again')
+    monkeypatch.setattr('color_stats.compute_color_stats', fail)
+    monkeypatch.setattr('lesion_segmentation.segment_lesions', fail)
+    copy = measure_image(skin_photo(quality=60))
+
+    assert copy['condition_key'] == original['condition_key']
+    assert copy['analysis']['near_duplicate']['perceptual_hash'] == original['analysis']['perceptual_hash']
+
+
+def test_same_skin_with_bites_is_measured_on_its_own(near_duplicates):
+    plain = measure_image(skin_photo())
+    bitten = measure_image(skin_photo(BITES))
+
+    assert plain['analysis']['perceptual_hash'] == bitten['analysis']['perceptual_hash']
+    assert 'near_duplicate' not in bitten['analysis']
+    assert bitten['analysis']['lesions']['count'] == 3
+    assert bitten['condition_key'] == 'bedbug_bite'
+
+
+def test_flat_images_are_not_matched(near_duplicates):
+    measure_image(encoded(800, 600, 'PNG'))
+    assert 'near_duplicate' not in measure_image(encoded(800, 600, 'JPEG'))['analysis']
+    assert image_analysis.near_duplicate_stats()['entries'] == 0
@@ -0,0 +1,55 @@
+import pytest
+
+import chatbot_api
+
+
+def condition_name(message):
+    match = chatbot_api.analyze_symptoms(message)
+    return match and match['condition']['name']
+
+
+def test_burn_is_not_a_burning_sensation():
+    # 'burning' is a Contact Dermatitis symptom; stemming it to 'burn' used to tie the two
+    assert condition_name('burn with redness and pain') == 'First-Degree Burn'
+    assert condition_name('I burned my hand, redness and pain') == 'First-Degree Burn'
+
+
+def test_burning_still_matches_rash_symptoms():
+    assert condition_name('burning and itching with redness') == 'Contact Dermatitis'
+
+
+def cache_key(message):
+    kb = chatbot_api.KNOWLEDGE_BASE.current()
+    tokens = kb.index('text_normalizer').content_tokens(message)
+    return chatbot_api.query_key(message, tokens, chatbot_api.find_keywords(message, kb))
+
+
+def test_cache_key_uses_normalized_tokens():
+    assert cache_key('What should I do for a fever?') == cache_key('fever what to do')
+    assert cache_key('my rash is itchy') == cache_key('itchy rashes')
+
+
+def test_retrieval_sees_stems_and_synonyms():
+    # 'nervous' only reaches anxiety through the lexicon
+    retrieval = chatbot_api.KNOWLEDGE_BASE.current().index('retrieval')
+    assert retrieval.rank('feeling nervous lately', 'category', 1)[0][0] == 'mental_health'
+
+
+def test_category_fallback_needs_a_whole_token():
+    # 'painting' shares the n-grams of 'pain' but is a different word
+    assert chatbot_api.rank_question_categories('painting my room') == []
+    assert chatbot_api.detect_question_category('painting my room') is None
+    retrieval = chatbot_api.KNOWLEDGE_BASE.current().index('retrieval')
+    assert retrieval.rank('feeling nervous lately', 'category', 1, token_match=True)[0][0] == 'mental_health'
+
+
+@pytest.mark.parametrize('session_id, reply, follow_up', [
+    ('follow-up-thanks', 'thanks', False),
+    ('follow-up-ok', 'ok got it', False),
+    ('follow-up-kids', 'what about for kids?', True)
+])
+def test_acknowledgements_are_not_follow_ups(session_id, reply, follow_up):
+    client = chatbot_api.app.test_client()
+    client.post('/api/chat', json={'message': 'I have a fever', 'session_id': session_id})
+    client.post('/api/chat', json={'message': reply, 'session_id': session_id})
+    assert chatbot_api.SESSIONS.get(session_id)['turns'][-1]['follow_up'] is follow_up
@@ -0,0 +1,59 @@
+import base64
+import io
+
+import pytest
+from PIL import Image
+
+import chatbot_api
+
+
+def png_bytes():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), (200, 40, 40)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def client():
+    return chatbot_api.app.test_client()
+
+
+@pytest.mark.parametrize('body', [
+    {'message': 123},
+    {'message': None},
+    {'message': 'hi', 'session_id': 42},
+    {'message': 'hi', 'image': ['data:image/png;base64,']}
+])
+def test_chat_refuses_non_string_fields(client, body):
+    response = client.post('/api/chat', json=body)
+    assert response.status_code == 422
+    assert response.get_json()['reason'] == 'invalid_field_type'
+
+
+def test_chat_accepts_null_image_and_session(client):
+    response = client.post('/api/chat', json={'message': 'I have a fever', 'image': None, 'session_id': None})
+    assert response.status_code == 200
+    assert response.get_json()['success']
+
+
+@pytest.mark.parametrize('symptoms', [None, 7, {'text': 'rash'}])
+def test_analyze_symptoms_refuses_non_string_symptoms(client, symptoms):
+    response = client.post('/api/analyze-symptoms', json={'symptoms': symptoms})
+    assert response.status_code == 422
+    assert response.get_json()['reason'] == 'invalid_field_type'
+
+
+def test_asgi_chat_refuses_non_string_message(asgi_request):
+    status, body = asgi_request('POST', '/api/chat', {'message': None})
+    assert status == 422
+    assert body['reason'] == 'invalid_field_type'
+
+
+@pytest.mark.parametrize('entry', [1, None, {'image': 'x'}])
+def test_batch_images_refuse_non_string_entries_per_item(client, entry):
+    url = 'data:image/png;base64,' + base64.b64encode(png_bytes()).decode()
+    response = client.post('/api/analyze-images', json={'images': [url, entry]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['analyzed'] == 1
+    assert body['results'][1]['reason'] == 'invalid_image'
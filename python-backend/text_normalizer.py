@@ -0,0 +1,118 @@
+import re
+from functools import lru_cache
+from itertools import chain
+
+WORD = re.compile(r'[a-z0-9]+')
+VOWEL = re.compile(r'[aeiouy]')
+
+# Filler words dropped from retrieval queries and cache keys
+STOPWORDS = frozenset("""
+a about am an and any are as at be been being but by can could d did do does doing for from get got
+had has have having hello hey hi how i if im in into is it its just ll m me my myself of on or our
+please re s should so some t tell than thank thanks that the their them then there these they this
+to too ve very was we were what whats when where which while who why will with would you your
+""".split())
+
+# Tried in order, first match only; the identity rules keep 'stress', 'virus', 'psoriasis'
+# and 'bleed' from losing their endings
+SUFFIXES = (
+    ('ss', 'ss'), ('us', 'us'), ('is', 'is'), ('eed', 'eed'),
+    ('ies', 'y'), ('ied', 'y'), ('ing', ''), ('ed', ''), ('ful', ''), ('s', '')
+)
+
+
+@lru_cache(maxsize=65536)
+def stem(word):
+    """Light suffix stripping so plurals, -ing/-ed forms and -ful adjectives share one stem"""
+    if len(word) <= 3 or not word.isalpha():
+        return word
+
+    for suffix, replacement in SUFFIXES:
+        if word.endswith(suffix):
+            base = word[:len(word) - len(suffix)] + replacement
+            if len(base) >= 3 and VOWEL.search(base):
+                word = base
+            break
+
+    # 'cutting' -> 'cut', but 'swell', 'stress' and 'fizz' keep their pair
+    if len(word) > 3 and word[-1] == word[-2] and word[-1] not in 'aeiouylsz':
+        word = word[:-1]
+    # 'bite'/'biting' and 'sneeze'/'sneezing' meet at 'bit' and 'sneez'
+    if len(word) > 3 and word.endswith('e') and not word.endswith('ee'):
+        word = word[:-1]
+    return word
+
+
+class TextNormalizer:
+    """Turns text into normalized tokens: lowercased words, stemmed, with lexicon synonyms applied"""
+
+    def __init__(self, synonyms=None, keep=()):
+        # Words in keep are never stemmed, for forms whose stem means something else:
+        # a 'burning' sensation is not a 'burn'
+        self.keep = frozenset(word.lower() for word in keep)
+
+        # Synonym sources and replacements are stemmed too, so 'throwing up' covers 'throw up'
+        self.word_synonyms = {}
+        self.phrase_synonyms = {}
+        for source, replacement in (synonyms or {}).items():
+            source_tokens = tuple(map(self.stem, WORD.findall(source.lower())))
+            replacement_tokens = tuple(map(self.stem, WORD.findall(replacement.lower())))
+            if len(source_tokens) == 1:
+                self.word_synonyms[source_tokens[0]] = replacement_tokens
+            elif source_tokens:
+                self.phrase_synonyms[source_tokens] = replacement_tokens
+
+        # Compared after stemming, since that is the form tokens() returns
+        self.stopwords = frozenset(map(self.stem, STOPWORDS))
+
+        self.phrase_starts = frozenset(source[0] for source in self.phrase_synonyms)
+        self.longest_phrase = max(map(len, self.phrase_synonyms), default=0)
+        self._word_tokens = {}
+        self._phrase_words = set()
+
+    def stem(self, word):
+        return word if word in self.keep else stem(word)
+
+    def word_tokens(self, word):
+        """Tokens of one lowercase word; computed once per distinct word"""
+        stemmed = self.stem(word)
+        tokens = self.word_synonyms.get(stemmed, (stemmed,))
+        if stemmed in self.phrase_starts:
+            self._phrase_words.add(word)
+        # Bounded so adversarial input cannot grow the table without limit
+        if len(self._word_tokens) < 65536:
+            self._word_tokens[word] = tokens
+        return tokens
+
+    def tokens(self, text):
+        """Normalized token tuple of a text, with multi-word synonyms replaced longest first"""
+        words = WORD.findall(text.lower())
+        try:
+            parts = list(map(self._word_tokens.__getitem__, words))
+        except KeyError:
+            parts = [self.word_tokens(word) for word in words]
+        if self._phrase_words.isdisjoint(words):
+            return tuple(chain.from_iterable(parts))
+
+        stems = list(map(self.stem, words))
+        tokens = []
+        idx = 0
+        while idx < len(words):
+            replacement = None
+            if stems[idx] in self.phrase_starts:
+                for length in range(min(self.longest_phrase, len(words) - idx), 1, -1):
+                    replacement = self.phrase_synonyms.get(tuple(stems[idx:idx + length]))
+                    if replacement is not None:
+                        break
+            if replacement is None:
+                replacement, length = parts[idx], 1
+            tokens.extend(replacement)
+            idx += length
+        return tuple(tokens)
+
+    def content_tokens(self, text):
+        """Normalized tokens of a text without stopwords"""
+        return self.without_stopwords(self.tokens(text))
+
+    def without_stopwords(self, tokens):
+        return [token for token in tokens if token not in self.stopwords]
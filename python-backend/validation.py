@@ -0,0 +1,56 @@
+import json
+
+
+class RequestRejected(Exception):
+    """A request refused before any real work is done on it, with the HTTP status of the reply"""
+
+    def __init__(self, message, status=422, reason='invalid_request'):
+        # Every field goes to Exception so rejections survive pickling out of pool workers
+        super().__init__(message, status, reason)
+        self.message = message
+        self.status = status
+        self.reason = reason
+
+    def __str__(self):
+        return self.message
+
+    def result(self):
+        """Body and status of the error reply; 'error' stays the human-readable message"""
+        return {'success': False, 'error': self.message, 'reason': self.reason}, self.status
+
+
+def body_too_large(limit):
+    return RequestRejected(f'Request body exceeds {limit} bytes', 413, 'body_too_large')
+
+
+def check_content_length(value, limit):
+    """Refuse a body whose declared length is over the cap before reading any of it"""
+    if value is None:
+        return
+    try:
+        length = int(value)
+    except ValueError:
+        raise RequestRejected('Content-Length must be an integer', 400, 'invalid_content_length')
+    if length > limit:
+        raise body_too_large(limit)
+
+
+def parse_json_object(body):
+    """Decode a JSON request body that must be an object"""
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise RequestRejected('Request body must be valid JSON', 400, 'invalid_json')
+    if not isinstance(data, dict):
+        raise RequestRejected('Request body must be a JSON object', 422, 'invalid_json')
+    return data
+
+
+def string_field(data, name, default='', nullable=False):
+    """A field of a JSON request object that must be a string; missing (or null, if nullable) gives default"""
+    value = data.get(name)
+    if name not in data or (value is None and nullable):
+        return default
+    if not isinstance(value, str):
+        raise RequestRejected(f'{name} must be a string', 422, 'invalid_field_type')
+    return value
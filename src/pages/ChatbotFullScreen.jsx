@@ -25,6 +25,8 @@ const ChatbotFullScreen = () => {
     { id: 1, title: 'Medical Consultation', date: 'Today' }
   ]);
   const [currentConversationId, setCurrentConversationId] = useState(1);
+  // The server keeps recent turns per session, so follow-ups need no history or re-attached image
+  const [sessionId, setSessionId] = useState(() => crypto.randomUUID());
   
   const messagesEndRef = useRef(null);
   const fileInputRef = useRef(null);
@@ -113,31 +115,77 @@ Quick access to life-saving information and when to seek immediate care
     setIsLoading(true);
 
     try {
-      const response = await fetch('http://localhost:5000/api/chat', {
+      const response = await fetch('http://localhost:5000/api/chat/stream', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'Accept': 'text/event-stream',
         },
         body: JSON.stringify({
           message: inputMessage,
-          image: selectedImage
+          image: selectedImage,
+          session_id: sessionId
         })
       });
 
-      const data = await response.json();
-
-      if (data.success) {
-        const aiMessage = {
-          type: 'ai',
-          content: data.response,
-          timestamp: data.timestamp,
-          hasImageAnalysis: data.hasImageAnalysis,
-          confidence: data.hasImageAnalysis ? 92 : 88
-        };
-        setMessages(prev => [...prev, aiMessage]);
-      } else {
+      if (!response.ok || !response.body) {
+        const data = await response.json().catch(() => ({}));
         throw new Error(data.error || 'Failed to get response');
       }
+
+      // Render each section as soon as the server sends it
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let started = false;
+
+      const updateAiMessage = (update) => {
+        setMessages(prev => {
+          const next = [...prev];
+          next[next.length - 1] = { ...next[next.length - 1], ...update(next[next.length - 1]) };
+          return next;
+        });
+      };
+
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+          const rawEvent = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+
+          let eventName = 'message';
+          let payload = '';
+          for (const line of rawEvent.split('\n')) {
+            if (line.startsWith('event: ')) eventName = line.slice(7);
+            else if (line.startsWith('data: ')) payload += line.slice(6);
+          }
+          const data = JSON.parse(payload);
+
+          if (eventName === 'start') {
+            started = true;
+            setIsLoading(false);
+            setMessages(prev => [...prev, {
+              type: 'ai',
+              content: '',
+              timestamp: data.timestamp,
+              hasImageAnalysis: data.hasImageAnalysis,
+              confidence: data.hasImageAnalysis ? 92 : 88
+            }]);
+          } else if (eventName === 'error') {
+            throw new Error(data.error || 'Failed to get response');
+          } else if (data.delta) {
+            updateAiMessage(message => ({ content: message.content + data.delta }));
+          }
+        }
+      }
+
+      if (!started) {
+        throw new Error('Failed to get response');
+      }
     } catch (error) {
       console.error('Error:', error);
       const errorMessage = {
@@ -178,6 +226,7 @@ I'm having trouble connecting to the medical AI server. Please ensure:
     };
     setConversations([newConv, ...conversations]);
     setCurrentConversationId(newConv.id);
+    setSessionId(crypto.randomUUID());
     setMessages([]);
   };
 